@@ -1,977 +1,613 @@
-import argparse
-import concurrent.futures
-import json
-import os
-import re
-
-import folium
-import requests
-import yaml
-from google.protobuf.message import DecodeError
-from rich import print
-from rich._emoji_codes import EMOJI
-from rich.console import Console
-from rich.table import Table
-
-emoji_list = ['cd', 'ab', 'ox', 'wc', 'cl', 'id', 'sa', 'vs', 'o2', 'on', 'tm']
-for emj in emoji_list:
-    del EMOJI[emj]
-# import the BSSIDResp protobuf message from the BSSIDApple_pb2 module
-from helpers.BSSIDApple_pb2 import BSSIDResp
-
-console = Console()
-requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
-
-
-def banner():
-    print("""
-   ██████╗ ███████╗ ██████╗   ██╗    ██╗     ███████╗ 
-  ██╔════╝ ██╔════╝██╔═══██╗  ██║    ██║ ██╗ ██╔════╝ ██╗
-  ██║  ███╗█████╗  ██║   ██║  ██║ █╗ ██║ ██║ █████╗   ██║
-  ██║   ██║██╔══╝  ██║   ██║  ██║███╗██║ ██║ ██╔══╝   ██║
-  ╚██████╔╝███████╗╚██████╔╝  ╚███╔███╔╝ ██║ ██║      ██║
-   ╚═════╝ ╚══════╝ ╚═════╝    ╚══╝╚══╝  ╚═╝ ╚═╝      ╚═╝ :earth_africa:[bold medium_purple1 italic]by GOΠZO[/bold medium_purple1 italic]                          
-""")
-
-
-def read_config():
-    """Loads the configuration data from config.yaml file.
-
-    Returns:
-        dict: A dictionary containing the configuration data.
-    """
-    try:
-        # Open the config.yaml file in read mode
-        with open('gw_utils/config.yaml', 'r') as config_file:
-            # Parse the contents of the file into a dictionary
-            parsed_config = yaml.safe_load(config_file)
-            return parsed_config
-    except FileNotFoundError:
-        # Return an error message if the file is not found
-        return {'error': 'config.yaml file not found'}
-    except yaml.YAMLError:
-        # Return an error message if there is an error parsing the file
-        return {'error': 'Error parsing config.yaml file'}
-
-
-def wigle_ssid(ssid_param):
-    """Searches for a network with a specific SSID in the Wigle database.
-
-    Parameters:
-        ssid_param (str): The SSID of the network to search for.
-
-    Returns:
-        list: A list of dictionaries, each containing information about a network. If an error occurred, the list will contain a single dictionary with an error message.
-    """
-    # Load the configuration data from the config.yaml file
-    parsed_config = read_config()
-    # Get the Wigle API key from the configuration data
-    api_key = parsed_config.get('wigle_auth')
-    # Set the headers for the request
-    headers = {
-        'accept': 'application/json',
-        'Authorization': f'Basic {api_key}'
-    }
-    # Set the parameters for the request
-    params = {'ssid': ssid_param}
-    # Set the endpoint for the request
-    endpoint = 'https://api.wigle.net/api/v2/network/search'
-    try:
-        # Send the GET request
-        response = requests.get(
-            endpoint,
-            headers=headers,
-            params=params,
-            # Disable SSL verification if specified in the configuration data
-            verify=not parsed_config.get('no-ssl-verify', False)
-        )
-        # If the request is successful
-        if response.json()['success']:
-            # If the request is successful
-            if response.json()['totalResults'] != 0:
-                # Get the results from the response
-                results = response.json()['results']
-                # Create a list of dictionaries containing the data
-                data = [{
-                    'module': 'wigle',
-                    'bssid': result.get('netid', ''),
-                    'ssid': result.get('ssid', ''),
-                    'latitude': result.get('trilat', ''),
-                    'longitude': result.get('trilong', '')
-                } for result in results]
-                return data
-            else:
-                # Return an error message if the request is not successful
-                return {
-                    'module': 'wigle',
-                    'error': 'No results detected'
-                }
-        else:
-            # Return an error message if the request is not successful
-            return {
-                'module': 'wigle',
-                'error': response.json()['message']
-            }
-    except Exception as e:
-        # Return an error message if an exception occurs
-        return {
-            'module': 'wigle',
-            'error': str(e)
-        }
-
-
-def wifidb_ssid(ssid_param):
-    """Searches for a network with a specific SSID in the wifidb database.
-
-    Parameters:
-        ssid_param (str): The SSID of the network to search for.
-
-    Returns:
-        list: A list of dictionaries, each containing information about a network. If an error occurred, the list will contain a single dictionary with an error message.
-    """
-    # Load the configuration data from the config.yaml file
-    parsed_config = read_config()
-    # Set the parameters for the request
-    params = {
-        'func': 'exp_search',
-        'ssid': ssid_param,
-        'mac': '',
-        'radio': '',
-        'chan': '',
-        'auth': '',
-        'encry': '',
-        'sectype': '',
-        'json': 0,
-        'labeled': 0
-    }
-    # Set the endpoint for the request
-    endpoint = 'https://wifidb.net/wifidb/api/geojson.php'
-    try:
-        # Send the GET request
-        response = requests.get(
-            endpoint,
-            params=params,
-            # Disable SSL verification if specified in the configuration data
-            verify=not parsed_config.get('no-ssl-verify', False)
-        )
-        # If the request is successful
-        if response.status_code == 200:
-            # Get the results from the response
-            results = response.json()['features']
-            # Check if the SSID is in the results
-            if len(results) > 0:
-                # Create a list of dictionaries containing the data
-                data = [{
-                    'module': 'wifidb',
-                    'bssid': result['properties']['mac'],
-                    'ssid': result['properties']['ssid'],
-                    'latitude': result['properties']['lat'],
-                    'longitude': result['properties']['lon']
-                } for result in results]
-                return data
-            else:
-                # Return an error message if the SSID is not in the results
-                return {
-                    'module': 'wifidb',
-                    'error': 'SSID not found'
-                }
-        else:
-            # Return an error message if the request is not successful
-            return {
-                'module': 'wifidb',
-                'error': 'Request failed'
-            }
-    except Exception as e:
-        # Return an error message if an exception occurs
-        return {
-            'module': 'wifidb',
-            'error': str(e)
-        }
-
-
-def openwifimap_ssid(ssid_param):
-    """Searches for a node with a specific SSID in the openwifimap.net database.
-
-    Parameters:
-        ssid_param (str): The SSID of the node to search for.
-
-    Returns:
-        dict: A dictionary containing information about the node, or an error message if an error occurred.
-    """
-    # Load the configuration data from the config.yaml file
-    parsed_config = read_config()
-    # Set the endpoint for the request
-    endpoint = 'https://api.openwifimap.net/view_nodes'
-    # Set the headers for the request
-    headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
-    # Set the request body
-    data = {'keys': [ssid_param]}
-    try:
-        # Send the POST request
-        response = requests.post(
-            endpoint,
-            headers=headers,
-            json=data,
-            # Disable SSL verification if specified in the configuration data
-            verify=not parsed_config.get('no-ssl-verify', False)
-        )
-        # If the request is successful
-        if response.status_code == 200:
-            # Get the results from the response
-            results = response.json()['rows']
-            # If there are no results, return an error message
-            if not results:
-                return {
-                    'module': 'openwifimap',
-                    'error': f'No node found with SSID "{ssid_param}"'
-                }
-            # Extract the relevant fields from the first result
-            result = results[0]['value']
-            # Create the output dictionary using a dictionary comprehension
-            data = {
-                'module': 'openwifimap',
-                'ssid': ssid_param,
-                'hostname': result['hostname'],
-                'latitude': result['latlng'][0],
-                'longitude': result['latlng'][1]
-            }
-            return data
-        else:
-            # Return the error message if the request is not successful
-            return {
-                'module': 'openwifimap',
-                'error': f'Request to openwifimap.net failed with status code {response.status_code}'
-            }
-    except Exception as e:
-        # Return an error message if an exception occurs
-        return {
-            'module': 'openwifimap',
-            'error': str(e)
-        }
-
-
-def freifunk_karte_ssid(ssid_param):
-    """Searches for a network with a specific SSID in the freifunk-karte.de database.
-
-    Parameters:
-        ssid_param (str): The SSID of the network to search for.
-
-    Returns:
-        dict: A dictionary containing information about the network, or an error message if an error occurred.
-    """
-    # Load the configuration data from the config.yaml file
-    parsed_config = read_config()
-    # Set the endpoint for the request
-    endpoint = 'https://www.freifunk-karte.de/data.php'
-    try:
-        # Send the GET request
-        response = requests.get(
-            endpoint,
-            # Disable SSL verification if specified in the configuration data
-            verify=not parsed_config.get('no-ssl-verify', False)
-        )
-        # If the request is successful
-        if response.status_code == 200:
-            # Get the results from the response
-            results = response.json()['allTheRouters']
-            # Check if the SSID is in the results
-            for result in results:
-                if result['name'] == ssid_param:
-                    # Extract the relevant fields from the result
-                    data = {
-                        'module': 'freifunk-karte',
-                        'ssid': result['name'],
-                        'latitude': result['lat'],
-                        'longitude': result['long'],
-                        'community': result['community'],
-                    }
-                    return data
-            # If the SSID is not in the results, return an error message
-            return {
-                'module': 'freifunk-karte',
-                'error': 'SSID not found'
-            }
-        else:
-            # Return an error message if the request is not successful
-            return {
-                'module': 'freifunk-karte',
-                'error': 'Request failed'
-            }
-    except Exception as e:
-        # Return an error message if an exception occurs
-        return {
-            'module': 'freifunk-karte',
-            'error': str(e)
-        }
-
-
-def wigle_bssid(bssid_param):
-    """Searches for a network with a specific BSSID in the Wigle database.
-
-    Parameters:
-        bssid_param (str): The BSSID of the network to search for.
-
-    Returns:
-        list: A list of dictionaries, each containing information about a network. If an error occurred, the list will contain a single dictionary with an error message.
-    """
-    # Load the configuration data from the config.yaml file
-    parsed_config = read_config()
-    # Get the Wigle API key from the configuration data
-    api_key = parsed_config.get('wigle_auth')
-    # Set the headers for the request
-    headers = {
-        'accept': 'application/json',
-        'Authorization': f'Basic {api_key}'
-    }
-    # Set the parameters for the request
-    params = {'netid': bssid_param}
-    # Set the endpoint for the request
-    endpoint = 'https://api.wigle.net/api/v2/network/search'
-    try:
-        # Send the GET request
-        response = requests.get(
-            endpoint,
-            headers=headers,
-            params=params,
-            # Disable SSL verification if specified in the configuration data
-            verify=not parsed_config.get('no-ssl-verify', False)
-        )
-        # If the request is successful
-        if response.json()['success']:
-            # If the request is successful
-            if response.json()['totalResults'] != 0:
-                # Get the results from the response
-                results = response.json()['results']
-                # Create a list of dictionaries containing the data
-                data = [{
-                    'module': 'wigle',
-                    'bssid': result.get('netid', ''),
-                    'ssid': result.get('ssid', ''),
-                    'latitude': result.get('trilat', ''),
-                    'longitude': result.get('trilong', '')
-                } for result in results]
-                return data
-            else:
-                # Return an error message if the request is not successful
-                return {
-                    'module': 'wigle',
-                    'error': 'No results detected'
-                }
-        else:
-            # Return an error message if the request is not successful
-            return {
-                'module': 'wigle',
-                'error': response.json()['message']
-            }
-    except Exception as e:
-        # Return an error message if an exception occurs
-        return {
-            'module': 'wigle',
-            'error': str(e)
-        }
-
-
-def mylnikov_bssid(bssid_param):
-    """Searches for a network with a specific BSSID in the mylnikov database.
-
-    Parameters:
-        bssid_param (str): The BSSID of the network to search for.
-
-    Returns:
-        dict: A dictionary containing information about the network, or an error message if an error occurred.
-    """
-
-    # Read the configuration from the config.yaml file
-    parsed_config = read_config()
-
-    # Set up the HTTP headers
-    headers = {
-        'accept': 'application/json',
-        'Content-Type': 'application/x-www-form-urlencoded'
-    }
-
-    # Set up the query parameters with the BSSID
-    params = {'bssid': bssid_param}
-
-    # Set the endpoint for the request
-    endpoint = 'https://api.mylnikov.org/geolocation/wifi?v=1.1&data=open'
-    # Make the HTTP POST request to the mylnikov API
-    try:
-        # Send the POST request
-        response = requests.post(
-            endpoint,
-            headers=headers,
-            params=params,
-            # Disable SSL verification if specified in the configuration data
-            verify=not parsed_config.get('no-ssl-verify', False)
-        )
-        # Check if the request was successful
-        if response.json()['result'] == 200:
-            # Extract the relevant fields from the response
-            result = response.json()['data']
-            # Create the output dictionary using a dictionary comprehension
-            data = {
-                'module': 'mylnikov',
-                'bssid': bssid_param,
-                'latitude': result['lat'],
-                'longitude': result['lon']
-            }
-            return data
-        else:
-            # Return the error message in a dictionary
-            return {
-                'module': 'mylnikov',
-                'error': response.json()['desc']
-            }
-    except Exception as e:
-        # Return the exception message in a dictionary
-        return {
-            'module': 'wigle',
-            'error': str(e)
-        }
-
-
-def apple_bssid(bssid_param):
-    """Searches for a network with a specific BSSID in the Apple database.
-
-    Parameters:
-        bssid_param (str): The BSSID of the network to search for.
-
-    Returns:
-        dict: A dictionary containing information about the network, or an error message if an error occurred.
-    """
-    # Read the configuration from the config.yaml file
-    parsed_config = read_config()
-
-    # Set up the HTTP headers
-    headers = {
-        'Content-Type': 'application/x-www-form-urlencoded',
-        'Accept': '*/*',
-        'Accept-Charset': 'utf-8',
-        'Accept-Encoding': 'gzip, deflate',
-        'Accept-Language': 'en-us',
-        'User-Agent': 'locationd/1753.17 CFNetwork/711.1.12 Darwin/14.0.0'
-    }
-
-    # Set up the POST data
-    data_bssid = f'\x12\x13\n\x11{bssid_param}\x18\x00\x20\01'
-    data = '\x00\x01\x00\x05en_US\x00\x13com.apple.locationd\x00\x0a' + '8.1.12B411\x00\x00\x00\x01\x00\x00\x00' + chr(
-        len(data_bssid)) + data_bssid
-    # Set the endpoint for the request
-    endpoint = 'https://gs-loc.apple.com/clls/wloc'
-    # Make the HTTP POST request using the requests library
-    response = requests.post(
-        endpoint,
-        headers=headers,
-        data=data,
-        verify=not parsed_config.get('no-ssl-verify', False))
-
-    # Parse the binary content of the response into a BSSIDResp protobuf object.
-    bssid_response = BSSIDResp()
-    try:
-        bssid_response.ParseFromString(response.content[10:])
-    except DecodeError as e:
-        return f'Failed to decode response: {e}'
-    lat_match = re.search(r'lat: (\S*)', str(bssid_response))
-    lon_match = re.search(r'lon: (\S*)', str(bssid_response))
-    try:
-        # Extract the latitude and longitude values from the response
-        lat = lat_match.group(1)
-        lon = lon_match.group(1)
-
-        if '18000000000' not in lat:
-            # format the latitude and longitude values
-            lat = float(lat[:-8] + '.' + lat[-8:])
-            lon = float(lon[:-8] + '.' + lon[-8:])
-            # create the output dictionary
-            data = {
-                'module': 'apple',
-                'bssid': bssid_param,
-                'latitude': lat,
-                'longitude': lon
-            }
-            return data
-        else:
-            return {
-                'module': 'apple',
-                'error': 'Latitude or longitude value not found in response'
-            }
-    except Exception as e:
-        if not lat_match or not lon_match:
-            # Return the error message in a dictionary
-            return {
-                'module': 'apple',
-                'error': 'Latitude or longitude value not found in response'
-            }
-        # Return the exception message in a dictionary
-        return {
-            'module': 'apple',
-            'error': str(e)
-        }
-
-
-def google_bssid(bssid_param):
-    """Searches for a network with a specific BSSID in the Google geolocation API.
-
-    Parameters:
-        bssid_param (str): The BSSID of the network to search for.
-
-    Returns:
-        dict: A dictionary containing information about the network, or an error message if an error occurred.
-    """
-
-    # Read the configuration from the config.yaml file
-    parsed_config = read_config()
-    # Get the Comba.in API key from the configuration data
-    api_key = parsed_config.get('google_api')
-    # Set up the HTTP headers
-    headers = {
-        'accept': 'application/json',
-        'Content-Type': 'application/json'
-    }
-    # Set up the query parameters with the BSSID
-    params = {
-        'considerIp': 'false',
-        'wifiAccessPoints': [
-            {
-                'macAddress': bssid_param,
-            },
-            {
-                'macAddress': '00:25:9c:cf:1c:ad',
-            }
-        ]
-    }
-    # Set the endpoint for the request
-    endpoint = f'https://www.googleapis.com/geolocation/v1/geolocate?key={api_key}'
-    # Make the HTTP POST request to the Google geolocation API
-    try:
-        response = requests.post(
-            endpoint,
-            headers=headers,
-            json=params,
-            verify=not parsed_config.get('no-ssl-verify', False)
-        )
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Extract the relevant fields from the response
-            result = response.json()
-            # Create the output dictionary using a dictionary comprehension
-            data = {
-                'module': 'google',
-                'bssid': bssid_param,
-                'latitude': result['location']['lat'],
-                'longitude': result['location']['lng']
-            }
-            return data
-        else:
-            # Return the error message in a dictionary
-            return {
-                'module': 'google',
-                'error': response.json()['error']['message']
-            }
-    except Exception as e:
-        # Return the exception message in a dictionary
-        return {
-            'module': 'google',
-            'error': str(e)
-        }
-
-
-def combain_bssid(bssid_param):
-    """Searches for a network with a specific BSSID in the Comba.in database.
-
-    Parameters:
-        bssid_param (str): The BSSID of the network to search for.
-
-    Returns:
-        dict: A dictionary containing information about the network, or an error message if an error occurred.
-    """
-    # Load the configuration data from the config.yaml file
-    parsed_config = read_config()
-    # Get the Comba.in API key from the configuration data
-    api_key = parsed_config.get('combain_api')
-    # Set the headers for the request
-    headers = {
-        'Content-Type': 'application/json',
-    }
-    # Set the parameters for the request
-    params = {
-        'wifiAccessPoints': [{
-            'macAddress': bssid_param,
-            'macAddress': '28:28:5d:d6:39:8a'
-        }],
-        'indoor': 1
-    }
-    # Set the endpoint for the request
-    endpoint = f'https://apiv2.combain.com?key={api_key}'
-    try:
-        # Send the POST request
-        response = requests.post(
-            endpoint,
-            headers=headers,
-            json=params,
-            # Disable SSL verification if specified in the configuration data
-            verify=not parsed_config.get('no-ssl-verify', False)
-        )
-        # If the request is successful
-        if response.status_code == 200:
-            # Extract the relevant fields from the response
-            result = response.json()
-            data = {
-                'module': 'combain',
-                'bssid': bssid_param,
-                'latitude': result['location']['lat'],
-                'longitude': result['location']['lng'],
-            }
-            if 'indoor' in result:
-                data['building'] = result['indoor']['building']
-            return data
-        else:
-            # Return an error message if the request is not successful
-            return {
-                'module': 'combain',
-                'error': response.json()['error']['message']
-            }
-    except Exception as e:
-        # Return an error message if an exception occurs
-        return {
-            'module': 'combain',
-            'error': str(e)
-        }
-
-
-def wifidb_bssid(bssid_param):
-    """Searches for a network with a specific BSSID in the wifidb database.
-
-    Parameters:
-        bssid_param (str): The BSSID of the network to search for.
-
-    Returns:
-        list: A list of dictionaries, each containing information about a network. If an error occurred, the list will contain a single dictionary with an error message.
-    """
-    # Load the configuration data from the config.yaml file
-    parsed_config = read_config()
-    # Set the endpoint for the request
-    endpoint = 'https://wifidb.net/wifidb/api/geojson.php'
-    # Set the parameters for the request
-    params = {
-        'func': 'exp_search',
-        'ssid': '',
-        'mac': bssid_param,
-        'radio': '',
-        'chan': '',
-        'auth': '',
-        'encry': '',
-        'sectype': '',
-        'json': '0',
-        'labeled': '0'
-    }
-    try:
-        # Send the GET request
-        response = requests.get(
-            endpoint,
-            params=params,
-            # Disable SSL verification if specified in the configuration data
-            verify=not parsed_config.get('no-ssl-verify', False)
-        )
-        # If the request is successful
-        if response.status_code == 200:
-            # Get the results from the response
-            results = response.json()['features']
-            # Create a list of dictionaries containing the data
-            data = [{
-                'module': 'wifidb',
-                'bssid': result['properties']['mac'],
-                'ssid': result['properties']['ssid'],
-                'latitude': result['properties']['lat'],
-                'longitude': result['properties']['lon']
-            } for result in results]
-            return data
-        else:
-            # Return an error message if the request is not successful
-            return {
-                'module': 'wifidb',
-                'error': 'Request failed'
-            }
-    except Exception as e:
-        # Return an error message if an exception occurs
-        return {
-            'module': 'wifidb',
-            'error': str(e)
-        }
-
-
-def vendor_check(bssid):
-    """Searches for information about the vendor of a device with the specified BSSID.
-
-    Parameters:
-        bssid (str): The BSSID of the device to search for.
-
-    Returns:
-        dict: A dictionary containing information about the vendor of the device, or an error message if an error occurred.
-    """
-
-    try:
-        # Send a GET request to the macvendors.com API, with the BSSID as a parameter
-        response = requests.get('https://api.macvendors.com/' + bssid)
-        # Raise an exception if the response indicates that an error occurred
-        response.raise_for_status()
-        # Extract the vendor information from the response
-        data = {
-            'module': 'vendor_check',
-            'vendor': response.text
-        }
-        # Return the vendor information
-        return data
-    except requests.exceptions.RequestException as e:
-        # Return an error message if an exception occurs
-        return {
-            'module': 'vendor_check',
-            'vendor': 'Unknown',
-            'error': str(e)
-        }
-
-
-def search_networks(bssid=None, ssid=None):
-    """Searches for networks using the specified search criteria.
-
-    Parameters:
-        bssid (str, optional): The BSSID of the network to search for.
-        ssid (str, optional): The SSID of the network to search for.
-
-    Returns:
-        list: A list of dictionaries, each containing information about a network.
-    """
-
-    # Initialize an empty list to store the results
-    results = []
-
-    # Create a list of functions to be called concurrently
-    functions = []
-    if bssid:
-        functions.extend(
-            [wigle_bssid, apple_bssid, mylnikov_bssid, google_bssid, combain_bssid, wifidb_bssid, vendor_check])
-    if ssid:
-        functions.extend([wigle_ssid, openwifimap_ssid, wifidb_ssid, freifunk_karte_ssid])
-
-    # Use a ThreadPoolExecutor to call the functions concurrently
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        # Create a list of futures for each function
-        futures = [executor.submit(f, bssid or ssid) for f in functions]
-
-        # Iterate over the completed futures
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                # Get the result from the future
-                result = future.result()
-
-                # Add the result to the list of results
-                if bssid:
-                    if isinstance(result, list):
-                        for res in result:
-                            if str(res['bssid']).lower() == str(bssid).lower():
-                                if res['latitude'] != 0.0:
-                                    results.append(res)
-                    else:
-                        results.append(result)
-                if ssid:
-                    if isinstance(result, list):
-                        for res in result:
-                            if str(res['ssid']).lower() == str(ssid).lower():
-                                if res['latitude'] != 0.0:
-                                    results.append(res)
-                    else:
-                        results.append(result)
-            except Exception as e:
-                # Add an error message to the list of results if an exception occurred
-                module_name = functions[futures.index(future)].__name__.split('_')[0]
-                results.append({
-                    'module': module_name,
-                    'error': str(e)
-                })
-
-    # Format the json data
-    for locations in results:
-        if 'latitude' in locations:
-            locations['latitude'] = float(locations['latitude'])
-        if 'longitude' in locations:
-            locations['longitude'] = float(locations['longitude'])
-
-    return results
-
-
-def create_map(search_results_data):
-    # Set a default location for the map
-    default_location = [48.8566, 2.3522]
-
-    # Use the default location if the first search result is missing a latitude or longitude, or if there are no search results
-    map = folium.Map(location=[39.600441, -41.141473], zoom_start=3,
-                     tiles='https://mt1.google.com/vt/lyrs=y&x={x}&y={y}&z={z}', attr='Google')
-
-    # Iterate through the search results
-    for result in search_results_data:
-        # Check if the result contains an error message
-        if 'error' in result:
-            # Skip this result if it contains an error message
-            continue
-        # Check if the result contains a latitude and longitude
-        elif 'latitude' in result and 'longitude' in result:
-            # Create the popup text with increased font size and line height
-            popup_text = f'<style>body {{font-size: 20px; line-height: 1.5; font-family: "Consolas";}}</style>'
-            # Create the popup text with headings and paragraphs
-            popup_text = f'<h3>Network Information</h1>'
-            popup_text += f'<p><b>Module</b>: {result["module"]}</p>'
-            if 'bssid' in result:
-                popup_text += f'<p><b>BSSID</b>: {result["bssid"]}</p>'
-            elif 'ssid' in result:
-                popup_text += f'<p><b>SSID</b>: {result["ssid"]}</p>'
-            # Look for a vendor_check result with the same BSSID
-            for vendor_result in search_results_data:
-                if vendor_result['module'] == 'vendor_check':
-                    # Use the vendor information from the vendor_check result
-                    popup_text += f'<p><b>Vendor</b>: {vendor_result["vendor"]}</p>'
-                    break
-            # Create an IFrame with the formatted popup text
-            popup = folium.Popup(popup_text)
-            # Add a marker to the map at the location of the network
-            folium.Marker(location=[result['latitude'], result['longitude']], popup=popup,
-                          icon=folium.Icon(color='red', icon='wifi', prefix='fa')).add_to(map)
-
-    return map
-
-
-def is_valid_bssid(bssid):
-    """Checks if a string is a valid BSSID.
-
-    A valid BSSID is a string in the format XX:XX:XX:XX:XX:XX where X is a hexadecimal digit.
-
-    Parameters:
-        bssid (str): The string to be checked.
-
-    Returns:
-        bool: True if the string is a valid BSSID, False otherwise.
-    """
-    # Define the regular expression pattern for a valid BSSID
-    bssid_regex = r'^[0-9A-Fa-f]{2}(:[0-9A-Fa-f]{2}){5}$'
-
-    # Use the re module's match function to check if the given string matches the pattern
-    # If it matches, the match function returns a Match object. If it doesn't match, it returns None.
-    return re.match(bssid_regex, bssid) is not None
-
-
-def print_results_table(results, main_color='bright_yellow', secondary_color='bright_blue'):
-    """Prints search_results in a table format, including any errors that occurred during the search and the result of
-        a vendor check module (if one was run).
-
-    Parameters:
-        - results (list): a list of dictionaries, where each dictionary represents the results of a search
-        - main_color (str, optional): the color of the table header. Defaults to 'bright_yellow'
-        - secondary_color (str, optional): the color of the other cells in the table. Defaults to 'bright_blue'
-
-    The function also prints any errors that occurred during the search, indicated with a red circle emoji.
-    If a vendor check module was run, the result is also printed, indicated with a green circle emoji.
-    """
-    # Create a table with the desired columns
-    table = Table(show_header=True, header_style=main_color, title_justify='center', title='Search Results')
-    table.add_column('Module', style=secondary_color)
-    table.add_column('BSSID', style=secondary_color, justify='center')
-    table.add_column('SSID', style=secondary_color, justify='center')
-    table.add_column('Latitude', style=secondary_color, justify='center')
-    table.add_column('Longitude', style=secondary_color, justify='center')
-
-    # Add a row for each result
-    for result in results:
-        if result['module'] != 'vendor_check':
-            module = result.get('module', '')
-            bssid = result.get('bssid', '')
-            ssid = result.get('ssid', '')
-            latitude = str(result.get('latitude', ''))
-            longitude = str(result.get('longitude', ''))
-
-            # Use emojis to indicate empty fields
-            if not bssid:
-                bssid = '❌'
-            if not ssid:
-                ssid = '❌'
-            if not latitude:
-                latitude = '❌'
-            if not longitude:
-                longitude = '❌'
-
-            # Use a different color for cells that contain errors
-            if 'error' in result:
-                table.add_row(module, bssid, ssid, latitude, longitude, style='bright_red')
-            else:
-                table.add_row(module, bssid, ssid, latitude, longitude)
-
-    # Print the table to the console
-    console.print(table)
-    print()
-
-    # Print errors
-    for result in results:
-        if 'error' in result:
-            console.print(' [:red_circle:] [bright_yellow]Error in [/bright_yellow][bright_blue]' + result[
-                'module'] + ' [/bright_blue][bright_yellow]module[/bright_yellow]: ' + str(result['error']).lower())
-    print()
-
-    # Print vendor check results
-    for result in results:
-        if result['module'] == 'vendor_check':
-            console.print(
-                ' [:green_circle:] [bright_yellow] Vendor_check module result: [/bright_yellow]: [bright_blue]' +
-                result['vendor'] + '[/bright_blue]')
-            console.print()
-
-
-# Set up the argument parser
-parser = argparse.ArgumentParser(description='Search for information about a network with a specific BSSID or SSID.')
-parser.add_argument('identifier', help='The BSSID or SSID of the network to search for.')
-parser.add_argument('-s', '--search-by', choices=['bssid', 'ssid'], default='bssid',
-                    help='Specifies whether to search by BSSID or SSID (default: bssid)')
-parser.add_argument('-o', '--output-format', choices=['map', 'json'], default='html',
-                    help='Specifies the output format for the search results (default: map)')
-
-# Print banner
-banner()
-
-# Parse the arguments
-args = parser.parse_args()
-
-# Get the search identifier and search type from the arguments
-identifier = args.identifier
-search_by = args.search_by
-output_format = args.output_format
-
-# Check if the search identifier is a valid BSSID
-if search_by == 'bssid':
-    if not is_valid_bssid(identifier):
-        console.print(' [:red_circle:] Error: Invalid BSSID')
-        exit(1)
-
-# Search for information about the network
-if search_by == 'bssid':
-    search_results = search_networks(identifier)
-elif search_by == 'ssid':
-    search_results = search_networks(ssid=identifier)
-
-print_results_table(search_results)
-
-# Save the search results in the specified output format
-if output_format == 'map':
-    # Create a map with markers for the search results
-    map = create_map(search_results)
-    # Save the map to an HTML file
-    map.save('results/' + str(args.identifier).replace(':', '_') + '.html')
-    filepath = os.getcwd()
-    console.print(' [:green_circle:] [bright_yellow]Map saved at[/bright_yellow]: [bright_blue]' + str(
-        filepath) + '\\results\\' + str(args.identifier).replace(':', '_') + '.html[/bright_blue]')
-    print()
-elif output_format == 'json':
-    # Save the search results to a JSON file
-    with open('results/' + str(args.identifier).replace(':', '_') + '.json', 'w') as outfile:
-        json.dump(search_results, outfile)
-    filepath = os.getcwd()
-    console.print(' [:green_circle:] [bright_yellow]Json file saved at[/bright_yellow]: [bright_blue]' + str(
-        filepath) + '\\results\\' + str(args.identifier).replace(':', '_') + '.json[/bright_blue]')
-    print()
+import argparse
+import json
+import os
+import types
+from array import array
+
+import folium
+from rich import print
+from rich._emoji_codes import EMOJI
+from rich.console import Console
+from rich.table import Table
+
+emoji_list = ['cd', 'ab', 'ox', 'wc', 'cl', 'id', 'sa', 'vs', 'o2', 'on', 'tm']
+for emj in emoji_list:
+    del EMOJI[emj]
+# import the provider registry and the lookup engine
+from helpers.batch import read_identifiers, run_batch, run_sharded_batch
+from helpers.bssid import RecordArray, bssids_to_ints, int_to_bssid, is_valid_bssid, normalize_bssid
+from helpers.engine import PROVIDERS, get_engine, select_providers
+from helpers.negcache import open_negative_cache
+from helpers.pivot import pivot_search
+from helpers.profiling import PROFILER, CallProfiler, profiled, span
+from helpers.progress import BatchProgress
+from helpers.refresh import open_default_scheduler
+from helpers.replay import Recorder
+from helpers.scan import locate_scan, read_scan
+from helpers.search import SearchMode
+from helpers.ssidindex import MATCH_MODES, index_results, open_default_index
+from helpers.store import open_default_store, store_results
+from helpers.watch import Watcher
+
+console = Console()
+
+# Batches with more results than this only print the summary table, not one row per result
+SUMMARY_THRESHOLD = 1000
+
+
+def banner():
+    print("""
+   ██████╗ ███████╗ ██████╗   ██╗    ██╗     ███████╗ 
+  ██╔════╝ ██╔════╝██╔═══██╗  ██║    ██║ ██╗ ██╔════╝ ██╗
+  ██║  ███╗█████╗  ██║   ██║  ██║ █╗ ██║ ██║ █████╗   ██║
+  ██║   ██║██╔══╝  ██║   ██║  ██║███╗██║ ██║ ██╔══╝   ██║
+  ╚██████╔╝███████╗╚██████╔╝  ╚███╔███╔╝ ██║ ██║      ██║
+   ╚═════╝ ╚══════╝ ╚═════╝    ╚══╝╚══╝  ╚═╝ ╚═╝      ╚═╝ :earth_africa:[bold medium_purple1 italic]by GOΠZO[/bold medium_purple1 italic]                          
+""")
+
+
+@profiled('map')
+def create_map(search_results_data):
+    # Set a default location for the map
+    default_location = [48.8566, 2.3522]
+
+    # Use the default location if the first search result is missing a latitude or longitude, or if there are no search results
+    map = folium.Map(location=[39.600441, -41.141473], zoom_start=3,
+                     tiles='https://mt1.google.com/vt/lyrs=y&x={x}&y={y}&z={z}', attr='Google')
+
+    # Iterate through the search results
+    for result in search_results_data:
+        # Check if the result contains an error message
+        if 'error' in result:
+            # Skip this result if it contains an error message
+            continue
+        # Check if the result contains a latitude and longitude
+        elif 'latitude' in result and 'longitude' in result:
+            # Create the popup text with increased font size and line height
+            popup_text = f'<style>body {{font-size: 20px; line-height: 1.5; font-family: "Consolas";}}</style>'
+            # Create the popup text with headings and paragraphs
+            popup_text = f'<h3>Network Information</h1>'
+            popup_text += f'<p><b>Module</b>: {result["module"]}</p>'
+            if 'bssid' in result:
+                popup_text += f'<p><b>BSSID</b>: {result["bssid"]}</p>'
+            elif 'ssid' in result:
+                popup_text += f'<p><b>SSID</b>: {result["ssid"]}</p>'
+            # Look for a vendor_check result with the same BSSID
+            for vendor_result in search_results_data:
+                if vendor_result['module'] == 'vendor_check':
+                    # Use the vendor information from the vendor_check result
+                    popup_text += f'<p><b>Vendor</b>: {vendor_result["vendor"]}</p>'
+                    break
+            # Create an IFrame with the formatted popup text
+            popup = folium.Popup(popup_text)
+            # Add a marker to the map at the location of the network
+            folium.Marker(location=[result['latitude'], result['longitude']], popup=popup,
+                          icon=folium.Icon(color='red', icon='wifi', prefix='fa')).add_to(map)
+
+    return map
+
+
+@profiled('table')
+def print_results_table(results, main_color='bright_yellow', secondary_color='bright_blue'):
+    """Prints search_results in a table format, including any errors that occurred during the search and the result of
+        a vendor check module (if one was run).
+
+    Parameters:
+        - results (list): a list of dictionaries, where each dictionary represents the results of a search
+        - main_color (str, optional): the color of the table header. Defaults to 'bright_yellow'
+        - secondary_color (str, optional): the color of the other cells in the table. Defaults to 'bright_blue'
+
+    The function also prints any errors that occurred during the search, indicated with a red circle emoji.
+    If a vendor check module was run, the result is also printed, indicated with a green circle emoji.
+    """
+    # Create a table with the desired columns
+    table = Table(show_header=True, header_style=main_color, title_justify='center', title='Search Results')
+    table.add_column('Module', style=secondary_color)
+    table.add_column('BSSID', style=secondary_color, justify='center')
+    table.add_column('SSID', style=secondary_color, justify='center')
+    table.add_column('Latitude', style=secondary_color, justify='center')
+    table.add_column('Longitude', style=secondary_color, justify='center')
+
+    # Add a row for each result, collecting the errors and vendor check results in the same pass
+    errors = []
+    vendors = []
+    for result in results:
+        if 'error' in result:
+            errors.append(result)
+        if result['module'] == 'vendor_check':
+            vendors.append(result)
+            continue
+        module = result.get('module', '')
+        bssid = result.get('bssid', '')
+        if 'sibling' in result:
+            # Located through an adjacent BSSID of the same access point
+            bssid += ' (via ' + result['sibling'] + ')'
+        ssid = result.get('ssid', '')
+        latitude = str(result.get('latitude', ''))
+        longitude = str(result.get('longitude', ''))
+
+        # Use emojis to indicate empty fields
+        if not bssid:
+            bssid = '❌'
+        if not ssid:
+            ssid = '❌'
+        if not latitude:
+            latitude = '❌'
+        if not longitude:
+            longitude = '❌'
+
+        # Use a different color for cells that contain errors
+        if 'error' in result:
+            table.add_row(module, bssid, ssid, latitude, longitude, style='bright_red')
+        else:
+            table.add_row(module, bssid, ssid, latitude, longitude)
+
+    # Print the table to the console
+    console.print(table)
+    print()
+
+    # Print errors
+    for result in errors:
+        console.print(' [:red_circle:] [bright_yellow]Error in [/bright_yellow][bright_blue]' + result[
+            'module'] + ' [/bright_blue][bright_yellow]module[/bright_yellow]: ' + str(result['error']).lower())
+    print()
+
+    # Print vendor check results
+    for result in vendors:
+        console.print(
+            ' [:green_circle:] [bright_yellow] Vendor_check module result: [/bright_yellow]: [bright_blue]' +
+            result['vendor'] + '[/bright_blue]')
+        console.print()
+
+
+def split_names(value):
+    """Splits a comma-separated list of provider names given on the command line."""
+    return [name.strip() for name in value.split(',') if name.strip()] if value else []
+
+
+def serve(host, port, client_limit, search):
+    """Runs geowifi as a long-lived HTTP lookup service.
+
+    The provider connections, the configuration and the engine caches (provider answers and known misses) stay warm
+    between requests, and the provider connections closed by the servers during idle periods are reopened in the
+    background. With refresh enabled in
+    the configuration, the stale positions of the store are refreshed in the background too.
+
+    Parameters:
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+        client_limit (int): The maximum number of concurrent requests per client.
+        search (callable): The search function answering the lookups.
+    """
+    from helpers.server import LookupService, create_server
+
+    engine = get_engine()
+    service = LookupService(search, client_limit=client_limit, engine=engine)
+    server = create_server(service, host, port)
+    keep_warm = None
+    if engine.config.get('prewarm', True):
+        keep_warm = engine.keep_warm(engine.config.get('prewarm_interval', 30))
+    refresh = None
+    refresh_options = engine.config.get('refresh') or {}
+    if refresh_options.get('enabled'):
+        # Re-query the stale stored positions while the server runs, within the configured budgets
+        scheduler = open_default_scheduler(engine.config, engine)
+        if scheduler is not None:
+            refresh = scheduler.start(refresh_options.get('interval', 3600))
+    console.print(
+        ' [:green_circle:] [bright_yellow]Lookup server listening on[/bright_yellow]: [bright_blue]http://' +
+        f'{host}:{port}[/bright_blue]')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if keep_warm is not None:
+            keep_warm.set()
+        if refresh is not None:
+            refresh.set()
+        server.server_close()
+
+
+def dump_json_array(items, outfile):
+    """Writes the items of an iterable as a JSON array, without holding them all in memory."""
+    outfile.write('[')
+    for number, item in enumerate(items):
+        if number:
+            outfile.write(', ')
+        json.dump(item, outfile)
+    outfile.write(']')
+
+
+@profiled('save')
+def save_results(name, search_results, output_format, json_data=None):
+    """Saves the search results in the specified output format.
+
+    Parameters:
+        name (str): The file name, without extension, used inside the results folder.
+        search_results (list or RecordArray): The search results to save.
+        output_format (str): Either 'map' or 'json'.
+        json_data (optional): The data written to the JSON file. Defaults to search_results. A generator is written
+            as a JSON array one item at a time.
+    """
+    filepath = os.getcwd()
+    packed = isinstance(search_results, RecordArray)
+    # Keep the located BSSIDs in the position store, later searches answer them without any request
+    store = open_default_store(get_engine().config)
+    if store is not None:
+        store_results(store, search_results.results() if packed else search_results)
+    index = open_default_index(get_engine().config)
+    if index is not None:
+        index_results(index, search_results.results() if packed else search_results)
+    if output_format == 'map':
+        # Create a map with markers for the search results
+        map = create_map(search_results.to_results() if packed else search_results)
+        # Save the map to an HTML file
+        map.save('results/' + name + '.html')
+        console.print(' [:green_circle:] [bright_yellow]Map saved at[/bright_yellow]: [bright_blue]' + str(
+            filepath) + '\\results\\' + name + '.html[/bright_blue]')
+        print()
+    elif output_format == 'json':
+        # Save the search results to a JSON file
+        with open('results/' + name + '.json', 'w') as outfile:
+            if isinstance(json_data, types.GeneratorType):
+                dump_json_array(json_data, outfile)
+            else:
+                json.dump((search_results.to_results() if packed else search_results) if json_data is None
+                          else json_data, outfile)
+        console.print(' [:green_circle:] [bright_yellow]Json file saved at[/bright_yellow]: [bright_blue]' + str(
+            filepath) + '\\results\\' + name + '.json[/bright_blue]')
+        print()
+
+
+def search_batch(path, search_by, search, output_format, processes=1, threads=16, summary=False, record=None):
+    """Searches every identifier listed in a batch file and saves the combined results.
+
+    Parameters:
+        path (str): The batch file, one BSSID or SSID per line.
+        search_by (str): Either 'bssid' or 'ssid'.
+        search (SearchMode): The search, also run by the worker processes.
+        output_format (str): Either 'map' or 'json'.
+        processes (int, optional): The number of worker processes, 1 runs the batch in this process. Defaults to 1.
+        threads (int, optional): The number of lookups running at the same time in each process. Defaults to 16.
+        summary (bool, optional): Whether to only print the per-module summary instead of one row per result.
+            Batches with more than SUMMARY_THRESHOLD results are always summarized. Defaults to False.
+        record (str, optional): The directory the worker processes record the provider responses in.
+    """
+    identifiers = read_identifiers(path)
+    if search_by == 'bssid':
+        keys, invalid = bssids_to_ints(identifiers)
+        for identifier in invalid:
+            console.print(' [:red_circle:] Error: Invalid BSSID ' + identifier)
+        # Search every network once, whatever notation it was written in
+        identifiers = [int_to_bssid(key) for key in dict.fromkeys(keys)]
+
+    # The results are packed into records as they arrive, and only turned back into dictionaries to be printed or
+    # saved. Lookups finish out of order, the rows of every identifier are kept as a range
+    records = RecordArray()
+    starts = array('Q', bytes(8 * len(identifiers)))
+    ends = array('Q', bytes(8 * len(identifiers)))
+    if processes > 1:
+        lookups = run_sharded_batch(identifiers, search_by, processes, threads, search, record)
+    else:
+        lookups = run_batch(identifiers, search_by, search, threads)
+    # The live view only keeps per-module counters, it costs the same for ten or a million lookups
+    with BatchProgress(len(identifiers), console) as progress:
+        for index, identifier, results in lookups:
+            starts[index] = len(records)
+            if isinstance(results, RecordArray):
+                # Packed by a worker process
+                progress.update(results.results())
+                records.extend(results)
+            else:
+                progress.update(results)
+                records.extend_results(results)
+            ends[index] = len(records)
+
+    # Put the rows back in input order
+    records = records.take(row for index in range(len(identifiers)) for row in range(starts[index], ends[index]))
+    if not summary and len(records) <= SUMMARY_THRESHOLD:
+        print_results_table(records.results())
+    progress.print_summary()
+
+    def batch_results():
+        row = 0
+        for index, identifier in enumerate(identifiers):
+            count = ends[index] - starts[index]
+            yield {search_by: identifier, 'results': list(records.results(row, row + count))}
+            row += count
+
+    save_results(os.path.splitext(os.path.basename(path))[0], records, output_format, batch_results())
+
+
+def search_pivot(ssid, output_format, providers=None, exclude=None, use_cache=True, limit=50):
+    """Searches an SSID and every BSSID found for it, and saves the correlated results.
+
+    Parameters:
+        ssid (str): The SSID to search for.
+        output_format (str): Either 'map' or 'json'.
+        providers (list, optional): Provider or module names to query.
+        exclude (list, optional): Provider or module names to skip.
+        use_cache (bool, optional): Whether cached results and known misses may be used.
+        limit (int, optional): The maximum number of BSSIDs searched. Defaults to 50.
+    """
+    search_results, networks = pivot_search(ssid, providers, exclude, use_cache=use_cache, limit=limit)
+    print_results_table(search_results)
+    located = sum(1 for network in networks
+                  if any('error' not in result and 'latitude' in result for result in network['results']))
+    console.print(' [:green_circle:] [bright_yellow]BSSIDs pivoted[/bright_yellow]: [bright_blue]' +
+                  f'{len(networks)} searched, {located} located[/bright_blue]')
+    print()
+    save_results(ssid, search_results, output_format, networks)
+
+
+def search_scan(path, output_format, providers=None, exclude=None, use_cache=True):
+    """Locates the device that recorded a Wi-Fi scan and saves the estimated position with the AP results.
+
+    Parameters:
+        path (str): The scan file, with the BSSID and RSSI of every AP seen.
+        output_format (str): Either 'map' or 'json'.
+        providers (list, optional): Provider or module names to query.
+        exclude (list, optional): Provider or module names to skip.
+        use_cache (bool, optional): Whether cached results and known misses may be used.
+    """
+    scan = read_scan(path)
+    position, ap_results = locate_scan(scan, providers, exclude, use_cache=use_cache)
+
+    search_results = [result for results in ap_results.values() for result in results]
+    print_results_table(search_results + [position])
+    if 'error' not in position:
+        console.print(' [:green_circle:] [bright_yellow]Estimated position[/bright_yellow]: [bright_blue]' +
+                      f'{position["latitude"]:.6f}, {position["longitude"]:.6f} (± {position["accuracy"]} m, ' +
+                      f'{position["aps_located"]}/{position["aps_total"]} APs located)[/bright_blue]')
+        print()
+    save_results(os.path.splitext(os.path.basename(path))[0], [position] + search_results, output_format,
+                 {'position': position, 'access_points': ap_results})
+
+
+def watch(paths, search, sink, interval=1.0, threads=16):
+    """Geolocates the new BSSIDs of capture files as they are written, until interrupted.
+
+    Parameters:
+        paths (list): The directories or files to watch (airodump-ng CSV, Kismet netxml or sqlite logs, BSSID lists).
+        search (callable): The search function.
+        sink (str): The JSON lines file every new BSSID and its results are appended to.
+        interval (float, optional): The number of seconds between two polls. Defaults to 1.
+        threads (int, optional): The number of lookups running at the same time. Defaults to 16.
+    """
+    store = open_default_store(get_engine().config)
+
+    def on_result(record):
+        located = {result['module'] for result in record['results'] if 'error' not in result and 'latitude' in result}
+        if store is not None:
+            store_results(store, record['results'])
+        console.print(' [:green_circle:] [bright_yellow]' + record['bssid'] + '[/bright_yellow]: [bright_blue]' +
+                      (', '.join(sorted(located)) if located else 'not located') + '[/bright_blue]')
+
+    console.print(' [:green_circle:] [bright_yellow]Watching[/bright_yellow]: [bright_blue]' + ', '.join(paths) +
+                  '[/bright_blue] [bright_yellow]results appended to[/bright_yellow]: [bright_blue]' + sink +
+                  '[/bright_blue]')
+    try:
+        Watcher(paths, search, sink, interval=interval, workers=threads, on_result=on_result).run()
+    except KeyboardInterrupt:
+        pass
+
+
+def print_profile(profiler):
+    """Prints the time spent per phase and per provider call, as recorded by the profiler spans."""
+    wall_time = profiler.wall_time()
+    table = Table(show_header=True, header_style='bright_yellow', title='Profile')
+    for column in ('Category', 'Name', 'Calls', 'Total (ms)', 'Mean (ms)', 'Max (ms)', '% of run'):
+        table.add_column(column, style='bright_blue', justify='left' if column in ('Category', 'Name') else 'right')
+    for category, name, calls, total, mean, maximum in profiler.summary():
+        table.add_row(category, name, str(calls), f'{total * 1000:.1f}', f'{mean * 1000:.2f}',
+                      f'{maximum * 1000:.1f}', f'{total / wall_time * 100:.1f}')
+    console.print(table)
+    # Provider spans run concurrently, so their shares may add up to more than the whole run
+    console.print(' [:green_circle:] [bright_yellow]Run time[/bright_yellow]: [bright_blue]' +
+                  f'{wall_time * 1000:.1f} ms[/bright_blue]')
+    print()
+
+
+def print_dispatch(report):
+    """Prints the requests, cost and quota use of every provider during a tiered run."""
+    table = Table(show_header=True, header_style='bright_yellow', title='Provider Usage')
+    for column in ('Provider', 'Requests', 'Cost (USD)', 'Used today', 'Daily quota', 'Skipped'):
+        table.add_column(column, style='bright_blue', justify='left' if column == 'Provider' else 'right')
+    for name, usage in report['providers'].items():
+        table.add_row(name, str(usage['requests']), f'{usage["cost"]:.3f}', str(usage['used_today']),
+                      str(usage['quota']) if usage['quota'] is not None else '-',
+                      str(usage['over_quota'] + usage['over_budget']))
+    console.print(table)
+    stops = ', '.join(f'tier {tier}: {count}' for tier, count in report['stops'].items())
+    console.print(' [:green_circle:] [bright_yellow]Run cost[/bright_yellow]: [bright_blue]' +
+                  f'{report["cost"]:.3f} USD[/bright_blue] [bright_yellow]Searches settled at[/bright_yellow]: ' +
+                  '[bright_blue]' + (stops or 'none') + '[/bright_blue]')
+    print()
+
+
+def prewarm_search_by(args):
+    """Returns which searches send provider requests from this process, or None if opening connections early does not
+    pay off."""
+    if args.watch:
+        # Files arrive one at a time, each lookup opens the connections it needs
+        return None
+    if args.batch and args.processes > 1:
+        # The worker processes send the requests on their own connections
+        return None
+    if args.scan:
+        return 'bssid'
+    if args.search_by == 'ssid' and args.match != 'exact' and not args.pivot:
+        # Partial and approximate SSID matches only read the local index
+        return None
+    return args.search_by
+
+
+def main():
+    # Set up the argument parser
+    parser = argparse.ArgumentParser(
+        description='Search for information about a network with a specific BSSID or SSID.')
+    parser.add_argument('identifier', nargs='?', help='The BSSID or SSID of the network to search for.')
+    parser.add_argument('-s', '--search-by', choices=['bssid', 'ssid'], default='bssid',
+                        help='Specifies whether to search by BSSID or SSID (default: bssid)')
+    parser.add_argument('-o', '--output-format', choices=['map', 'json'], default='html',
+                        help='Specifies the output format for the search results (default: map)')
+    parser.add_argument('--serve', action='store_true',
+                        help='Run as a long-lived HTTP lookup server instead of a single search')
+    parser.add_argument('--host', default='127.0.0.1', help='Address the lookup server listens on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080, help='Port the lookup server listens on (default: 8080)')
+    parser.add_argument('--client-limit', type=int, default=4,
+                        help='Maximum concurrent requests per client in server mode (default: 4)')
+    parser.add_argument('--providers',
+                        help='Comma-separated providers or modules to query (default: all). Available: ' +
+                             ', '.join(PROVIDERS))
+    parser.add_argument('--exclude', help='Comma-separated providers or modules to skip')
+    parser.add_argument('-b', '--batch', metavar='FILE',
+                        help='Search every BSSID or SSID listed in FILE, one per line')
+    parser.add_argument('--summary', action='store_true',
+                        help='Only print the per-module summary of a batch, not one row per result (always on above '
+                             + str(SUMMARY_THRESHOLD) + ' results)')
+    parser.add_argument('--scan', metavar='FILE',
+                        help='Locate the device that recorded the Wi-Fi scan in FILE (bssid and rssi per AP)')
+    parser.add_argument('--watch', metavar='PATH', action='append',
+                        help='Geolocate the new BSSIDs of the capture files in PATH as they are written (repeatable)')
+    parser.add_argument('--watch-interval', type=float, default=1.0,
+                        help='Seconds between two polls of the watched files (default: 1)')
+    parser.add_argument('--sink', default='results/watch.jsonl',
+                        help='JSON lines file the watch results are appended to (default: results/watch.jsonl)')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Worker processes sharing a batch, each with its own connections (default: 1)')
+    parser.add_argument('--threads', type=int, default=16,
+                        help='Concurrent lookups per process in batch and watch modes (default: 16)')
+    parser.add_argument('--expand', action='store_true',
+                        help='When a BSSID is not located, also search the sibling BSSIDs of the same access point')
+    parser.add_argument('--expand-budget', type=int, default=32,
+                        help='Maximum extra provider requests per BSSID for --expand (default: 32)')
+    parser.add_argument('--pivot', action='store_true',
+                        help='With -s ssid, also search every BSSID the SSID providers return, in the same run')
+    parser.add_argument('--pivot-limit', type=int, default=50,
+                        help='Maximum number of BSSIDs searched by --pivot (default: 50)')
+    parser.add_argument('--match', choices=MATCH_MODES, default='exact',
+                        help='How SSIDs are matched; prefix, substring and fuzzy searches only use the local SSID '
+                             'index, substrings need at least 3 characters (default: exact)')
+    parser.add_argument('--max-distance', type=int, default=2,
+                        help='Maximum edit distance of --match fuzzy results (default: 2)')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Query every provider again, ignoring cached results and known misses')
+    parser.add_argument('--tiered', action='store_true',
+                        help='Query local and free providers first and paid or quota-limited ones only when they miss '
+                             'or disagree, within the daily quotas and cost budget of the configuration')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print the time spent per phase and per provider call at the end of the run')
+    parser.add_argument('--profile-trace', metavar='FILE',
+                        help='Save the profile spans to FILE in the Chrome trace format (chrome://tracing, Perfetto)')
+    parser.add_argument('--profile-stats', metavar='FILE',
+                        help='Run cProfile over every thread and save the statistics to FILE in the pstats format')
+    parser.add_argument('--record', metavar='DIRECTORY',
+                        help='Record every provider response in DIRECTORY for offline replay and benchmarks')
+
+    # Print banner
+    banner()
+
+    # Parse the arguments
+    args = parser.parse_args()
+
+    if args.profile or args.profile_trace:
+        PROFILER.enable()
+    call_profiler = None
+    if args.profile_stats:
+        call_profiler = CallProfiler()
+        call_profiler.start()
+
+    providers = split_names(args.providers)
+    exclude = split_names(args.exclude)
+
+    # Skip providers that already confirmed they do not know a network, unless a refresh is requested
+    engine = get_engine()
+    engine.negative_cache = open_negative_cache(engine.config)
+    # The search options, also sent to the worker processes of a sharded batch
+    search = SearchMode(providers, exclude, not args.refresh, args.expand_budget if args.expand else None, args.match,
+                        args.max_distance, args.tiered or (engine.config.get('dispatch') or {}).get('tiered', False))
+    search.bind(engine)
+    planner = search.planner
+    prewarm = prewarm_search_by(args)
+    if prewarm and engine.config.get('prewarm', True):
+        # Resolve the provider hosts and open their connections while the rest of the startup runs
+        engine.prewarm(select_providers(prewarm, providers, exclude))
+    try:
+        run(parser, args, search, providers, exclude)
+    finally:
+        if engine.negative_cache is not None:
+            engine.negative_cache.save()
+        if planner is not None:
+            planner.ledger.save()
+            print_dispatch(planner.report())
+        if call_profiler is not None:
+            call_profiler.stop()
+            call_profiler.save(args.profile_stats)
+            console.print(' [:green_circle:] [bright_yellow]Profile statistics saved at[/bright_yellow]: ' +
+                          '[bright_blue]' + args.profile_stats + '[/bright_blue]')
+        if args.profile_trace:
+            PROFILER.save_chrome_trace(args.profile_trace)
+            console.print(' [:green_circle:] [bright_yellow]Profile trace saved at[/bright_yellow]: [bright_blue]' +
+                          args.profile_trace + '[/bright_blue]')
+        if args.profile:
+            print_profile(PROFILER)
+
+
+def run(parser, args, search, providers, exclude):
+    """Runs the mode selected on the command line."""
+    if args.record:
+        # Save every provider response so the run can be replayed offline
+        get_engine().hooks.append(Recorder(args.record))
+
+    if args.serve:
+        serve(args.host, args.port, args.client_limit, search)
+        return
+    if args.watch:
+        watch(args.watch, search, args.sink, args.watch_interval, args.threads)
+        return
+    if args.scan:
+        ignored = [flag for flag, used in (('--tiered', args.tiered), ('--expand', args.expand), ('--pivot', args.pivot))
+                   if used]
+        if ignored:
+            parser.error(f'{", ".join(ignored)} cannot be combined with --scan')
+        search_scan(args.scan, args.output_format, providers, exclude, not args.refresh)
+        return
+    if args.batch:
+        if args.pivot:
+            parser.error('--pivot only applies to a single SSID search')
+        search_batch(args.batch, args.search_by, search, args.output_format, args.processes, args.threads,
+                     args.summary, args.record)
+        return
+    if not args.identifier:
+        parser.error('the identifier argument is required')
+
+    # Get the search identifier and search type from the arguments
+    identifier = args.identifier
+    search_by = args.search_by
+    output_format = args.output_format
+
+    # Check if the search identifier is a valid BSSID
+    if search_by == 'bssid':
+        if not is_valid_bssid(identifier):
+            console.print(' [:red_circle:] Error: Invalid BSSID')
+            exit(1)
+        identifier = normalize_bssid(identifier)
+    elif args.pivot:
+        with span('search'):
+            search_pivot(identifier, output_format, providers, exclude, not args.refresh, args.pivot_limit)
+        return
+
+    # Search for information about the network
+    with span('search'):
+        if search_by == 'bssid':
+            search_results = search(identifier)
+        elif search_by == 'ssid':
+            search_results = search(ssid=identifier)
+
+    print_results_table(search_results)
+    save_results(str(identifier).replace(':', '_'), search_results, output_format)
+
+if __name__ == '__main__':
+    main()
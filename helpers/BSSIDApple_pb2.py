@@ -17,7 +17,7 @@ DESCRIPTOR = _descriptor.FileDescriptor(
     syntax='proto3',
     serialized_options=None,
     create_key=_descriptor._internal_create_key,
-    serialized_pb=b'\n\x10\x42SSIDApple.proto\"q\n\x07WifiGeo\x12\r\n\x05\x62ssid\x18\x01 \x01(\t\x12#\n\x08location\x18\x02 \x01(\x0b\x32\x11.WifiGeo.Location\x1a\x32\n\x08Location\x12\x0b\n\x03lat\x18\x01 \x01(\x03\x12\x0b\n\x03lon\x18\x02 \x01(\x03\x12\x0c\n\x04unk1\x18\x03 \x01(\x03\"^\n\tBSSIDResp\x12\x0c\n\x04unk1\x18\x01 \x01(\x03\x12\x16\n\x04wifi\x18\x02 \x03(\x0b\x32\x08.WifiGeo\x12\x0c\n\x04unk2\x18\x03 \x01(\x05\x12\x0c\n\x04unk3\x18\x04 \x01(\x05\x12\x0f\n\x07\x41PIName\x18\x05 \x01(\tb\x06proto3'
+    serialized_pb=b'\n\x10\x42SSIDApple.proto\"q\n\x07WifiGeo\x12\r\n\x05\x62ssid\x18\x01 \x01(\t\x12#\n\x08location\x18\x02 \x01(\x0b\x32\x11.WifiGeo.Location\x1a\x32\n\x08Location\x12\x0b\n\x03lat\x18\x01 \x01(\x03\x12\x0b\n\x03lon\x18\x02 \x01(\x03\x12\x0c\n\x04unk1\x18\x03 \x01(\x03\"^\n\tBSSIDResp\x12\x0c\n\x04unk1\x18\x01 \x01(\x03\x12\x16\n\x04wifi\x18\x02 \x03(\x0b\x32\x08.WifiGeo\x12\x0c\n\x04unk2\x18\x03 \x01(\x05\x12\x0c\n\x04unk3\x18\x04 \x01(\x05\x12\x0f\n\x07\x41PIName\x18\x05 \x01(\t\"Z\n\x08\x42SSIDReq\x12\x16\n\x04wifi\x18\x02 \x03(\x0b\x32\x08.WifiGeo\x12\x11\n\x04unk1\x18\x03 \x01(\x05H\x00\x88\x01\x01\x12\x11\n\x04unk2\x18\x04 \x01(\x05H\x01\x88\x01\x01\x42\x07\n\x05_unk1B\x07\n\x05_unk2b\x06proto3'
 )
 
 _WIFIGEO_LOCATION = _descriptor.Descriptor(
@@ -162,11 +162,74 @@ _BSSIDRESP = _descriptor.Descriptor(
     serialized_end=229,
 )
 
+_BSSIDREQ = _descriptor.Descriptor(
+    name='BSSIDReq',
+    full_name='BSSIDReq',
+    filename=None,
+    file=DESCRIPTOR,
+    containing_type=None,
+    create_key=_descriptor._internal_create_key,
+    fields=[
+        _descriptor.FieldDescriptor(
+            name='wifi', full_name='BSSIDReq.wifi', index=0,
+            number=2, type=11, cpp_type=10, label=3,
+            has_default_value=False, default_value=[],
+            message_type=None, enum_type=None, containing_type=None,
+            is_extension=False, extension_scope=None,
+            serialized_options=None, file=DESCRIPTOR, create_key=_descriptor._internal_create_key),
+        _descriptor.FieldDescriptor(
+            name='unk1', full_name='BSSIDReq.unk1', index=1,
+            number=3, type=5, cpp_type=1, label=1,
+            has_default_value=False, default_value=0,
+            message_type=None, enum_type=None, containing_type=None,
+            is_extension=False, extension_scope=None,
+            serialized_options=None, file=DESCRIPTOR, create_key=_descriptor._internal_create_key),
+        _descriptor.FieldDescriptor(
+            name='unk2', full_name='BSSIDReq.unk2', index=2,
+            number=4, type=5, cpp_type=1, label=1,
+            has_default_value=False, default_value=0,
+            message_type=None, enum_type=None, containing_type=None,
+            is_extension=False, extension_scope=None,
+            serialized_options=None, file=DESCRIPTOR, create_key=_descriptor._internal_create_key),
+    ],
+    extensions=[
+    ],
+    nested_types=[],
+    enum_types=[
+    ],
+    serialized_options=None,
+    is_extendable=False,
+    syntax='proto3',
+    extension_ranges=[],
+    oneofs=[
+        _descriptor.OneofDescriptor(
+            name='_unk1', full_name='BSSIDReq._unk1',
+            index=0, containing_type=None,
+            create_key=_descriptor._internal_create_key,
+            fields=[]),
+        _descriptor.OneofDescriptor(
+            name='_unk2', full_name='BSSIDReq._unk2',
+            index=1, containing_type=None,
+            create_key=_descriptor._internal_create_key,
+            fields=[]),
+    ],
+    serialized_start=231,
+    serialized_end=321,
+)
+
 _WIFIGEO_LOCATION.containing_type = _WIFIGEO
 _WIFIGEO.fields_by_name['location'].message_type = _WIFIGEO_LOCATION
 _BSSIDRESP.fields_by_name['wifi'].message_type = _WIFIGEO
+_BSSIDREQ.fields_by_name['wifi'].message_type = _WIFIGEO
+_BSSIDREQ.oneofs_by_name['_unk1'].fields.append(
+    _BSSIDREQ.fields_by_name['unk1'])
+_BSSIDREQ.fields_by_name['unk1'].containing_oneof = _BSSIDREQ.oneofs_by_name['_unk1']
+_BSSIDREQ.oneofs_by_name['_unk2'].fields.append(
+    _BSSIDREQ.fields_by_name['unk2'])
+_BSSIDREQ.fields_by_name['unk2'].containing_oneof = _BSSIDREQ.oneofs_by_name['_unk2']
 DESCRIPTOR.message_types_by_name['WifiGeo'] = _WIFIGEO
 DESCRIPTOR.message_types_by_name['BSSIDResp'] = _BSSIDRESP
+DESCRIPTOR.message_types_by_name['BSSIDReq'] = _BSSIDREQ
 _sym_db.RegisterFileDescriptor(DESCRIPTOR)
 
 WifiGeo = _reflection.GeneratedProtocolMessageType('WifiGeo', (_message.Message,), {
@@ -191,4 +254,11 @@ BSSIDResp = _reflection.GeneratedProtocolMessageType('BSSIDResp', (_message.Mess
 })
 _sym_db.RegisterMessage(BSSIDResp)
 
+BSSIDReq = _reflection.GeneratedProtocolMessageType('BSSIDReq', (_message.Message,), {
+    'DESCRIPTOR': _BSSIDREQ,
+    '__module__': 'BSSIDApple_pb2'
+    # @@protoc_insertion_point(class_scope:BSSIDReq)
+})
+_sym_db.RegisterMessage(BSSIDReq)
+
 # @@protoc_insertion_point(module_scope)
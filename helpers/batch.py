@@ -0,0 +1,155 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from helpers.bssid import RecordArray
+
+
+def read_identifiers(path):
+    """Reads the identifiers of a batch file, one BSSID or SSID per line.
+
+    Blank lines and lines starting with '#' are ignored.
+
+    Parameters:
+        path (str): The path of the batch file.
+
+    Returns:
+        list: The identifiers, in file order.
+    """
+    with open(path, 'r') as batch_file:
+        return [line.strip() for line in batch_file if line.strip() and not line.startswith('#')]
+
+
+def run_batch(identifiers, search_by, search, workers=16):
+    """Runs a lookup for every identifier, several at a time.
+
+    Parameters:
+        identifiers (list): The BSSIDs or SSIDs to search for.
+        search_by (str): Either 'bssid' or 'ssid'.
+        search (callable): The search function, called as search(bssid=...) or search(ssid=...).
+        workers (int, optional): The number of lookups running at the same time. Defaults to 16.
+
+    Yields:
+        tuple: The index of the identifier, the identifier and its results, in completion order.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(search, **{search_by: identifier}): index
+                   for index, identifier in enumerate(identifiers)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [{'module': 'batch', 'error': str(e)}]
+            yield index, identifiers[index], results
+
+
+def shard_worker(shard, search_by, threads, search, record, limiters, engine_options, output):
+    """Runs one shard of a sharded batch inside a worker process, with its own engine.
+
+    Parameters:
+        shard (list): The (index, identifier) tuples of the shard.
+        search_by (str): Either 'bssid' or 'ssid'.
+        threads (int): The number of lookups running at the same time in this process.
+        search (SearchMode): The search to run, bound to the engine of the worker.
+        record (str): The directory the provider responses are recorded in, or None.
+        limiters (dict): The rate limiters shared with the other workers.
+        engine_options (dict): Keyword arguments of the worker engine, e.g. its config and base_url.
+        output (multiprocessing.Queue): The queue receiving (index, identifier, records) tuples, the results
+            packed in a RecordArray, then the list of new negative cache misses of the worker and the tiers its
+            tiered searches stopped at.
+    """
+    from helpers.engine import Engine
+    from helpers.replay import Recorder
+
+    engine = Engine(max_workers=threads * 4, limiters=limiters, **engine_options)
+    if engine.negative_cache is not None:
+        engine.negative_cache.track_new_misses()
+    if record:
+        engine.hooks.append(Recorder(record))
+    search.bind(engine)
+    indexes = [index for index, _ in shard]
+
+    try:
+        for position, identifier, results in run_batch([identifier for _, identifier in shard], search_by, search,
+                                                       threads):
+            # Packed results pickle to a fraction of the size of their dictionaries
+            output.put((indexes[position], identifier, RecordArray.from_results(results)))
+    finally:
+        # The requests are booked on the ledger shared with the parent, which saves it, only the tiers are reported
+        stops = dict(search.planner.stops) if search.planner is not None else None
+        # Tell the parent this worker is done, handing over the misses it found
+        output.put(('done', engine.negative_cache.new_misses if engine.negative_cache is not None else [], stops))
+
+
+def run_sharded_batch(identifiers, search_by, processes, threads=16, search=None, record=None):
+    """Runs a batch across several worker processes, so response parsing is not bound to a single core.
+
+    The identifiers are dealt round-robin to the workers. Every provider rate limit is shared by all the
+    workers, and the results are merged back in input order.
+
+    Parameters:
+        identifiers (list): The BSSIDs or SSIDs to search for.
+        search_by (str): Either 'bssid' or 'ssid'.
+        processes (int): The number of worker processes.
+        threads (int, optional): The number of lookups running at the same time in each process. Defaults to 16.
+        search (SearchMode, optional): The search every worker runs. Defaults to a plain provider search. A
+            tiered search shares its quota ledger with the workers, and gets the tier counts of their searches.
+        record (str, optional): The directory the workers record the provider responses in.
+
+    Yields:
+        tuple: The index of the identifier, the identifier and its results as a RecordArray, in input order.
+    """
+    import multiprocessing
+
+    from helpers.engine import PROVIDERS, SharedRateLimiter, get_engine
+    from helpers.search import SearchMode
+
+    engine = get_engine()
+    search = search if search is not None else SearchMode()
+    # Every worker books its requests against the quotas and cost budget of the whole run
+    search.share_ledger()
+    limiters = {}
+    for provider in PROVIDERS.values():
+        rate = engine.rate_limit(provider)
+        if rate:
+            limiters[provider.name] = SharedRateLimiter(rate)
+
+    engine_options = {'config': engine.config, 'base_url': engine.base_url, 'negative_cache': engine.negative_cache}
+    output = multiprocessing.Queue(maxsize=threads * processes * 4)
+    workers = []
+    for number in range(processes):
+        shard = [(index, identifiers[index]) for index in range(number, len(identifiers), processes)]
+        worker = multiprocessing.Process(target=shard_worker, daemon=True, args=(
+            shard, search_by, threads, search, record, limiters, engine_options, output))
+        worker.start()
+        workers.append(worker)
+
+    # Single ordered writer: hold early results back until every previous index has been yielded
+    pending = {}
+    next_index = 0
+    running = processes
+    while running:
+        try:
+            item = output.get(timeout=1)
+        except queue.Empty:
+            if not any(worker.is_alive() for worker in workers):
+                break
+            continue
+        if item[0] == 'done':
+            running -= 1
+            if engine.negative_cache is not None:
+                for provider, key in item[1]:
+                    engine.negative_cache.add(provider, key)
+            if item[2] is not None and search.planner is not None:
+                search.planner.stops.update(item[2])
+            continue
+        pending[item[0]] = item
+        while next_index in pending:
+            yield pending.pop(next_index)
+            next_index += 1
+    for worker in workers:
+        worker.join()
+    # Results of workers that crashed never arrive, report them instead of stopping silently
+    for index in range(next_index, len(identifiers)):
+        yield pending.pop(index, (index, identifiers[index],
+                                  RecordArray.from_results([{'module': 'batch', 'error': 'Worker process failed'}])))
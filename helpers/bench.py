@@ -0,0 +1,187 @@
+"""Offline benchmark of geowifi lookups against recorded provider responses.
+
+Record responses first with `python3 geowifi.py <identifier> --record <directory>`, then run:
+
+    python3 -m helpers.bench <directory> --latency 0.05 --jitter 0.02 --error-rate 0.01
+
+Add --slow-rate 0.02 --slow-latency 1 for a long latency tail, and --hedge to measure hedged requests against it.
+
+Use --save to keep the measurements and --baseline to fail when a run regresses against them.
+"""
+import argparse
+import json
+import resource
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+
+from rich.console import Console
+from rich.table import Table
+
+from helpers.batch import run_batch
+from helpers.engine import PROVIDERS, Engine, read_config, select_providers
+from helpers.providers import search_networks
+from helpers.replay import create_stub_server, load_recordings, recorded_queries
+
+console = Console()
+
+
+def percentile(values, fraction):
+    """Returns the value below which the given fraction of the values fall."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(name, run, count):
+    """Runs a benchmark and collects throughput, latency and memory figures.
+
+    Parameters:
+        name (str): The name of the benchmark.
+        run (callable): Called with no arguments, returns the list of per-lookup latencies in seconds.
+        count (int): The number of lookups done by run().
+
+    Returns:
+        dict: The measurements of the benchmark.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    latencies = run()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'name': name,
+        'lookups': count,
+        'lookups_per_second': count / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'mean_ms': statistics.mean(latencies) * 1000 if latencies else 0.0,
+        'peak_alloc_mb': peak / 2 ** 20,
+    }
+
+
+def bench_single(engine, search_by, queries, rounds):
+    """Benchmarks sequential search_networks() calls."""
+
+    def run():
+        latencies = []
+        for _ in range(rounds):
+            for query in queries:
+                start = time.perf_counter()
+                search_networks(**{search_by: query}, engine=engine, use_cache=False)
+                latencies.append(time.perf_counter() - start)
+        return latencies
+
+    return measure(f'single/{search_by}', run, len(queries) * rounds)
+
+
+def bench_batch(engine, search_by, queries, rounds, workers):
+    """Benchmarks the batch mode."""
+    identifiers = queries * rounds
+
+    def run():
+        latencies = []
+        lock = threading.Lock()
+
+        def search(**kwargs):
+            begin = time.perf_counter()
+            results = search_networks(**kwargs, engine=engine, use_cache=False)
+            with lock:
+                latencies.append(time.perf_counter() - begin)
+            return results
+
+        for _ in run_batch(identifiers, search_by, search, workers):
+            pass
+        return latencies
+
+    return measure(f'batch/{search_by}', run, len(identifiers))
+
+
+def print_report(measurements):
+    table = Table(show_header=True, header_style='bright_yellow', title='Benchmark')
+    for column in ('Benchmark', 'Lookups', 'Lookups/s', 'p50 (ms)', 'p99 (ms)', 'Mean (ms)', 'Peak alloc (MB)'):
+        table.add_column(column, style='bright_blue', justify='right')
+    for m in measurements:
+        table.add_row(m['name'], str(m['lookups']), f'{m["lookups_per_second"]:.1f}', f'{m["p50_ms"]:.2f}',
+                      f'{m["p99_ms"]:.2f}', f'{m["mean_ms"]:.2f}', f'{m["peak_alloc_mb"]:.2f}')
+    console.print(table)
+    # ru_maxrss is reported in kilobytes on Linux
+    console.print(f' Max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB')
+
+
+def compare(measurements, baseline, tolerance):
+    """Returns the list of regressions against a baseline run."""
+    previous = {m['name']: m for m in baseline}
+    regressions = []
+    for m in measurements:
+        before = previous.get(m['name'])
+        if not before:
+            continue
+        if m['lookups_per_second'] < before['lookups_per_second'] * (1 - tolerance):
+            regressions.append(f'{m["name"]}: throughput {m["lookups_per_second"]:.1f}/s '
+                               f'(baseline {before["lookups_per_second"]:.1f}/s)')
+        if m['p99_ms'] > before['p99_ms'] * (1 + tolerance):
+            regressions.append(f'{m["name"]}: p99 {m["p99_ms"]:.2f} ms (baseline {before["p99_ms"]:.2f} ms)')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark geowifi lookups against recorded provider responses.')
+    parser.add_argument('recordings', help='Directory holding the responses recorded with --record')
+    parser.add_argument('--latency', type=float, default=0.0, help='Mean simulated provider latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Maximum latency deviation in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests failing with 503')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='Fraction of responses delayed by --slow-latency')
+    parser.add_argument('--slow-latency', type=float, default=0.0, help='Extra delay of the slow responses in seconds')
+    parser.add_argument('--hedge', action='store_true', help='Duplicate the requests slower than the rolling p95')
+    parser.add_argument('--rounds', type=int, default=5, help='Number of passes over the recorded queries')
+    parser.add_argument('--workers', type=int, default=16, help='Concurrent lookups in the batch benchmark')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the simulated latency and errors')
+    parser.add_argument('--save', help='Write the measurements to this JSON file')
+    parser.add_argument('--baseline', help='Compare against measurements saved with --save')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression (default: 0.2)')
+    args = parser.parse_args()
+
+    recordings = load_recordings(args.recordings)
+    server = create_stub_server(recordings, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                seed=args.seed, slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # The stub is local, so the provider rate limits would only measure the limiter itself
+    config = dict(read_config())
+    config['rate_limits'] = {name: 0 for name in PROVIDERS}
+    if args.hedge:
+        config['hedge'] = dict(config.get('hedge') or {}, enabled=True)
+    engine = Engine(config=config, base_url=f'http://127.0.0.1:{server.server_address[1]}', backoff=0.01)
+
+    measurements = []
+    for search_by in ('bssid', 'ssid'):
+        queries = recorded_queries(recordings, select_providers(search_by))
+        if not queries:
+            continue
+        measurements.append(bench_single(engine, search_by, queries, args.rounds))
+        measurements.append(bench_batch(engine, search_by, queries, args.rounds, args.workers))
+    server.shutdown()
+
+    print_report(measurements)
+    if engine.hedger is not None:
+        stats = engine.hedger.stats
+        console.print(f' Hedged: {stats["hedges"]} of {stats["calls"]} requests, {stats["hedge_wins"]} answered first '
+                      f'by the duplicate')
+    if args.save:
+        with open(args.save, 'w') as output:
+            json.dump(measurements, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(measurements, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            console.print(f' [:red_circle:] Regression: {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
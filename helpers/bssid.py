@@ -0,0 +1,262 @@
+import re
+from array import array
+
+# Accepted BSSID notations: colon (aa:bb:cc:dd:ee:ff), dash (aa-bb-cc-dd-ee-ff), dotted Cisco (aabb.ccdd.eeff) and
+# bare hex (aabbccddeeff)
+BSSID_PATTERN = re.compile(
+    r'^(?:[0-9A-Fa-f]{2}([:-])[0-9A-Fa-f]{2}(?:\1[0-9A-Fa-f]{2}){4}'
+    r'|[0-9A-Fa-f]{4}\.[0-9A-Fa-f]{4}\.[0-9A-Fa-f]{4}'
+    r'|[0-9A-Fa-f]{12})$'
+)
+# Colon notation without zero padding, as returned by the Apple location service (e.g. 0:1a:2b:3c:4d:5)
+UNPADDED_PATTERN = re.compile(r'^[0-9A-Fa-f]{1,2}(?::[0-9A-Fa-f]{1,2}){5}$')
+SEPARATORS = str.maketrans('', '', ':-.')
+
+# Fixed-point scale of the coordinates stored in records: degrees * 1e7 fits an int32
+COORDINATE_SCALE = 10 ** 7
+
+# Record flags
+FLAG_STALE = 2  # Position older than the refresh policy allows, or no longer located by a refresh
+FLAG_MOVED = 4  # Refreshed position far from the previous one, see helpers.refresh
+FLAG_ERROR = 8  # Error result, the record carries the message instead of a position
+
+
+def is_valid_bssid(bssid):
+    """Checks if a string is a valid BSSID.
+
+    A valid BSSID uses one of the colon (XX:XX:XX:XX:XX:XX), dash (XX-XX-XX-XX-XX-XX), dotted Cisco (XXXX.XXXX.XXXX)
+    or bare (XXXXXXXXXXXX) notations, where X is a hexadecimal digit.
+
+    Parameters:
+        bssid (str): The string to be checked.
+
+    Returns:
+        bool: True if the string is a valid BSSID, False otherwise.
+    """
+    return BSSID_PATTERN.match(bssid) is not None
+
+
+def bssid_to_int(bssid):
+    """Converts a BSSID in any accepted notation to its 48-bit integer key.
+
+    Parameters:
+        bssid (str): The BSSID to convert.
+
+    Returns:
+        int: The integer key of the BSSID, or None if the string is not a BSSID.
+    """
+    bssid = str(bssid).strip()
+    if BSSID_PATTERN.match(bssid):
+        return int(bssid.translate(SEPARATORS), 16)
+    if UNPADDED_PATTERN.match(bssid):
+        key = 0
+        for octet in bssid.split(':'):
+            key = (key << 8) | int(octet, 16)
+        return key
+    return None
+
+
+def int_to_bssid(key):
+    """Formats a 48-bit integer key as a lowercase colon-separated BSSID."""
+    digits = f'{key:012x}'
+    return ':'.join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+def normalize_bssid(bssid):
+    """Returns a BSSID in lowercase colon notation, or None if the string is not a BSSID."""
+    key = bssid_to_int(bssid)
+    return None if key is None else int_to_bssid(key)
+
+
+def bssids_to_ints(bssids):
+    """Converts many BSSIDs to integer keys at once.
+
+    Parameters:
+        bssids (iterable): The BSSIDs, in any accepted notation.
+
+    Returns:
+        tuple: An array('Q') with the keys of the valid BSSIDs, and the list of the invalid strings.
+    """
+    keys = array('Q')
+    invalid = []
+    match = BSSID_PATTERN.match
+    for bssid in bssids:
+        if match(bssid):
+            keys.append(int(bssid.translate(SEPARATORS), 16))
+        else:
+            key = bssid_to_int(bssid)
+            if key is None:
+                invalid.append(bssid)
+            else:
+                keys.append(key)
+    return keys, invalid
+
+
+class StringTable:
+    """Interns strings, such as module names or error messages, into small integer ids, so records do not carry a
+    string each."""
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def id(self, name):
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        return self.ids[name]
+
+    def name(self, string_id):
+        return self.names[string_id]
+
+
+MODULES = StringTable()
+MESSAGES = StringTable()
+# The result keys a record holds in its columns, results with any other key are kept whole
+RECORD_FIELDS = {'module', 'bssid', 'latitude', 'longitude'}
+
+
+class Record:
+    """A search result, with its BSSID key, module id and fixed-point coordinates, or its error message id.
+
+    Results that do not fit these fields, e.g. vendor checks or SSID results, keep their dictionary in extra.
+    """
+
+    __slots__ = ('key', 'module', 'lat', 'lon', 'flags', 'message', 'extra')
+
+    def __init__(self, key, module, lat, lon, flags=0, message=0, extra=None):
+        self.key = key
+        self.module = module
+        self.lat = lat
+        self.lon = lon
+        self.flags = flags
+        self.message = message
+        self.extra = extra
+
+    @classmethod
+    def from_result(cls, result, flags=0):
+        """Builds a record from a search result."""
+        module = result.get('module')
+        if isinstance(module, str) and len(result) == 2 and isinstance(result.get('error'), str):
+            return cls(0, MODULES.id(module), 0, 0, flags | FLAG_ERROR, MESSAGES.id(result['error']))
+        if isinstance(module, str) and result.keys() == RECORD_FIELDS:
+            key = bssid_to_int(result['bssid'])
+            try:
+                lat = round(float(result['latitude']) * COORDINATE_SCALE)
+                lon = round(float(result['longitude']) * COORDINATE_SCALE)
+            except (TypeError, ValueError):
+                key = None
+            if key is not None and -2 ** 31 <= lat < 2 ** 31 and -2 ** 31 <= lon < 2 ** 31:
+                return cls(key, MODULES.id(module), lat, lon, flags)
+        return cls(0, 0, 0, 0, flags, extra=dict(result))
+
+    @property
+    def latitude(self):
+        return self.lat / COORDINATE_SCALE
+
+    @property
+    def longitude(self):
+        return self.lon / COORDINATE_SCALE
+
+    def to_result(self):
+        if self.extra is not None:
+            return dict(self.extra)
+        if self.flags & FLAG_ERROR:
+            return {'module': MODULES.name(self.module), 'error': MESSAGES.name(self.message)}
+        return {
+            'module': MODULES.name(self.module),
+            'bssid': int_to_bssid(self.key),
+            'latitude': self.latitude,
+            'longitude': self.longitude
+        }
+
+
+class RecordArray:
+    """Column-oriented storage for many search results: about 22 bytes per result instead of a dictionary each.
+
+    Arrays are pickled with the names of their module and message ids, so they can be sent between processes, whose
+    string tables differ.
+    """
+
+    def __init__(self):
+        self.keys = array('Q')
+        self.modules = array('B')
+        self.lats = array('i')
+        self.lons = array('i')
+        self.flags = array('B')
+        self.messages = array('I')
+        # Results kept whole, by row
+        self.extras = {}
+
+    @classmethod
+    def from_results(cls, results, flags=0):
+        records = cls()
+        records.extend_results(results, flags)
+        return records
+
+    def __len__(self):
+        return len(self.keys)
+
+    def append(self, record):
+        if record.extra is not None:
+            self.extras[len(self.keys)] = record.extra
+        self.keys.append(record.key)
+        self.modules.append(record.module)
+        self.lats.append(record.lat)
+        self.lons.append(record.lon)
+        self.flags.append(record.flags)
+        self.messages.append(record.message)
+
+    def extend_results(self, results, flags=0):
+        """Appends search results."""
+        for result in results:
+            self.append(Record.from_result(result, flags))
+
+    def extend(self, other):
+        """Appends the records of another array."""
+        offset = len(self)
+        for column in ('keys', 'modules', 'lats', 'lons', 'flags', 'messages'):
+            getattr(self, column).extend(getattr(other, column))
+        self.extras.update((offset + row, extra) for row, extra in other.extras.items())
+
+    def take(self, rows):
+        """Returns a new array with the given rows, in the given order."""
+        taken = RecordArray()
+        for row in rows:
+            taken.append(self[row])
+        return taken
+
+    def __getitem__(self, row):
+        return Record(self.keys[row], self.modules[row], self.lats[row], self.lons[row], self.flags[row],
+                      self.messages[row], self.extras.get(row))
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def results(self, start=0, end=None):
+        """Yields the rows from start to end as search result dictionaries."""
+        for row in range(start, len(self) if end is None else end):
+            yield self[row].to_result()
+
+    def to_results(self):
+        return list(self.results())
+
+    def __getstate__(self):
+        state = {column: getattr(self, column) for column in ('keys', 'modules', 'lats', 'lons', 'flags', 'messages',
+                                                               'extras')}
+        # Ids are only meaningful in this process, send the names along
+        # Rows kept whole carry module 0, which may not name a module yet in this process
+        state['module_names'] = {module_id: MODULES.name(module_id) for module_id in set(self.modules)
+                                 if module_id < len(MODULES.names)}
+        state['message_names'] = {message_id: MESSAGES.name(message_id) for message_id in set(self.messages)
+                                  if message_id < len(MESSAGES.names)}
+        return state
+
+    def __setstate__(self, state):
+        module_ids = {module_id: MODULES.id(name) for module_id, name in state.pop('module_names').items()}
+        message_ids = {message_id: MESSAGES.id(name) for message_id, name in state.pop('message_names').items()}
+        for column, value in state.items():
+            setattr(self, column, value)
+        self.modules = array('B', (module_ids.get(module_id, 0) for module_id in self.modules))
+        self.messages = array('I', (message_ids.get(message_id, 0) for message_id in self.messages))
@@ -0,0 +1,76 @@
+import threading
+
+
+class PendingBatch:
+    """The queries gathered for one shared request, and its outcome once sent."""
+
+    def __init__(self):
+        self.queries = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class QueryBatcher:
+    """Sends the concurrent queries of a provider that accepts several of them at once in shared requests.
+
+    The first query of a batch waits up to linger seconds for others to join, or until the batch is full, then sends
+    them all in one request. Every query of the batch receives the same decoded payload, and the provider parser
+    picks its own answer out of it.
+
+    Parameters:
+        size (int): The maximum number of queries sent in one request.
+        linger (float, optional): The number of seconds a batch waits for more queries. Defaults to 0.01.
+    """
+
+    def __init__(self, size, linger=0.01):
+        self.size = size
+        self.linger = linger
+        self.requests = 0
+        self.queries = 0
+        self._open = None
+        self._lock = threading.Lock()
+
+    def run(self, query, send):
+        """Adds a query to the open batch and returns the answer of the request it was sent in.
+
+        Parameters:
+            query (str): The query to send.
+            send (callable): Called as send(queries) with the list of queries of a batch, returns the answer.
+
+        Returns:
+            The answer of the shared request.
+
+        Raises:
+            Exception: The error of the shared request.
+        """
+        with self._lock:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = PendingBatch()
+            if query not in batch.queries:
+                batch.queries.append(query)
+            if len(batch.queries) >= self.size:
+                # Full: later queries start the next batch
+                self._open = None
+                batch.full.set()
+        if leader:
+            batch.full.wait(self.linger)
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+                self.requests += 1
+                self.queries += len(batch.queries)
+            try:
+                batch.result = send(batch.queries)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.result
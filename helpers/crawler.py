@@ -0,0 +1,390 @@
+"""Crawler prefilling the BSSID position store with the access points Apple knows in a region.
+
+Every Apple wloc answer lists the access points around the queried one. The crawler starts from seed BSSIDs, stores
+every access point the answers list, and queries the ones inside the region next, closest to the region centre
+first, so the crawl grows outwards from the centre and stops at the region border.
+
+Neighbouring access points return mostly the same neighbours, so a frontier point closer than the spacing to an
+access point already queried is stored without being queried itself.
+
+Run `python3 -m helpers.crawler --help` to start or resume a crawl.
+"""
+import argparse
+import heapq
+import json
+import os
+import time
+from array import array
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import helpers.providers  # noqa: F401, registers apple_wloc
+from helpers.bssid import bssid_to_int, int_to_bssid
+from helpers.engine import PROVIDERS, RateLimiter, get_engine
+from helpers.store import Position, distance, module_mask, open_default_store
+
+# Degrees of latitude per metre, to size the spacing grid
+DEGREES_PER_METRE = 1 / 111320
+
+
+class BoundingBox:
+    """A latitude and longitude rectangle.
+
+    Parameters:
+        south (float): The southern latitude.
+        west (float): The western longitude.
+        north (float): The northern latitude.
+        east (float): The eastern longitude.
+    """
+
+    def __init__(self, south, west, north, east):
+        self.south, self.west, self.north, self.east = south, west, north, east
+
+    @property
+    def center(self):
+        return (self.south + self.north) / 2, (self.west + self.east) / 2
+
+    def contains(self, lat, lon):
+        return self.south <= lat <= self.north and self.west <= lon <= self.east
+
+    def to_json(self):
+        return {'bbox': [self.south, self.west, self.north, self.east]}
+
+
+class Polygon:
+    """A polygon region, tested with ray casting after a bounding box check.
+
+    Parameters:
+        points (list): The (latitude, longitude) vertices, in order.
+    """
+
+    def __init__(self, points):
+        self.points = [(float(lat), float(lon)) for lat, lon in points]
+        lats = [lat for lat, _ in self.points]
+        lons = [lon for _, lon in self.points]
+        self.bounds = BoundingBox(min(lats), min(lons), max(lats), max(lons))
+
+    @property
+    def center(self):
+        return (sum(lat for lat, _ in self.points) / len(self.points),
+                sum(lon for _, lon in self.points) / len(self.points))
+
+    def contains(self, lat, lon):
+        if not self.bounds.contains(lat, lon):
+            return False
+        inside = False
+        previous_lat, previous_lon = self.points[-1]
+        for point_lat, point_lon in self.points:
+            if (point_lat > lat) != (previous_lat > lat):
+                crossing = point_lon + (lat - point_lat) * (previous_lon - point_lon) / (previous_lat - point_lat)
+                if lon < crossing:
+                    inside = not inside
+            previous_lat, previous_lon = point_lat, point_lon
+        return inside
+
+    def to_json(self):
+        return {'polygon': self.points}
+
+
+def region_from_json(data):
+    """Returns the region saved with to_json, or read from a GeoJSON Polygon, Feature or FeatureCollection."""
+    if 'bbox' in data and 'type' not in data:
+        return BoundingBox(*data['bbox'])
+    if 'polygon' in data:
+        return Polygon(data['polygon'])
+    if data.get('type') == 'FeatureCollection':
+        data = data['features'][0]
+    if data.get('type') == 'Feature':
+        data = data['geometry']
+    if data.get('type') != 'Polygon':
+        raise ValueError('The region must be a GeoJSON Polygon')
+    # GeoJSON positions are longitude, latitude; only the outer ring is used
+    return Polygon([(lat, lon) for lon, lat, *_ in data['coordinates'][0]])
+
+
+class CrawlState:
+    """The progress of a crawl, persisted so an interrupted crawl resumes where it stopped.
+
+    The visited and discovered BSSID keys are appended to binary files as the crawl goes, the frontier is rewritten
+    on every save.
+
+    Parameters:
+        directory (str): The directory the state is kept in.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.stats = {'requests': 0, 'discovered': 0, 'stored': 0, 'errors': 0}
+        self.region = None
+        self.frontier = []
+        try:
+            with open(os.path.join(directory, 'state.json'), 'r') as state_file:
+                state = json.load(state_file)
+            self.stats.update(state.get('stats', {}))
+            self.region = state.get('region')
+        except (FileNotFoundError, ValueError):
+            pass
+        self.visited = set(self.load('visited.bin', 'Q'))
+        self.discovered = set(self.load('discovered.bin', 'Q'))
+        # (distance to the region centre, key, latitude, longitude) tuples
+        entries = self.load('frontier.bin', 'd')
+        self.frontier = [(entries[i], int(entries[i + 1]), entries[i + 2], entries[i + 3])
+                         for i in range(0, len(entries) - 3, 4)]
+        heapq.heapify(self.frontier)
+        self._new = {'visited.bin': array('Q'), 'discovered.bin': array('Q')}
+
+    def load(self, name, code):
+        values = array(code)
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as source:
+                data = source.read()
+            values.frombytes(data[:len(data) - len(data) % values.itemsize])
+        except FileNotFoundError:
+            pass
+        return values
+
+    def visit(self, key):
+        self.visited.add(key)
+        self._new['visited.bin'].append(key)
+
+    def discover(self, key):
+        self.discovered.add(key)
+        self._new['discovered.bin'].append(key)
+
+    def save(self, in_flight=()):
+        """Writes the progress; the points still being queried go back to the frontier."""
+        os.makedirs(self.directory, exist_ok=True)
+        for name, values in self._new.items():
+            if values:
+                with open(os.path.join(self.directory, name), 'ab') as output:
+                    values.tofile(output)
+                self._new[name] = array('Q')
+        frontier = array('d')
+        for entry in list(self.frontier) + list(in_flight):
+            frontier.extend(entry)
+        path = os.path.join(self.directory, 'frontier.bin')
+        with open(path + '.tmp', 'wb') as output:
+            frontier.tofile(output)
+        os.replace(path + '.tmp', path)
+        path = os.path.join(self.directory, 'state.json')
+        with open(path + '.tmp', 'w') as state_file:
+            json.dump({'region': self.region, 'stats': self.stats}, state_file)
+        os.replace(path + '.tmp', path)
+
+
+class Crawler:
+    """Crawls the Apple neighbourhoods of a region into the position store.
+
+    Parameters:
+        region (BoundingBox or Polygon): The region to crawl.
+        store (PositionStore): The store the discovered access points are written to.
+        state_dir (str): The directory of the persisted crawl state.
+        engine (Engine, optional): The engine running the queries. Defaults to the process-wide engine.
+        workers (int, optional): The number of requests running at the same time. Defaults to 8.
+        spacing (float, optional): Frontier points closer than this many metres to a queried access point are not
+            queried. 0 queries every access point of the region. Defaults to 50.
+        rate (float, optional): The Apple requests per second, unless the configuration sets a rate limit.
+            Defaults to 5.
+        on_request (callable, optional): Called as on_request(report) after every request.
+    """
+
+    def __init__(self, region, store, state_dir, engine=None, workers=8, spacing=50, rate=5, on_request=None):
+        self.region = region
+        self.store = store
+        self.engine = engine or get_engine()
+        self.workers = workers
+        self.spacing = spacing
+        self.on_request = on_request
+        self.provider = PROVIDERS['apple_wloc']
+        self.state = CrawlState(state_dir)
+        self.state.region = region.to_json()
+        self.center = region.center
+        # Cells of the spacing grid holding the queried positions, rebuilt from the store on resume
+        self.covered = {}
+        visited = list(self.state.visited)
+        for position in self.store.get_many(visited) if visited else ():
+            if position is not None:
+                self.cover(position.latitude, position.longitude)
+        self.pending = set()
+        if rate and not self.engine.rate_limit(self.provider):
+            self.engine.limiters.setdefault(self.provider.name, RateLimiter(rate))
+
+    def cell(self, lat, lon):
+        size = self.spacing * DEGREES_PER_METRE
+        return int(lat // size), int(lon // size)
+
+    def is_covered(self, lat, lon):
+        """Checks whether an access point closer than the spacing was already queried."""
+        if not self.spacing:
+            return False
+        cell_lat, cell_lon = self.cell(lat, lon)
+        for near_lat in (cell_lat - 1, cell_lat, cell_lat + 1):
+            for near_lon in (cell_lon - 1, cell_lon, cell_lon + 1):
+                for point_lat, point_lon in self.covered.get((near_lat, near_lon), ()):
+                    if distance(lat, lon, point_lat, point_lon) < self.spacing:
+                        return True
+        return False
+
+    def cover(self, lat, lon):
+        if self.spacing:
+            self.covered.setdefault(self.cell(lat, lon), []).append((lat, lon))
+
+    def push(self, key, lat, lon):
+        heapq.heappush(self.state.frontier,
+                       (distance(self.center[0], self.center[1], lat, lon), key, lat, lon))
+
+    def seed(self, bssids):
+        """Adds seed BSSIDs to the frontier; they are queried first, wherever they are."""
+        for bssid in bssids:
+            key = bssid_to_int(bssid)
+            if key is not None and key not in self.state.visited:
+                heapq.heappush(self.state.frontier, (-1.0, key, *self.center))
+
+    def absorb(self, key, results):
+        """Stores the access points of an answer and queues the new ones inside the region.
+
+        Returns:
+            dict: The report of the request.
+        """
+        report = {'bssid': int_to_bssid(key), 'returned': 0, 'discovered': 0, 'queued': 0}
+        if not isinstance(results, list):
+            report['error'] = results.get('error', '') if isinstance(results, dict) else str(results)
+            self.state.stats['errors'] += 1
+            return report
+        now = time.time()
+        mask = module_mask(['apple', 'crawler'])
+        fresh = []
+        for result in results:
+            neighbour = bssid_to_int(result['bssid'])
+            if neighbour is None:
+                continue
+            report['returned'] += 1
+            lat, lon = result['latitude'], result['longitude']
+            if neighbour == key:
+                self.cover(lat, lon)
+            if neighbour in self.state.discovered:
+                continue
+            self.state.discover(neighbour)
+            report['discovered'] += 1
+            position = Position.from_results(neighbour, [result], now)
+            position.modules = mask
+            fresh.append(position)
+            if neighbour not in self.state.visited and self.region.contains(lat, lon):
+                self.push(neighbour, lat, lon)
+                report['queued'] += 1
+        # Keep the positions other modules already confirmed
+        existing = self.store.get_many([position.key for position in fresh])
+        stored = [position for position, known in zip(fresh, existing) if known is None]
+        self.store.append(stored)
+        report['stored'] = len(stored)
+        self.state.stats['requests'] += 1
+        self.state.stats['discovered'] += report['discovered']
+        self.state.stats['stored'] += len(stored)
+        return report
+
+    def next_point(self):
+        """Pops the closest frontier point still worth a request, or None when the frontier is exhausted."""
+        while self.state.frontier:
+            entry = heapq.heappop(self.state.frontier)
+            _, key, lat, lon = entry
+            if key in self.state.visited or key in self.pending or (entry[0] >= 0 and self.is_covered(lat, lon)):
+                continue
+            return entry
+        return None
+
+    def run(self, max_requests=None, save_every=50):
+        """Crawls until the frontier is exhausted, max_requests were sent or the crawl is interrupted.
+
+        Returns:
+            dict: The totals of the crawl, including the earlier runs of a resumed crawl.
+        """
+        in_flight = {}
+        sent = 0
+        answered = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                while True:
+                    while len(in_flight) < self.workers and (max_requests is None or sent < max_requests):
+                        entry = self.next_point()
+                        if entry is None:
+                            break
+                        self.pending.add(entry[1])
+                        # Cover the point now, so the requests in flight do not all target the same block
+                        if entry[0] >= 0:
+                            self.cover(entry[2], entry[3])
+                        future = executor.submit(self.engine.query, self.provider, int_to_bssid(entry[1]))
+                        in_flight[future] = entry
+                        sent += 1
+                    if not in_flight:
+                        break
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        entry = in_flight.pop(future)
+                        self.pending.discard(entry[1])
+                        self.state.visit(entry[1])
+                        answered += 1
+                        try:
+                            results = future.result()
+                        except Exception as e:
+                            results = {'module': 'crawler', 'error': str(e)}
+                        report = self.absorb(entry[1], results)
+                        if self.on_request is not None:
+                            self.on_request(report)
+                    if answered >= save_every:
+                        self.state.save(in_flight.values())
+                        answered = 0
+            finally:
+                for future in in_flight:
+                    future.cancel()
+                # Unanswered points go back to the frontier, to be queried again on resume
+                self.state.save(in_flight.values())
+        return dict(self.state.stats, frontier=len(self.state.frontier))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prefill the geowifi position store with the Apple-known access '
+                                                 'points of a region.')
+    parser.add_argument('seeds', nargs='*', help='Seed BSSIDs (not needed to resume a crawl)')
+    parser.add_argument('--bbox', help='Region as south,west,north,east')
+    parser.add_argument('--polygon', metavar='FILE', help='Region as a GeoJSON Polygon file')
+    parser.add_argument('--state', default='results/crawl', help='Directory of the crawl state (default: '
+                                                                  'results/crawl)')
+    parser.add_argument('--max-requests', type=int, help='Stop after this many requests')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent requests (default: 8)')
+    parser.add_argument('--rate', type=float, default=5, help='Requests per second (default: 5)')
+    parser.add_argument('--spacing', type=float, default=50,
+                        help='Do not query access points closer than this many metres to a queried one (default: 50)')
+    parser.add_argument('--quiet', action='store_true', help='Only print the totals')
+    args = parser.parse_args()
+
+    engine = get_engine()
+    store = open_default_store(engine.config)
+    if store is None:
+        parser.error('the position store is disabled in the configuration')
+    if args.bbox:
+        region = BoundingBox(*(float(value) for value in args.bbox.split(',')))
+    elif args.polygon:
+        with open(args.polygon, 'r') as region_file:
+            region = region_from_json(json.load(region_file))
+    else:
+        saved = CrawlState(args.state).region
+        if saved is None:
+            parser.error('--bbox or --polygon is required to start a crawl')
+        region = region_from_json(saved)
+
+    def report(entry):
+        if not args.quiet:
+            print(json.dumps(entry))
+
+    crawler = Crawler(region, store, args.state, engine, args.workers, args.spacing, args.rate, report)
+    crawler.seed(args.seeds)
+    if not crawler.state.frontier:
+        parser.error('the frontier is empty: give seed BSSIDs inside the region')
+    try:
+        totals = crawler.run(args.max_requests)
+    except KeyboardInterrupt:
+        totals = dict(crawler.state.stats, frontier=len(crawler.state.frontier))
+    print(json.dumps(totals))
+
+
+if __name__ == '__main__':
+    main()
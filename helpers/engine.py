@@ -0,0 +1,630 @@
+import collections
+import functools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+import yaml
+
+from helpers.coalesce import QueryBatcher
+from helpers.hedge import Hedger
+from helpers.profiling import span
+from helpers.resolver import CachedDNSAdapter, DNSCache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
+
+# Status codes worth retrying, every other response is handed to the provider parser
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+@functools.lru_cache(maxsize=None)
+def read_config():
+    """Loads the configuration data from config.yaml file.
+
+    The file is parsed only once per process, subsequent calls return the cached dictionary.
+
+    Returns:
+        dict: A dictionary containing the configuration data.
+    """
+    try:
+        # Open the config.yaml file in read mode
+        with span('config'), open('gw_utils/config.yaml', 'r') as config_file:
+            # Parse the contents of the file into a dictionary
+            parsed_config = yaml.safe_load(config_file)
+            return parsed_config
+    except FileNotFoundError:
+        # Return an error message if the file is not found
+        return {'error': 'config.yaml file not found'}
+    except yaml.YAMLError:
+        # Return an error message if there is an error parsing the file
+        return {'error': 'Error parsing config.yaml file'}
+
+
+class ProviderError(Exception):
+    """Raised by a response parser when the provider answered with an error."""
+
+
+class NotFound(ProviderError):
+    """Raised by a response parser when the provider has no data for the query."""
+
+
+class Provider:
+    """Declarative definition of a geolocation data source.
+
+    Parameters:
+        name (str): The unique name of the provider, e.g. 'wigle_bssid'.
+        module (str): The module name reported in the results, e.g. 'wigle'.
+        search_by (str): Either 'bssid' or 'ssid'.
+        endpoint (str): The URL of the API. May contain {api_key} and {query} placeholders.
+        build_request (callable): Called as build_request(query, api_key), returns the keyword arguments
+            (headers, params, json, data) for the HTTP request.
+        parse_response (callable): Called as parse_response(query, status_code, payload), returns a result
+            dictionary or a list of them. Raises NotFound or ProviderError.
+        method (str, optional): The HTTP method. Defaults to 'GET'.
+        auth (str, optional): The configuration key holding the API key.
+        response_type (str, optional): How the body is decoded: 'json', 'text' or 'content'. Defaults to 'json'.
+        cost (float, optional): The price of a single request in USD. Defaults to 0.
+        rate_limit (float, optional): The maximum number of requests per second, None for no limit.
+        allow_insecure (bool, optional): Whether the no-ssl-verify option applies to this provider. Defaults to True.
+        error_fields (dict, optional): Extra fields added to error results.
+        local (callable, optional): Called as local(query, config) to read the payload from a local data source instead of
+            sending an HTTP request. Local answers are neither cached nor recorded as known misses.
+        records (str, optional): The key of the record list of a large JSON payload. With ijson installed the list
+            is parsed incrementally from the socket, otherwise after the whole body was read.
+        record_filter (callable, optional): Called as record_filter(query, record) while the records are parsed,
+            only the records it returns True for are kept in the payload.
+        batch_size (int, optional): The number of queries the API accepts in one request. With batching enabled,
+            concurrent queries are joined with commas into one call of build_request, and every query parses the
+            shared payload. Defaults to 1.
+    """
+
+    def __init__(self, name, module, search_by, endpoint, build_request, parse_response, method='GET', auth=None,
+                 response_type='json', cost=0.0, rate_limit=None, allow_insecure=True, error_fields=None, local=None,
+                 records=None, record_filter=None, batch_size=1):
+        self.name = name
+        self.module = module
+        self.search_by = search_by
+        self.endpoint = endpoint
+        self.build_request = build_request
+        self.parse_response = parse_response
+        self.method = method
+        self.auth = auth
+        self.response_type = response_type
+        self.cost = cost
+        self.rate_limit = rate_limit
+        self.allow_insecure = allow_insecure
+        self.error_fields = error_fields or {}
+        self.local = local
+        self.records = records
+        self.record_filter = record_filter
+        self.batch_size = batch_size
+
+    def __repr__(self):
+        return f'Provider({self.name!r})'
+
+    def error(self, message):
+        """Builds the error result reported for this provider."""
+        return {'module': self.module, 'error': message, **self.error_fields}
+
+
+def loads(content):
+    """Parses a JSON body, with orjson when it is installed."""
+    return orjson.loads(content) if orjson is not None else json.loads(content)
+
+
+# The registry of every known provider, in the order they are queried
+PROVIDERS = collections.OrderedDict()
+
+
+def register(provider):
+    """Adds a provider to the registry and returns it."""
+    PROVIDERS[provider.name] = provider
+    return provider
+
+
+def select_providers(search_by, include=None, exclude=None):
+    """Returns the registered providers for a search type.
+
+    Parameters:
+        search_by (str): Either 'bssid' or 'ssid'.
+        include (list, optional): Provider or module names to keep, all providers when empty.
+        exclude (list, optional): Provider or module names to drop.
+
+    Returns:
+        list: The matching Provider objects.
+    """
+    selected = []
+    for provider in PROVIDERS.values():
+        names = {provider.name, provider.module}
+        if provider.search_by != search_by:
+            continue
+        if include and not names.intersection(include):
+            continue
+        if exclude and names.intersection(exclude):
+            continue
+        selected.append(provider)
+    return selected
+
+
+class ResultCache:
+    """A thread-safe LRU cache with a time to live for lookup results.
+
+    Parameters:
+        max_entries (int): The maximum number of entries kept in the cache.
+        ttl (float): The number of seconds an entry stays valid.
+    """
+
+    def __init__(self, max_entries=10000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                # Drop the expired entry so it is fetched again
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RateLimiter:
+    """A token bucket limiting how many requests per second are sent to a provider.
+
+    Parameters:
+        rate (float): The number of requests allowed per second.
+        burst (int, optional): The number of requests that may be sent at once. Defaults to 1.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SharedRateLimiter(RateLimiter):
+    """A token bucket shared by several processes, so sharded workers stay within one request budget.
+
+    Create it in the parent process and hand it to the workers when they are started.
+
+    Parameters:
+        rate (float): The number of requests allowed per second, across all processes.
+        burst (int, optional): The number of requests that may be sent at once. Defaults to 1.
+    """
+
+    def __init__(self, rate, burst=1):
+        import multiprocessing
+
+        self.rate = rate
+        self.burst = burst
+        self._shared = multiprocessing.Array('d', [burst, time.monotonic()])
+        self._lock = self._shared.get_lock()
+
+    @property
+    def _tokens(self):
+        return self._shared[0]
+
+    @_tokens.setter
+    def _tokens(self, value):
+        self._shared[0] = value
+
+    @property
+    def _updated(self):
+        return self._shared[1]
+
+    @_updated.setter
+    def _updated(self, value):
+        self._shared[1] = value
+
+
+class Engine:
+    """Runs provider queries with pooled connections, caching, rate limiting, retries and metrics.
+
+    Parameters:
+        config (dict, optional): The configuration data. Defaults to the contents of config.yaml.
+        max_workers (int, optional): The number of provider calls that may run at the same time, also the number
+            of pooled connections kept per host. Defaults to 64.
+        cache_ttl (float, optional): The number of seconds results are cached. Defaults to 3600.
+        retries (int, optional): The number of retries after a connection error or a retryable status. Defaults to 2.
+        backoff (float, optional): The delay before the first retry, doubled on every attempt. Defaults to 0.5.
+        timeout (float, optional): The timeout of a single HTTP request in seconds. Defaults to 30.
+        base_url (str, optional): Sends every provider request to base_url/<provider name>/<endpoint path>
+            instead of the real API, used to run against local stub providers.
+        limiters (dict, optional): Rate limiters to use instead of per-engine ones, as {provider name: limiter}.
+        negative_cache (NegativeCache, optional): Persistent record of confirmed misses, used to skip providers
+            that are known not to have data for a query.
+    """
+
+    def __init__(self, config=None, max_workers=64, cache_ttl=3600, retries=2, backoff=0.5, timeout=30,
+                 base_url=None, limiters=None, negative_cache=None):
+        self.config = config if config is not None else read_config()
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.base_url = base_url
+        dns_options = self.config.get('dns') or {}
+        self.dns_cache = DNSCache(dns_options.get('ttl', 300), dns_options.get('max_ttl', 3600))
+        self.session = requests.Session()
+        self.adapter = CachedDNSAdapter(self.dns_cache, pool_connections=16, pool_maxsize=max_workers)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.cache = ResultCache(ttl=cache_ttl)
+        self.limiters = dict(limiters or {})
+        self.negative_cache = negative_cache
+        self.metrics = collections.defaultdict(collections.Counter)
+        # Callables run as hook(provider, query, response) after every HTTP response, e.g. a response recorder
+        self.hooks = []
+        # Callables run as gate(provider) before every HTTP attempt, returning False to refuse it, e.g. a quota ledger
+        self.gates = []
+        self._lock = threading.Lock()
+        hedge_options = self.config.get('hedge') or {}
+        self.hedge_providers = hedge_options.get('providers')
+        self.hedger = None
+        if hedge_options.get('enabled'):
+            # Duplicates run next to the calls they hedge, hence twice the workers
+            self.hedger = Hedger(hedge_options.get('budget', 0.05), hedge_options.get('quantile', 0.95),
+                                 hedge_options.get('window', 1000), hedge_options.get('min_samples', 20),
+                                 max_workers * 2)
+        batch_options = self.config.get('batching') or {}
+        self.batch_linger = batch_options.get('linger', 0.01) if batch_options.get('enabled') else None
+        self.batch_max_size = batch_options.get('max_size')
+        self.batchers = {}
+
+    def endpoint(self, provider, query):
+        """Returns the URL a provider query is sent to."""
+        overrides = self.config.get('endpoints') or {}
+        endpoint = overrides.get(provider.name, provider.endpoint)
+        api_key = self.config.get(provider.auth) if provider.auth else ''
+        url = endpoint.format(api_key=api_key, query=query)
+        if self.base_url:
+            # Keep the path and query of the real endpoint so stub servers can tell requests apart
+            parts = urlsplit(url)
+            url = urlunsplit(urlsplit(f'{self.base_url.rstrip("/")}/{provider.name}{parts.path}')[:3] +
+                             (parts.query, ''))
+        return url
+
+    def rate_limit(self, provider):
+        """Returns the number of requests per second allowed for a provider, None or 0 for no limit."""
+        return (self.config.get('rate_limits') or {}).get(provider.name, provider.rate_limit)
+
+    def limiter(self, provider):
+        """Returns the rate limiter of a provider, or None if it is not rate limited."""
+        if provider.name in self.limiters:
+            return self.limiters[provider.name]
+        rate = self.rate_limit(provider)
+        if not rate:
+            return None
+        with self._lock:
+            if provider.name not in self.limiters:
+                self.limiters[provider.name] = RateLimiter(rate)
+            return self.limiters[provider.name]
+
+    def hedged(self, provider):
+        """Checks whether the slow calls of a provider are duplicated.
+
+        Unless the hedge section of the configuration lists the providers, only the free providers without a rate
+        limit are hedged: a duplicate would cost money or wait for the limiter.
+        """
+        if self.hedger is None or provider.local is not None:
+            return False
+        if self.hedge_providers is not None:
+            return bool({provider.name, provider.module}.intersection(self.hedge_providers))
+        return not provider.cost and not self.rate_limit(provider)
+
+    def batcher(self, provider):
+        """Returns the batcher joining the concurrent queries of a provider, or None if they are sent one by one."""
+        if self.batch_linger is None or provider.batch_size <= 1 or provider.local is not None:
+            return None
+        with self._lock:
+            if provider.name not in self.batchers:
+                size = min(provider.batch_size, self.batch_max_size or provider.batch_size)
+                self.batchers[provider.name] = QueryBatcher(size, self.batch_linger)
+            return self.batchers[provider.name]
+
+    def verify(self, provider):
+        """Returns whether the TLS certificate of a provider is checked."""
+        return not (provider.allow_insecure and self.config.get('no-ssl-verify', False))
+
+    def prewarm(self, providers=None):
+        """Resolves the provider hosts and opens a connection to each of them in parallel, in the background.
+
+        Hosts that already have an open pooled connection are left alone, so calling it again after an idle period
+        only reconnects where the server closed the connection.
+
+        Parameters:
+            providers (list, optional): The providers about to be queried. Defaults to every registered provider.
+
+        Returns:
+            list: The futures of the connection attempts.
+        """
+        urls = {}
+        for provider in providers if providers is not None else PROVIDERS.values():
+            if provider.local is not None or not provider.endpoint:
+                continue
+            parts = urlsplit(self.endpoint(provider, ''))
+            url = urlunsplit((parts.scheme, parts.netloc, '/', '', ''))
+            # Requests picks the connection pool by the effective verify setting, CA bundle variables included
+            verify = self.session.merge_environment_settings(url, {}, None, self.verify(provider), None)['verify']
+            urls.setdefault((parts.scheme, parts.netloc, verify), (provider, url))
+        return [self.executor.submit(self.warm, provider, url, verify)
+                for (_, _, verify), (provider, url) in urls.items()]
+
+    def warm(self, provider, url, verify):
+        try:
+            self.adapter.warm(url, verify)
+            self.metrics[provider.name]['prewarms'] += 1
+        except Exception:
+            # A provider that cannot be reached now reports the error on its first query
+            self.metrics[provider.name]['prewarm_errors'] += 1
+
+    def keep_warm(self, interval=30, providers=None):
+        """Calls prewarm every interval seconds from a daemon thread, e.g. while a lookup server is idle.
+
+        Returns:
+            threading.Event: Set it to stop the thread.
+        """
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.prewarm(providers)
+
+        threading.Thread(target=run, name='geowifi-keep-warm', daemon=True).start()
+        return stop
+
+    def admit(self, provider):
+        """Returns whether every gate allows one more HTTP request to a provider."""
+        return all(gate(provider) for gate in self.gates)
+
+    def send(self, provider, query, stream=False):
+        """Sends the HTTP request of a provider query, retrying transient failures.
+
+        Parameters:
+            provider (Provider): The provider to query.
+            query (str): The BSSID or SSID to search for.
+            stream (bool, optional): Leave the body on the socket, to be read by decode. Defaults to False.
+
+        Returns:
+            requests.Response: The response of the last attempt.
+
+        Raises:
+            ProviderError: If a gate refuses the first attempt.
+        """
+        api_key = self.config.get(provider.auth) if provider.auth else None
+        kwargs = provider.build_request(query, api_key)
+        verify = self.verify(provider)
+        limiter = self.limiter(provider)
+        url = self.endpoint(provider, query)
+        stats = self.metrics[provider.name]
+        if not self.admit(provider):
+            stats['skipped'] += 1
+            raise ProviderError('Skipped: daily quota or cost budget spent')
+        for attempt in range(self.retries + 1):
+            if limiter:
+                limiter.acquire()
+            stats['requests'] += 1
+            try:
+                with span(provider.name, 'http', attempt=attempt):
+                    response = self.session.request(provider.method, url, verify=verify, timeout=self.timeout,
+                                                    stream=stream, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == self.retries or not self.admit(provider):
+                    raise
+            else:
+                for hook in self.hooks:
+                    hook(provider, query, response)
+                # A retry the gates refuse leaves the last answer to the parser
+                if response.status_code not in RETRY_STATUS or attempt == self.retries or not self.admit(provider):
+                    return response
+                response.close()
+            stats['retries'] += 1
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def decode(self, provider, response, query=None):
+        """Decodes a response body once, according to the provider response type."""
+        with span(provider.name, 'decode'):
+            if provider.response_type == 'json':
+                if provider.records is not None and response.status_code == 200:
+                    return self.decode_records(provider, response, query)
+                # Error bodies are small and may not hold the record list, read them whole as before
+                return loads(response.content)
+            if provider.response_type == 'text':
+                return response.text
+            return response.content
+
+    def decode_records(self, provider, response, query):
+        """Decodes the record list of a JSON payload, keeping the records accepted by the provider filter.
+
+        A streamed body is parsed incrementally, so only the kept records are ever held in memory. Other payload keys
+        are dropped.
+        """
+        keep = provider.record_filter or (lambda query, record: True)
+        if ijson is None or response._content_consumed:
+            # Already read, e.g. by a response recorder, or no incremental parser available
+            payload = loads(response.content)
+            records = payload.get(provider.records, []) if isinstance(payload, dict) else []
+            return {provider.records: [record for record in records if keep(query, record)]}
+        response.raw.decode_content = True
+        try:
+            records = [record for record in ijson.items(response.raw, provider.records + '.item', use_float=True)
+                       if keep(query, record)]
+        except Exception:
+            response.close()
+            raise
+        # The body was read to the end, the connection can go back to the pool
+        response.raw.release_conn()
+        return {provider.records: records}
+
+    def fetch(self, provider, query, stream=False):
+        """Sends a provider query and decodes the response.
+
+        Returns:
+            tuple: The status code and the decoded payload.
+        """
+        response = self.send(provider, query, stream=stream)
+        return response.status_code, self.decode(provider, response, query)
+
+    def call(self, provider, query, stream=False):
+        """Fetches a provider query, hedged when the provider is."""
+        if self.hedged(provider):
+            return self.hedger.run(provider.name, lambda: self.fetch(provider, query, stream))
+        return self.fetch(provider, query, stream)
+
+    def query(self, provider, query, use_cache=True):
+        """Queries a single provider.
+
+        Parameters:
+            provider (Provider): The provider to query.
+            query (str): The BSSID or SSID to search for.
+            use_cache (bool, optional): Whether cached results and known misses may be used. Defaults to True.
+
+        Returns:
+            dict or list: The provider result, or a dictionary with an error message if an error occurred.
+        """
+        with span(provider.name, 'provider', query=query):
+            return self._query(provider, query, use_cache)
+
+    def _query(self, provider, query, use_cache):
+        key = (provider.name, str(query).lower())
+        stats = self.metrics[provider.name]
+        if provider.local is not None:
+            # Local data sources are cheaper to read than the cache, and change whenever results are stored
+            stats['local_lookups'] += 1
+            try:
+                return provider.parse_response(query, 200, provider.local(query, self.config))
+            except ProviderError as e:
+                stats['misses'] += 1
+                return provider.error(str(e))
+            except Exception as e:
+                stats['errors'] += 1
+                return provider.error(str(e))
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                stats['cache_hits'] += 1
+                return cached
+            if self.negative_cache is not None and self.negative_cache.contains(provider.name, key[1]):
+                # The provider confirmed it does not know this network on an earlier run
+                stats['known_misses'] += 1
+                return provider.error('No results detected (known miss)')
+        start = time.perf_counter()
+        try:
+            streamed = provider.records is not None and ijson is not None and provider.response_type == 'json'
+            batcher = self.batcher(provider)
+            if batcher is not None:
+                status, payload = batcher.run(query, lambda queries: self.call(provider, ','.join(queries), streamed))
+            else:
+                status, payload = self.call(provider, query, streamed)
+            with span(provider.name, 'parse'):
+                result = provider.parse_response(query, status, payload)
+        except NotFound as e:
+            # Misses are cached like hits, the provider will not know the network on the next call either
+            stats['misses'] += 1
+            result = provider.error(str(e))
+            if self.negative_cache is not None:
+                self.negative_cache.add(provider.name, key[1])
+        except Exception as e:
+            stats['errors'] += 1
+            return provider.error(str(e))
+        finally:
+            stats['seconds'] += time.perf_counter() - start
+        self.cache.put(key, result)
+        return result
+
+    def search(self, providers, query, use_cache=True):
+        """Queries several providers concurrently.
+
+        Parameters:
+            providers (list): The providers to query.
+            query (str): The BSSID or SSID to search for.
+            use_cache (bool, optional): Whether cached results may be returned. Defaults to True.
+
+        Yields:
+            tuple: The provider and its result, in completion order.
+        """
+        futures = {self.executor.submit(self.query, provider, query, use_cache): provider for provider in providers}
+        for future in as_completed(futures):
+            provider = futures[future]
+            try:
+                yield provider, future.result()
+            except Exception as e:
+                yield provider, provider.error(str(e))
+
+    def render_metrics(self):
+        """Returns the per-provider metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, stats in sorted(self.metrics.items()):
+            for metric, value in sorted(stats.items()):
+                lines.append(f'geowifi_provider_{metric}_total{{provider="{name}"}} {value:g}')
+        for metric, value in sorted(self.dns_cache.stats.items()):
+            lines.append(f'geowifi_dns_{metric}_total {value:g}')
+        for name, batcher in sorted(self.batchers.items()):
+            lines.append(f'geowifi_batch_requests_total{{provider="{name}"}} {batcher.requests:g}')
+            lines.append(f'geowifi_batch_queries_total{{provider="{name}"}} {batcher.queries:g}')
+        if self.hedger is not None:
+            lines.extend(self.hedger.render_metrics())
+        return '\n'.join(lines) + '\n'
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Returns the process-wide engine, creating it on first use."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = Engine()
+        return _engine
+
+
+def set_engine(engine):
+    """Replaces the process-wide engine, e.g. with one pointed at local stub providers."""
+    global _engine
+    with _engine_lock:
+        _engine = engine
@@ -0,0 +1,155 @@
+from helpers.bssid import bssid_to_int, int_to_bssid, normalize_bssid
+from helpers.engine import PROVIDERS, get_engine, select_providers
+from helpers.providers import APPLE_BATCH_SIZE, collect_results
+
+# Bit of the first octet marking a locally administered address, often set on the virtual BSSIDs of an AP
+LOCALLY_ADMINISTERED = 0x02 << 40
+
+
+def sibling_candidates(bssid, byte_span=2, limit=None):
+    """Generates the BSSIDs an access point is likely to advertise next to the given one.
+
+    Multi-radio and multi-SSID APs usually derive their BSSIDs from one base address by changing the last nibble
+    or the last byte, and sometimes by setting the locally administered bit. The candidates are ordered from the
+    most to the least common pattern.
+
+    Parameters:
+        bssid (str): The BSSID to expand.
+        byte_span (int, optional): How far the last byte may move up and down. Defaults to 2.
+        limit (int, optional): The maximum number of candidates returned.
+
+    Returns:
+        list: The candidate BSSIDs in colon notation, without the BSSID itself.
+    """
+    key = bssid_to_int(bssid)
+    if key is None:
+        return []
+    candidates = []
+    base = key & ~0xff
+    # Neighbouring last byte values first, then the other values of the last nibble
+    for offset in range(1, byte_span + 1):
+        for sibling in (key + offset, key - offset):
+            if base <= sibling <= base + 0xff:
+                candidates.append(sibling)
+    for nibble in range(16):
+        candidates.append((key & ~0xf) | nibble)
+    candidates.append(key ^ LOCALLY_ADMINISTERED)
+    unique = [sibling for sibling in dict.fromkeys(candidates) if sibling != key]
+    return [int_to_bssid(sibling) for sibling in unique[:limit]]
+
+
+def attribute(results, bssid, sibling):
+    """Reports the located results of a sibling as results of the original BSSID."""
+    attributed = []
+    for result in results:
+        if 'error' in result or 'latitude' not in result:
+            continue
+        result = dict(result, bssid=bssid, sibling=sibling)
+        attributed.append(result)
+    return attributed
+
+
+def match_siblings(answer, candidates, found):
+    """Picks the candidate siblings out of an Apple wloc answer, as (sibling, result) tuples.
+
+    Parameters:
+        answer (list or dict): The access points of the answer, or the error of the request.
+        candidates (list): The candidate sibling BSSIDs.
+        found (set): The siblings already located, updated with the new ones.
+    """
+    if not isinstance(answer, list):
+        return []
+    keys = {bssid_to_int(sibling): sibling for sibling in candidates}
+    matches = []
+    for access_point in answer:
+        sibling = keys.get(bssid_to_int(access_point['bssid']))
+        if sibling and sibling not in found:
+            found.add(sibling)
+            matches.append((sibling, access_point))
+    return matches
+
+
+def expand_search(bssid, providers=None, exclude=None, engine=None, use_cache=True, budget=32, always=False):
+    """Searches a BSSID and, if no provider locates it, the sibling BSSIDs of the same access point.
+
+    Apple is asked once for the BSSID through the wloc provider: its answer locates the BSSID itself and lists the
+    access points around it, so siblings found there cost nothing. The remaining candidates are sent to Apple
+    together in multi-BSSID wloc requests, then to the other providers in one concurrent pass, stopping at the
+    request budget. Only free remote providers take part in that pass, unless providers names paid ones.
+
+    Parameters:
+        bssid (str): The BSSID to search for.
+        providers (list, optional): Provider or module names to query.
+        exclude (list, optional): Provider or module names to skip.
+        engine (Engine, optional): The engine running the queries. Defaults to the process-wide engine.
+        use_cache (bool, optional): Whether cached results and known misses may be used. Defaults to True.
+        budget (int, optional): The maximum number of extra provider requests. Defaults to 32.
+        always (bool, optional): Expand even when the BSSID itself was located. Defaults to False.
+
+    Returns:
+        list: The search results of the BSSID, followed by the results attributed from its siblings, which
+            carry a 'sibling' key with the BSSID that was actually located.
+    """
+    engine = engine or get_engine()
+    bssid = normalize_bssid(bssid) or bssid
+    selected = [provider for provider in select_providers('bssid', providers, exclude)
+                if use_cache or provider.local is None]
+    apple = PROVIDERS['apple_bssid'] if PROVIDERS['apple_bssid'] in selected else None
+
+    # The wloc answer to the BSSID stands for the apple_bssid query, which would send the same request again
+    wloc = None
+    if apple is not None:
+        wloc = engine.executor.submit(engine.query, PROVIDERS['apple_wloc'], bssid, use_cache)
+    provider_results = list(engine.search([provider for provider in selected if provider is not apple], bssid,
+                                          use_cache))
+    neighbours = None
+    if wloc is not None:
+        neighbours = wloc.result()
+        if isinstance(neighbours, list):
+            own = next((access_point for access_point in neighbours
+                        if bssid_to_int(access_point['bssid']) == bssid_to_int(bssid)), None)
+            own = dict(own, bssid=bssid) if own else apple.error('Latitude or longitude value not found in response')
+        else:
+            own = neighbours
+        provider_results.insert(0, (apple, own))
+    results = collect_results(provider_results, bssid=bssid)
+    located = any('error' not in result and 'latitude' in result for result in results)
+    if located and not always:
+        return results
+
+    candidates = sibling_candidates(bssid)
+    if not candidates:
+        return results
+    found = set()
+    expanded = []
+    for sibling, access_point in match_siblings(neighbours, candidates, found):
+        expanded.extend(attribute([access_point], bssid, sibling))
+
+    # The other candidates go to Apple together, a single request for the usual number of candidates
+    if apple is not None:
+        remaining = [sibling for sibling in candidates if sibling not in found]
+        for start in range(0, len(remaining), APPLE_BATCH_SIZE):
+            if budget <= 0:
+                break
+            chunk = remaining[start:start + APPLE_BATCH_SIZE]
+            answer = engine.query(PROVIDERS['apple_wloc'], ','.join(chunk), use_cache)
+            budget -= 1
+            for sibling, access_point in match_siblings(answer, chunk, found):
+                expanded.extend(attribute([access_point], bssid, sibling))
+
+    # One concurrent pass over the remaining candidates with the other providers, within the budget. Local sources
+    # only know BSSIDs that were searched before, and paid providers are only queried when asked for by name
+    others = [provider for provider in selected
+              if provider.module not in ('apple', 'vendor_check') and provider.local is None
+              and (not provider.cost or {provider.name, provider.module}.intersection(providers or []))]
+    pairs = [(sibling, provider) for sibling in candidates if sibling not in found for provider in others]
+    pairs = pairs[:max(budget, 0)]
+    futures = [(sibling, provider, engine.executor.submit(engine.query, provider, sibling, use_cache))
+               for sibling, provider in pairs]
+    per_sibling = {}
+    for sibling, provider, future in futures:
+        per_sibling.setdefault(sibling, []).append((provider, future.result()))
+    for sibling, provider_results in per_sibling.items():
+        expanded.extend(attribute(collect_results(provider_results, bssid=sibling), bssid, sibling))
+
+    return results + expanded
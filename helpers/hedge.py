@@ -0,0 +1,149 @@
+import collections
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class LatencyWindow:
+    """The latest latencies of a provider, in seconds.
+
+    Parameters:
+        size (int, optional): The number of latencies kept. Defaults to 1000.
+    """
+
+    # Latencies added before the quantiles are sorted again
+    RESORT_EVERY = 16
+
+    def __init__(self, size=1000):
+        self.samples = collections.deque(maxlen=size)
+        self._sorted = None
+        self._added = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+            self._added += 1
+
+    def __len__(self):
+        return len(self.samples)
+
+    def quantile(self, fraction):
+        """Returns the latency below which the given fraction of the kept latencies fall, or None without any."""
+        with self._lock:
+            if self._sorted is None or self._added >= self.RESORT_EVERY:
+                self._sorted = sorted(self.samples)
+                self._added = 0
+            ordered = self._sorted
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Hedger:
+    """Duplicates the provider calls that take longer than usual, and keeps the first answer.
+
+    A call that has not returned after the rolling quantile latency of its provider is sent a second time, which
+    the connection pool sends on another connection. Duplicates are limited to a fraction of all calls, so a
+    provider slowing down as a whole does not double the load on it.
+
+    This trims the latency tail of single provider calls. A lookup querying several providers waits for the slowest
+    of them, and is slow far more often than the budget allows duplicates, so its own p99 does not improve.
+
+    Parameters:
+        budget (float, optional): The maximum number of duplicates per call, over the whole run. Defaults to 0.05.
+        quantile (float, optional): The latency quantile after which a call is duplicated. Defaults to 0.95.
+        window (int, optional): The number of latencies kept per provider. Defaults to 1000.
+        min_samples (int, optional): The number of latencies needed before a provider is hedged. Defaults to 20.
+        max_workers (int, optional): The number of calls and duplicates that may run at the same time.
+            Defaults to 128.
+    """
+
+    def __init__(self, budget=0.05, quantile=0.95, window=1000, min_samples=20, max_workers=128):
+        self.budget = budget
+        self.quantile = quantile
+        self.min_samples = min_samples
+        # Latencies of the individual requests, and of the calls as seen by their callers
+        self.latencies = collections.defaultdict(lambda: LatencyWindow(window))
+        self.observed = collections.defaultdict(lambda: LatencyWindow(window))
+        self.stats = collections.Counter()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='geowifi-hedge')
+        self._lock = threading.Lock()
+
+    def delay(self, name):
+        """Returns how long a call of a provider may take before it is duplicated, or None if it is not yet known."""
+        latencies = self.latencies[name]
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies.quantile(self.quantile)
+
+    def allow(self):
+        """Books a duplicate if the budget allows one."""
+        with self._lock:
+            if self.stats['hedges'] + 1 > self.budget * self.stats['calls']:
+                self.stats['over_budget'] += 1
+                return False
+            self.stats['hedges'] += 1
+            return True
+
+    def timed(self, name, call):
+        start = time.perf_counter()
+        try:
+            return call()
+        finally:
+            self.latencies[name].add(time.perf_counter() - start)
+
+    def run(self, name, call):
+        """Runs call(), duplicating it once if it has not returned after the rolling latency quantile of name.
+
+        Returns:
+            The value of the first call to return successfully.
+
+        Raises:
+            Exception: The error of the first call, if every call failed.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            self.stats['calls'] += 1
+        delay = self.delay(name)
+        try:
+            if delay is None:
+                # Not enough latencies yet to tell a slow call: run it in place
+                return self.timed(name, call)
+            primary = self.executor.submit(self.timed, name, call)
+            done, _ = wait([primary], timeout=delay)
+            if done or not self.allow():
+                return primary.result()
+            hedge = self.executor.submit(self.timed, name, call)
+            return self.first(primary, hedge)
+        finally:
+            self.observed[name].add(time.perf_counter() - start)
+
+    def first(self, primary, hedge):
+        """Returns the result of the first of two calls to succeed; the other one is cancelled if it has not started,
+        and its result dropped otherwise."""
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if future is hedge:
+                        with self._lock:
+                            self.stats['hedge_wins'] += 1
+                    return future.result()
+                if error is None or future is primary:
+                    error = future.exception()
+        raise error
+
+    def render_metrics(self):
+        """Returns the hedging counters and the p99 latency per provider, of the requests and of the calls."""
+        lines = [f'geowifi_hedge_{metric}_total {value:g}' for metric, value in sorted(self.stats.items())]
+        for kind, windows in (('request', self.latencies), ('call', self.observed)):
+            for name, window in sorted(windows.items()):
+                p99 = window.quantile(0.99)
+                if p99 is not None:
+                    lines.append(f'geowifi_provider_latency_p99_seconds{{provider="{name}",kind="{kind}"}} {p99:g}')
+        return lines
@@ -0,0 +1,236 @@
+import contextlib
+import hashlib
+import math
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# File header: magic, format version, creation time, number of bits, number of hashes, number of keys
+HEADER = struct.Struct('<4sHdQII')
+MAGIC = b'GWBF'
+
+
+class BloomFilter:
+    """A fixed-size Bloom filter over string keys.
+
+    Parameters:
+        capacity (int): The number of keys the filter is sized for.
+        error_rate (float): The false positive rate once the filter holds capacity keys.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.01, created=None):
+        self.bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+        self.created = created if created is not None else time.time()
+
+    def positions(self, key):
+        # Double hashing: the k bit positions are derived from two 64-bit halves of one digest
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first, second = struct.unpack('<QQ', digest)
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.array[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+    def compatible(self, other):
+        """Returns whether the filters hash keys to the same bits, so they can be merged."""
+        return self.bits == other.bits and self.hashes == other.hashes
+
+    def update(self, other):
+        """Adds the keys of a compatible filter, keeping the older creation time."""
+        self.array = bytearray((int.from_bytes(self.array, 'little') | int.from_bytes(other.array, 'little'))
+                               .to_bytes(len(self.array), 'little'))
+        self.count = max(self.count, other.count) if self.created == other.created else self.count + other.count
+        self.created = min(self.created, other.created)
+
+    def save(self, path):
+        with open(path, 'wb') as output:
+            output.write(HEADER.pack(MAGIC, 1, self.created, self.bits, self.hashes, self.count))
+            output.write(self.array)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as source:
+            magic, version, created, bits, hashes, count = HEADER.unpack(source.read(HEADER.size))
+            if magic != MAGIC or version != 1:
+                raise ValueError(f'{path} is not a geowifi Bloom filter')
+            bloom = cls.__new__(cls)
+            bloom.bits, bloom.hashes, bloom.count, bloom.created = bits, hashes, count, created
+            bloom.array = bytearray(source.read())
+            return bloom
+
+
+class NegativeCache:
+    """Remembers, per provider, the queries the provider confirmed it knows nothing about.
+
+    Each provider has two Bloom filter generations. New misses go to the current generation, and once it is
+    older than half the TTL it becomes the previous generation and a new one is started, so a miss is forgotten
+    between ttl / 2 and ttl seconds after it was recorded.
+
+    Several processes may share the directory: saving merges the filters on disk into the loaded ones under a lock
+    file (<directory>/.lock, where fcntl is available) before writing them back, so no process drops the misses of
+    another. Misses are saved every save_interval seconds while they are recorded, and by save() at exit.
+
+    Parameters:
+        directory (str): The directory the filters are persisted in.
+        ttl (float, optional): The number of seconds a miss is remembered at most. Defaults to 30 days.
+        capacity (int, optional): The number of misses per provider and generation each filter is sized for.
+        error_rate (float, optional): The false positive rate of the filters. Defaults to 0.01.
+        save_interval (float, optional): The number of seconds between saves while misses are recorded. Defaults
+            to 300, None to save at exit only.
+    """
+
+    def __init__(self, directory, ttl=30 * 86400, capacity=1000000, error_rate=0.01, save_interval=300):
+        self.directory = directory
+        self.ttl = ttl
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.save_interval = save_interval
+        self.filters = {}
+        self._saved = time.monotonic()
+        # Misses recorded since track_new_misses() was called, None while not tracking
+        self.new_misses = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def track_new_misses(self):
+        """Starts collecting the misses recorded from now on, e.g. to send them back from a worker process."""
+        self.new_misses = []
+
+    def path(self, provider, generation):
+        return os.path.join(self.directory, f'{provider}.{generation}.bloom')
+
+    def load(self, provider):
+        """Reads the [current, previous] filters of a provider from the cache directory."""
+        generations = []
+        for generation in ('current', 'previous'):
+            try:
+                generations.append(BloomFilter.load(self.path(provider, generation)))
+            except (FileNotFoundError, ValueError, struct.error):
+                generations.append(None)
+        return generations
+
+    def generations(self, provider):
+        """Returns the [current, previous] filters of a provider, loading and rotating them as needed."""
+        generations = self.filters.get(provider)
+        if generations is None:
+            generations = self.filters[provider] = self.load(provider)
+        current, previous = generations
+        now = time.time()
+        if current is None or now - current.created > self.ttl / 2:
+            # Rotate: the current generation becomes the previous one, older misses are dropped
+            previous = current if current is not None and now - current.created <= self.ttl else None
+            current = BloomFilter(self.capacity, self.error_rate)
+            generations[:] = [current, previous]
+        return generations
+
+    def merge(self, filters):
+        """Folds filters of one provider, e.g. the loaded ones and the ones saved by other processes, into
+        [current, previous] generations.
+
+        Filters created within ttl / 2 of the newest one form the current generation, the others the previous
+        generation, and filters older than the TTL are dropped.
+        """
+        now = time.time()
+        filters = sorted((bloom for bloom in filters if bloom is not None and now - bloom.created <= self.ttl),
+                         key=lambda bloom: bloom.created, reverse=True)
+        generations = [None, None]
+        for bloom in filters:
+            slot = 0 if filters[0].created - bloom.created <= self.ttl / 2 else 1
+            merged = generations[slot]
+            if merged is None:
+                generations[slot] = bloom
+            elif merged.compatible(bloom):
+                merged.update(bloom)
+        return generations
+
+    def contains(self, provider, query):
+        """Returns True if the provider recently confirmed it does not know the query."""
+        key = query.lower()
+        with self._lock:
+            return any(bloom is not None and key in bloom for bloom in self.generations(provider))
+
+    def add(self, provider, query):
+        """Records a confirmed miss of a provider."""
+        key = query.lower()
+        with self._lock:
+            self.generations(provider)[0].add(key)
+            if self.new_misses is not None:
+                self.new_misses.append((provider, key))
+            due = self.save_interval is not None and time.monotonic() - self._saved > self.save_interval
+            if due:
+                self._saved = time.monotonic()
+        if due:
+            self.save()
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Holds the lock file of the cache directory, shared by every process saving to it."""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save(self):
+        """Merges the filters saved by other processes into the loaded ones and writes them to the cache directory."""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, self.locked():
+            for provider, generations in self.filters.items():
+                generations[:] = self.merge(generations + self.load(provider))
+                for generation, bloom in zip(('current', 'previous'), generations):
+                    path = self.path(provider, generation)
+                    if bloom is None:
+                        if os.path.exists(path):
+                            os.remove(path)
+                        continue
+                    # Write to a temporary file first so an interrupted save never leaves a truncated filter
+                    bloom.save(path + '.tmp')
+                    os.replace(path + '.tmp', path)
+            self._saved = time.monotonic()
+
+
+def open_negative_cache(config):
+    """Creates the negative cache described by the negative_cache section of the configuration.
+
+    Parameters:
+        config (dict): The configuration data.
+
+    Returns:
+        NegativeCache: The negative cache, or None if it is disabled.
+    """
+    options = config.get('negative_cache') or {}
+    if options.get('enabled') is False:
+        return None
+    return NegativeCache(
+        options.get('path', 'results/negative_cache'),
+        ttl=options.get('ttl_days', 30) * 86400,
+        capacity=options.get('capacity', 1000000),
+        error_rate=options.get('error_rate', 0.01),
+        save_interval=options.get('save_interval', 300),
+    )
@@ -0,0 +1,83 @@
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from helpers.bssid import bssid_to_int, int_to_bssid
+from helpers.engine import get_engine, select_providers
+from helpers.providers import collect_results
+
+
+def pivot_search(ssid, providers=None, exclude=None, engine=None, use_cache=True, limit=50):
+    """Searches an SSID, then every BSSID the SSID providers return, in one pipelined run.
+
+    The BSSID queries of a network are sent as soon as an SSID provider returns it, while the other SSID providers
+    are still answering, so both stages overlap. Every BSSID is searched once, whichever providers returned it,
+    and at most limit BSSIDs are searched.
+
+    Parameters:
+        ssid (str): The SSID to search for.
+        providers (list, optional): Provider or module names to query, in both stages.
+        exclude (list, optional): Provider or module names to skip, in both stages.
+        engine (Engine, optional): The engine running the queries. Defaults to the process-wide engine.
+        use_cache (bool, optional): Whether cached results, known misses and local data may be used.
+            Defaults to True.
+        limit (int, optional): The maximum number of BSSIDs searched. Defaults to 50.
+
+    Returns:
+        tuple: The search results of both stages, the BSSID results carrying the SSID and a 'pivot' key with the
+            modules that returned the BSSID, and the networks found, as a list of {'bssid', 'ssid', 'found_by',
+            'results'} dictionaries in discovery order.
+    """
+    engine = engine or get_engine()
+    ssid_providers = [provider for provider in select_providers('ssid', providers, exclude)
+                      if use_cache or provider.local is None]
+    bssid_providers = [provider for provider in select_providers('bssid', providers, exclude)
+                       if use_cache or provider.local is None]
+
+    # Futures of both stages: SSID provider futures map to their provider, BSSID query futures to (key, provider)
+    futures = {engine.executor.submit(engine.query, provider, ssid, use_cache): provider
+               for provider in ssid_providers}
+    ssid_results = []
+    networks = {}
+    skipped = set()
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            source = futures.pop(future)
+            if isinstance(source, tuple):
+                key, provider = source
+                networks[key]['raw'].append((provider, future.result()))
+                continue
+            results = collect_results([(source, future.result())], ssid=ssid)
+            ssid_results.extend(results)
+            for result in results:
+                key = bssid_to_int(result.get('bssid', '')) if 'error' not in result else None
+                if key is None:
+                    continue
+                if key in networks:
+                    networks[key]['found_by'].add(result['module'])
+                    continue
+                if len(networks) >= limit:
+                    skipped.add(key)
+                    continue
+                networks[key] = {'found_by': {result['module']}, 'raw': []}
+                for provider in bssid_providers:
+                    query = engine.executor.submit(engine.query, provider, int_to_bssid(key), use_cache)
+                    futures[query] = (key, provider)
+                    pending.add(query)
+
+    bssid_results = []
+    correlated = []
+    for key, network in networks.items():
+        bssid = int_to_bssid(key)
+        found_by = sorted(network['found_by'])
+        results = []
+        for result in collect_results(network['raw'], bssid=bssid):
+            result.setdefault('bssid', bssid)
+            result.setdefault('ssid', ssid)
+            result['pivot'] = found_by
+            results.append(result)
+        bssid_results.extend(results)
+        correlated.append({'bssid': bssid, 'ssid': ssid, 'found_by': found_by, 'results': results})
+    if skipped:
+        ssid_results.append({'module': 'pivot', 'error': f'{len(skipped)} more BSSIDs not searched (limit {limit})'})
+    return ssid_results + bssid_results, correlated
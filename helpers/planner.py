@@ -0,0 +1,319 @@
+"""Cost- and quota-aware dispatch of the provider queries of a search.
+
+Instead of querying every provider at once, the planner queries the providers in tiers, cheapest first: local data
+sources, then free providers, then providers with a daily quota, then paid providers in increasing price. It moves
+on to the next tier only while no provider located the network, or while the positions found disagree.
+
+Requests and their cost are counted per provider and per day in a ledger persisted across runs, so providers with
+a daily quota or a cost budget are skipped once it is spent.
+"""
+import collections
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import threading
+
+from helpers.engine import PROVIDERS, get_engine, select_providers
+from helpers.profiling import span
+from helpers.providers import collect_results
+from helpers.store import distance
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Days of history kept in the ledger
+LEDGER_DAYS = 31
+
+
+def today():
+    return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+
+class SharedCounter:
+    """The counters of one provider in a SharedCounts table, used like a Counter."""
+
+    def __init__(self, values, offset):
+        self._values = values
+        self._offset = offset
+
+    def __getitem__(self, field):
+        value = self._values[self._offset + SharedCounts.FIELDS.index(field)]
+        return value if field == 'cost' else int(value)
+
+    def __setitem__(self, field, value):
+        self._values[self._offset + SharedCounts.FIELDS.index(field)] = value
+
+    def keys(self):
+        return SharedCounts.FIELDS
+
+    def update(self, counts):
+        for field, value in counts.items():
+            self[field] += value
+
+
+class SharedCounts:
+    """Per-provider counters in shared memory, used like a defaultdict of Counters by the processes of a sharded run.
+
+    Parameters:
+        names (iterable): The names of the providers counted.
+    """
+
+    FIELDS = ('requests', 'cost', 'over_quota', 'over_budget')
+
+    def __init__(self, names):
+        import multiprocessing
+
+        self.names = list(names)
+        self._values = multiprocessing.RawArray('d', len(self.names) * len(self.FIELDS))
+
+    def __getitem__(self, name):
+        return SharedCounter(self._values, self.names.index(name) * len(self.FIELDS))
+
+    def items(self):
+        """Yields the providers with any count, and their counters."""
+        for name in self.names:
+            counts = self[name]
+            if any(counts[field] for field in self.FIELDS):
+                yield name, counts
+
+    def values(self):
+        return [counts for _, counts in self.items()]
+
+    def clear(self):
+        for position in range(len(self._values)):
+            self._values[position] = 0
+
+
+class QuotaLedger:
+    """Counts the requests sent to every provider and their cost, per UTC day and for the current run.
+
+    The ledger is an engine gate, asked before every HTTP attempt, retries and hedged requests included: it books the
+    attempt, or refuses it once the quota or the cost budget is spent. Cache hits, known misses and local answers
+    send no request and are free. Attempts are booked before they are sent, so concurrent lookups cannot overshoot
+    a quota. The worker processes of a sharded run book against one shared ledger, see share(). Other runs going on
+    at the same time are only seen through the file, which is read at start and on every save.
+
+    Parameters:
+        path (str): The JSON file the daily counts are kept in.
+        quotas (dict, optional): The daily request quota of providers or modules, e.g. {'wigle': 100}.
+        max_cost (float, optional): The maximum cost of a run, in USD. Defaults to no limit.
+    """
+
+    def __init__(self, path, quotas=None, max_cost=None):
+        self.path = path
+        self.quotas = dict(quotas or {})
+        self.max_cost = max_cost
+        self.day = today()
+        self.days = {}
+        self.run = collections.defaultdict(collections.Counter)
+        # Counts not written to the file yet, merged with those of the other processes on save
+        self._unsaved = collections.defaultdict(collections.Counter)
+        self._lock = threading.Lock()
+        self.load()
+
+    @property
+    def shared(self):
+        return isinstance(self.run, SharedCounts)
+
+    def share(self):
+        """Moves the counts of the run into shared memory, so the worker processes of a sharded run book their
+        requests against the same quotas and cost budget. Call it before the workers are started, and save the ledger
+        from the parent process only.
+
+        Returns:
+            QuotaLedger: The ledger itself.
+        """
+        import multiprocessing
+
+        if self.shared:
+            return self
+        with self._lock:
+            run, unsaved = SharedCounts(PROVIDERS), SharedCounts(PROVIDERS)
+            for shared, counts in ((run, self.run), (unsaved, self._unsaved)):
+                for name, provider_counts in counts.items():
+                    shared[name].update(provider_counts)
+            self.run, self._unsaved = run, unsaved
+            self._lock = multiprocessing.Lock()
+        return self
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Holds the lock file of the ledger, shared by every run saving to it."""
+        if fcntl is None:
+            yield
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as ledger_file:
+                self.days = json.load(ledger_file).get('days', {})
+        except (FileNotFoundError, ValueError):
+            self.days = {}
+
+    def quota(self, provider):
+        """Returns the daily request quota of a provider, or None."""
+        for name in (provider.name, provider.module):
+            if name in self.quotas:
+                return self.quotas[name]
+        return None
+
+    def used(self, provider):
+        """Returns the number of requests sent to a provider today, by every run."""
+        day = self.days.get(self.day, {}).get(provider.name, {})
+        return day.get('requests', 0) + self._unsaved[provider.name]['requests']
+
+    def run_cost(self):
+        return sum(counts['cost'] for counts in self.run.values())
+
+    def __call__(self, provider):
+        """Books an HTTP request to a provider, or returns False if its quota or the cost budget is spent."""
+        with self._lock:
+            if self.day != today():
+                self.day = today()
+            quota = self.quota(provider)
+            if quota is not None and self.used(provider) >= quota:
+                self.run[provider.name]['over_quota'] += 1
+                return False
+            if provider.cost and self.max_cost is not None and (
+                    self.run_cost() + provider.cost > self.max_cost + 1e-9):
+                self.run[provider.name]['over_budget'] += 1
+                return False
+            for counts in (self.run[provider.name], self._unsaved[provider.name]):
+                counts['requests'] += 1
+                counts['cost'] += provider.cost
+            return True
+
+    def save(self):
+        """Adds the counts of this process, or of every process sharing the ledger, to the ledger file."""
+        with self._lock, self.locked():
+            self.load()
+            day = self.days.setdefault(self.day, {})
+            for name, counts in self._unsaved.items():
+                entry = day.setdefault(name, {'requests': 0, 'cost': 0.0})
+                entry['requests'] += counts['requests']
+                entry['cost'] = round(entry['cost'] + counts['cost'], 6)
+            self._unsaved.clear()
+            self.days = {date: self.days[date] for date in sorted(self.days)[-LEDGER_DAYS:]}
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path + '.tmp', 'w') as ledger_file:
+                json.dump({'days': self.days}, ledger_file, indent=1)
+            os.replace(self.path + '.tmp', self.path)
+
+
+def tiers(providers, ledger):
+    """Groups providers into dispatch tiers, cheapest first.
+
+    Local data sources and the providers that do not locate networks (vendor_check) come first, then the free
+    providers, then the free providers with a daily quota, then every paid provider on its own, cheapest first.
+
+    Returns:
+        list: The lists of providers of every tier, empty tiers left out.
+    """
+    first, free, limited, paid = [], [], [], []
+    for provider in providers:
+        if provider.local is not None or provider.module == 'vendor_check':
+            first.append(provider)
+        elif provider.cost:
+            paid.append(provider)
+        elif ledger is not None and ledger.quota(provider) is not None:
+            limited.append(provider)
+        else:
+            free.append(provider)
+    paid.sort(key=lambda provider: provider.cost)
+    return [tier for tier in [first, free, limited] + [[provider] for provider in paid] if tier]
+
+
+def settled(results, disagreement=None):
+    """Checks whether the search results hold a position and, given a distance, whether every two positions lie
+    within it."""
+    fixes = [(float(result['latitude']), float(result['longitude'])) for result in results
+             if 'error' not in result and 'latitude' in result]
+    if not fixes:
+        return False
+    if disagreement is None:
+        return True
+    return all(distance(*first, *second) <= disagreement for first, second in itertools.combinations(fixes, 2))
+
+
+class DispatchPlanner:
+    """Searches networks tier by tier, escalating to costlier providers only while needed.
+
+    Parameters:
+        ledger (QuotaLedger, optional): The quota and cost ledger. Without one, tiers only follow the provider costs.
+        disagreement (float, optional): The distance, in metres, past which the positions found count as
+            disagreeing, which escalates to the next tier. Defaults to 1000.
+        engine (Engine, optional): The engine running the queries. Defaults to the process-wide engine.
+    """
+
+    def __init__(self, ledger=None, disagreement=1000, engine=None):
+        self.ledger = ledger
+        self.disagreement = disagreement
+        self.engine = engine or get_engine()
+        # Number of searches that stopped at every tier
+        self.stops = collections.Counter()
+        self._lock = threading.Lock()
+        if ledger is not None and ledger not in self.engine.gates:
+            self.engine.gates.append(ledger)
+
+    def search(self, bssid=None, ssid=None, providers=None, exclude=None, use_cache=True):
+        """Searches a network like search_networks, with tiered dispatch.
+
+        Returns:
+            list: The search results of the providers queried, in tier order.
+        """
+        search_by = 'bssid' if bssid else 'ssid'
+        query = bssid or ssid
+        selected = [provider for provider in select_providers(search_by, providers, exclude)
+                    if use_cache or provider.local is None]
+        results = []
+        stop = 0
+        for stop, tier in enumerate(tiers(selected, self.ledger)):
+            with span('tier ' + str(stop)):
+                futures = [(provider, self.engine.executor.submit(self.engine.query, provider, query, use_cache))
+                           for provider in tier]
+                results.extend(collect_results(((provider, future.result()) for provider, future in futures),
+                                               bssid=bssid, ssid=ssid))
+            # Networks sharing an SSID may be anywhere, only the positions of one BSSID can disagree
+            if settled(results, self.disagreement if bssid else None):
+                break
+        with self._lock:
+            self.stops[stop] += 1
+        return results
+
+    def report(self):
+        """Returns the requests, cost and skipped queries of the run per provider, and the searches per tier."""
+        ledger = self.ledger
+        providers = {}
+        if ledger is not None:
+            for name, counts in sorted(ledger.run.items()):
+                provider = PROVIDERS[name]
+                providers[name] = {'requests': counts['requests'], 'cost': round(counts['cost'], 6),
+                                   'over_quota': counts['over_quota'], 'over_budget': counts['over_budget'],
+                                   'used_today': ledger.used(provider), 'quota': ledger.quota(provider)}
+        return {'providers': providers, 'stops': dict(sorted(self.stops.items())),
+                'cost': round(ledger.run_cost(), 6) if ledger is not None else 0.0}
+
+
+def open_default_planner(config, engine=None, ledger=None):
+    """Returns a planner with the ledger described by the dispatch section of the configuration, or with the given
+    ledger, e.g. the one shared by the workers of a sharded run."""
+    options = config.get('dispatch') or {}
+    if ledger is None:
+        ledger = QuotaLedger(options.get('ledger', 'results/quota.json'), options.get('daily_quota'),
+                             options.get('max_cost'))
+    return DispatchPlanner(ledger, options.get('disagreement', 1000), engine)
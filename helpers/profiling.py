@@ -0,0 +1,164 @@
+import collections
+import cProfile
+import functools
+import json
+import pstats
+import sys
+import threading
+import time
+
+
+class Span:
+    """A timed section of a run, recorded by its profiler when it ends."""
+
+    __slots__ = ('profiler', 'name', 'category', 'args', 'start')
+
+    def __init__(self, profiler, name, category, args):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.spans.append((self.name, self.category, threading.get_ident(), self.start,
+                                    time.perf_counter_ns(), self.args))
+        return False
+
+
+class NullSpan:
+    """The span returned while profiling is off, costing one method call."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Profiler:
+    """Records timing spans per phase and per provider call.
+
+    Spans are kept in a bounded buffer, so a profiler left enabled in a long-lived process only holds the most
+    recent ones.
+
+    Parameters:
+        max_spans (int, optional): The number of spans kept. Defaults to 100000.
+    """
+
+    def __init__(self, max_spans=100000):
+        self.enabled = False
+        self.spans = collections.deque(maxlen=max_spans)
+        self.started = time.perf_counter_ns()
+
+    def enable(self):
+        self.enabled = True
+        self.started = time.perf_counter_ns()
+
+    def span(self, name, category='phase', **args):
+        """Returns a context manager timing a section of the run.
+
+        Parameters:
+            name (str): The name of the section, e.g. a phase or a provider name.
+            category (str, optional): The kind of section, e.g. 'phase', 'provider' or 'http'. Defaults to 'phase'.
+            args: Extra details shown in the trace, e.g. the query.
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, args)
+
+    def summary(self):
+        """Aggregates the spans per category and name.
+
+        Returns:
+            list: (category, name, calls, total seconds, mean seconds, max seconds) tuples, largest total first.
+        """
+        totals = collections.defaultdict(list)
+        for name, category, _, start, end, _ in list(self.spans):
+            totals[(category, name)].append((end - start) / 1e9)
+        rows = [(category, name, len(durations), sum(durations), sum(durations) / len(durations), max(durations))
+                for (category, name), durations in totals.items()]
+        return sorted(rows, key=lambda row: row[3], reverse=True)
+
+    def wall_time(self):
+        return (time.perf_counter_ns() - self.started) / 1e9
+
+    def save_chrome_trace(self, path):
+        """Writes the spans in the Chrome trace event format, to open in chrome://tracing or Perfetto."""
+        events = [{
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': (start - self.started) / 1000,
+            'dur': (end - start) / 1000,
+            'pid': 1,
+            'tid': thread,
+            'args': {key: str(value) for key, value in args.items()}
+        } for name, category, thread, start, end, args in list(self.spans)]
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
+
+
+class CallProfiler:
+    """Runs cProfile in the main thread and in every thread started afterwards, e.g. the engine workers."""
+
+    def __init__(self):
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def _start_thread(self, frame, event, arg):
+        # Called once as the profile function of every new thread: replace it with a cProfile profiler
+        profile = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        threading.setprofile(self._start_thread)
+        profile = cProfile.Profile()
+        self.profiles.append(profile)
+        profile.enable()
+
+    def stop(self):
+        threading.setprofile(None)
+        self.profiles[0].disable()
+
+    def save(self, path):
+        """Writes the combined statistics of every thread in the pstats format."""
+        with self._lock:
+            stats = pstats.Stats(self.profiles[0], stream=sys.stderr)
+            for profile in self.profiles[1:]:
+                stats.add(profile)
+        stats.dump_stats(path)
+        return stats
+
+
+# The process-wide profiler used by the engine, the providers and the command line
+PROFILER = Profiler()
+
+
+def span(name, category='phase', **args):
+    """Times a section of the run with the process-wide profiler, see Profiler.span."""
+    return PROFILER.span(name, category, **args)
+
+
+def profiled(name, category='phase'):
+    """Decorates a function so every call is timed as a span of the process-wide profiler."""
+
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with PROFILER.span(name, category):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
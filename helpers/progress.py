@@ -0,0 +1,96 @@
+import collections
+import time
+
+from rich.console import Group
+from rich.live import Live
+from rich.progress import (BarColumn, MofNCompleteColumn, Progress, SpinnerColumn, TextColumn, TimeElapsedColumn,
+                           TimeRemainingColumn)
+from rich.table import Table
+
+
+class BatchProgress:
+    """Live view of a batch run: overall progress with ETA, and throughput and hit rate per module.
+
+    Only per-module counters are kept, so updating and rendering the view costs the same whatever the batch size.
+
+    Parameters:
+        total (int): The number of lookups of the batch.
+        console (rich.console.Console): The console the view is drawn on.
+        main_color (str, optional): The color of the table header. Defaults to 'bright_yellow'.
+        secondary_color (str, optional): The color of the table cells. Defaults to 'bright_blue'.
+    """
+
+    def __init__(self, total, console, main_color='bright_yellow', secondary_color='bright_blue'):
+        self.total = total
+        self.console = console
+        self.main_color = main_color
+        self.secondary_color = secondary_color
+        self.modules = collections.defaultdict(collections.Counter)
+        self.located = 0
+        self.done = 0
+        self.started = time.monotonic()
+        self.progress = Progress(
+            SpinnerColumn(),
+            TextColumn('[' + main_color + ']Lookups'),
+            BarColumn(),
+            MofNCompleteColumn(),
+            TextColumn('[' + secondary_color + ']{task.fields[rate]:.1f}/s'),
+            TimeElapsedColumn(),
+            TextColumn('ETA'),
+            TimeRemainingColumn(),
+            console=console,
+        )
+        self.task = self.progress.add_task('batch', total=total, rate=0.0)
+        self.live = Live(self, console=console, refresh_per_second=4, transient=True)
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        self.live.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.live.stop()
+        return False
+
+    def update(self, results):
+        """Counts the results of one finished lookup."""
+        self.done += 1
+        located = False
+        for result in results:
+            stats = self.modules[result.get('module', 'unknown')]
+            stats['answers'] += 1
+            if 'error' in result:
+                # Misses and failures alike, the providers word them differently
+                stats['errors'] += 1
+            elif 'latitude' in result:
+                stats['located'] += 1
+                located = True
+        self.located += located
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        self.progress.update(self.task, advance=1, rate=self.done / elapsed)
+
+    def table(self, title=None):
+        """Returns the per-module table: answers, located networks, hit rate, errors or misses and answers per second."""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        table = Table(show_header=True, header_style=self.main_color, title=title)
+        for column in ('Module', 'Answers', 'Located', 'Hit rate', 'Not located', 'Per second'):
+            table.add_column(column, style=self.secondary_color, justify='left' if column == 'Module' else 'right')
+        for module, stats in sorted(self.modules.items()):
+            answers = stats['answers']
+            table.add_row(module, str(answers), str(stats['located']),
+                          f'{stats["located"] / answers * 100:.1f}%' if answers else '-', str(stats['errors']),
+                          f'{answers / elapsed:.1f}')
+        return table
+
+    def __rich__(self):
+        return Group(self.progress, self.table())
+
+    def print_summary(self):
+        """Prints the aggregated results of the batch."""
+        elapsed = time.monotonic() - self.started
+        self.console.print(self.table(title='Batch Summary'))
+        self.console.print(
+            ' [:green_circle:] [' + self.main_color + ']Networks located[/' + self.main_color + ']: [' +
+            self.secondary_color + ']' + f'{self.located}/{self.done} in {elapsed:.1f} s' +
+            f' ({self.done / max(elapsed, 1e-9):.1f} lookups/s)[/' + self.secondary_color + ']')
+        print()
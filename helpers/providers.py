@@ -0,0 +1,550 @@
+import struct
+
+from helpers.BSSIDApple_pb2 import BSSIDReq, BSSIDResp
+from helpers.bssid import bssid_to_int, normalize_bssid
+from helpers.engine import NotFound, Provider, ProviderError, get_engine, register, select_providers
+from helpers.profiling import span
+from helpers.ssidindex import open_default_index
+from helpers.store import open_default_store
+
+
+def wigle_request(param):
+    """Returns a request builder for the Wigle network search using the given query parameter."""
+
+    def build_request(query, api_key):
+        return {
+            'headers': {
+                'accept': 'application/json',
+                'Authorization': f'Basic {api_key}'
+            },
+            'params': {param: query}
+        }
+
+    return build_request
+
+
+def parse_wigle(query, status, payload):
+    """Parses a Wigle network search response.
+
+    Returns:
+        list: A list of dictionaries, each containing information about a network.
+    """
+    if not payload['success']:
+        raise ProviderError(payload['message'])
+    if payload['totalResults'] == 0:
+        raise NotFound('No results detected')
+    return [{
+        'module': 'wigle',
+        'bssid': result.get('netid', ''),
+        'ssid': result.get('ssid', ''),
+        'latitude': result.get('trilat', ''),
+        'longitude': result.get('trilong', '')
+    } for result in payload['results']]
+
+
+def wifidb_request(param):
+    """Returns a request builder for the wifidb GeoJSON search using the given query parameter."""
+
+    def build_request(query, api_key):
+        params = {
+            'func': 'exp_search',
+            'ssid': '',
+            'mac': '',
+            'radio': '',
+            'chan': '',
+            'auth': '',
+            'encry': '',
+            'sectype': '',
+            'json': '0',
+            'labeled': '0'
+        }
+        params[param] = query
+        return {'params': params}
+
+    return build_request
+
+
+def parse_wifidb(query, status, payload):
+    """Parses a wifidb GeoJSON response.
+
+    Returns:
+        list: A list of dictionaries, each containing information about a network.
+    """
+    if status != 200:
+        raise ProviderError('Request failed')
+    results = payload['features']
+    if not results:
+        raise NotFound('No results detected')
+    return [{
+        'module': 'wifidb',
+        'bssid': result['properties']['mac'],
+        'ssid': result['properties']['ssid'],
+        'latitude': result['properties']['lat'],
+        'longitude': result['properties']['lon']
+    } for result in results]
+
+
+def wifidb_filter(param):
+    """Returns a record filter keeping the wifidb features of the searched network, by MAC or SSID."""
+
+    def keep(query, record):
+        properties = record.get('properties') or {}
+        if param == 'mac':
+            return bssid_to_int(str(properties.get('mac', ''))) == bssid_to_int(query)
+        return str(properties.get('ssid', '')).lower() == str(query).lower()
+
+    return keep
+
+
+def openwifimap_request(query, api_key):
+    return {
+        'headers': {'Content-Type': 'application/json', 'Accept': 'application/json'},
+        'json': {'keys': [query]}
+    }
+
+
+def parse_openwifimap(query, status, payload):
+    """Parses an openwifimap.net view_nodes response.
+
+    Returns:
+        dict: A dictionary containing information about the node.
+    """
+    if status != 200:
+        raise ProviderError(f'Request to openwifimap.net failed with status code {status}')
+    results = payload['rows']
+    if not results:
+        raise NotFound(f'No node found with SSID "{query}"')
+    # Extract the relevant fields from the first result
+    result = results[0]['value']
+    return {
+        'module': 'openwifimap',
+        'ssid': query,
+        'hostname': result['hostname'],
+        'latitude': result['latlng'][0],
+        'longitude': result['latlng'][1]
+    }
+
+
+def freifunk_karte_request(query, api_key):
+    return {}
+
+
+def freifunk_karte_filter(query, record):
+    """Keeps the routers of the freifunk-karte.de dump named like the SSID."""
+    return record.get('name') == query
+
+
+def parse_freifunk_karte(query, status, payload):
+    """Parses the freifunk-karte.de router dump, keeping the router named like the SSID.
+
+    Returns:
+        dict: A dictionary containing information about the network.
+    """
+    if status != 200:
+        raise ProviderError('Request failed')
+    for result in payload['allTheRouters']:
+        if result['name'] == query:
+            return {
+                'module': 'freifunk-karte',
+                'ssid': result['name'],
+                'latitude': result['lat'],
+                'longitude': result['long'],
+                'community': result['community'],
+            }
+    raise NotFound('SSID not found')
+
+
+def mylnikov_request(query, api_key):
+    return {
+        'headers': {
+            'accept': 'application/json',
+            'Content-Type': 'application/x-www-form-urlencoded'
+        },
+        'params': {'bssid': query}
+    }
+
+
+def parse_mylnikov(query, status, payload):
+    """Parses a mylnikov geolocation response.
+
+    Returns:
+        dict: A dictionary containing information about the network.
+    """
+    if status != 200:
+        raise ProviderError('Request failed')
+    # The API reports its own status in the body, 404 when it does not know the network
+    if payload['result'] == 404:
+        raise NotFound(payload['desc'])
+    if payload['result'] != 200:
+        raise ProviderError(payload['desc'])
+    return {
+        'module': 'mylnikov',
+        'bssid': query,
+        'latitude': payload['data']['lat'],
+        'longitude': payload['data']['lon']
+    }
+
+
+# Locale, client and OS version sent before the protobuf message of a wloc request
+APPLE_WLOC_HEADER = b'\x00\x01\x00\x05en_US\x00\x13com.apple.locationd\x00\x0a8.1.12B411\x00\x00\x00\x01\x00\x00'
+# BSSIDs sent in one wloc request when batching is enabled
+APPLE_BATCH_SIZE = 25
+
+
+def encode_apple_request(bssids):
+    """Encodes a wloc request for one or more BSSIDs.
+
+    Parameters:
+        bssids (list): The BSSIDs to locate.
+
+    Returns:
+        bytes: The request body, the header followed by the length-prefixed BSSIDReq message.
+    """
+    request = BSSIDReq(unk1=0, unk2=1)
+    for bssid in bssids:
+        request.wifi.add(bssid=bssid)
+    message = request.SerializeToString()
+    return APPLE_WLOC_HEADER + struct.pack('>H', len(message)) + message
+
+
+def apple_request(query, api_key):
+    # Set up the POST data, batched queries join their BSSIDs with commas
+    data = encode_apple_request(str(query).split(','))
+    return {
+        'headers': {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Accept': '*/*',
+            'Accept-Charset': 'utf-8',
+            'Accept-Encoding': 'gzip, deflate',
+            'Accept-Language': 'en-us',
+            'User-Agent': 'locationd/1753.17 CFNetwork/711.1.12 Darwin/14.0.0'
+        },
+        'data': data
+    }
+
+
+def parse_apple(query, status, payload):
+    """Parses the binary content of an Apple wloc response into a BSSIDResp protobuf object.
+
+    The response may answer a batch of BSSIDs, the entry of the queried one is matched on its 48-bit key.
+
+    Returns:
+        dict: A dictionary containing information about the network.
+    """
+    if status != 200:
+        raise ProviderError('Request failed')
+    bssid_response = BSSIDResp()
+    bssid_response.ParseFromString(payload[10:])
+    key = bssid_to_int(query)
+    # Apple drops the leading zeros of every byte, the key ignores them
+    wifi = next((wifi for wifi in bssid_response.wifi if key is not None and bssid_to_int(wifi.bssid) == key), None)
+    # Apple reports unknown networks at -180.0, -180.0
+    if wifi is None or wifi.location.lat == -18000000000:
+        raise NotFound('Latitude or longitude value not found in response')
+    location = wifi.location
+    return {
+        'module': 'apple',
+        'bssid': query,
+        'latitude': location.lat * 1e-8,
+        'longitude': location.lon * 1e-8
+    }
+
+
+def parse_apple_wloc(query, status, payload):
+    """Parses every access point of an Apple wloc response, the queried one and its neighbours.
+
+    Returns:
+        list: A list of dictionaries, each containing the location of an access point.
+    """
+    if status != 200:
+        raise ProviderError('Request failed')
+    bssid_response = BSSIDResp()
+    bssid_response.ParseFromString(payload[10:])
+    results = [{
+        'module': 'apple',
+        'bssid': normalize_bssid(wifi.bssid) or wifi.bssid,
+        'latitude': wifi.location.lat * 1e-8,
+        'longitude': wifi.location.lon * 1e-8
+    } for wifi in bssid_response.wifi if wifi.location.lat != -18000000000]
+    if not results:
+        raise NotFound('Latitude or longitude value not found in response')
+    return results
+
+
+def google_request(query, api_key):
+    return {
+        'headers': {
+            'accept': 'application/json',
+            'Content-Type': 'application/json'
+        },
+        'json': {
+            'considerIp': 'false',
+            'wifiAccessPoints': [
+                {
+                    'macAddress': query,
+                },
+                {
+                    'macAddress': '00:25:9c:cf:1c:ad',
+                }
+            ]
+        }
+    }
+
+
+def parse_google(query, status, payload):
+    """Parses a Google geolocation API response.
+
+    Returns:
+        dict: A dictionary containing information about the network.
+    """
+    if status != 200:
+        if status == 404:
+            raise NotFound(payload['error']['message'])
+        raise ProviderError(payload['error']['message'])
+    return {
+        'module': 'google',
+        'bssid': query,
+        'latitude': payload['location']['lat'],
+        'longitude': payload['location']['lng']
+    }
+
+
+def combain_request(query, api_key):
+    return {
+        'headers': {'Content-Type': 'application/json'},
+        'json': {
+            'wifiAccessPoints': [{
+                'macAddress': query,
+                'macAddress': '28:28:5d:d6:39:8a'
+            }],
+            'indoor': 1
+        }
+    }
+
+
+def parse_combain(query, status, payload):
+    """Parses a Comba.in positioning response.
+
+    Returns:
+        dict: A dictionary containing information about the network.
+    """
+    if status != 200:
+        if status == 404:
+            raise NotFound(payload['error']['message'])
+        raise ProviderError(payload['error']['message'])
+    data = {
+        'module': 'combain',
+        'bssid': query,
+        'latitude': payload['location']['lat'],
+        'longitude': payload['location']['lng'],
+    }
+    if 'indoor' in payload:
+        data['building'] = payload['indoor']['building']
+    return data
+
+
+def vendor_check_request(query, api_key):
+    return {}
+
+
+def parse_vendor_check(query, status, payload):
+    """Parses a macvendors.com response.
+
+    Returns:
+        dict: A dictionary containing information about the vendor of the device.
+    """
+    if status == 404:
+        raise NotFound('Vendor not found')
+    if status != 200:
+        raise ProviderError(f'{status} Error: {payload}')
+    return {
+        'module': 'vendor_check',
+        'vendor': payload
+    }
+
+
+def store_lookup(query, config):
+    """Reads the position of a BSSID from the local position store."""
+    store = open_default_store(config)
+    return None if store is None else store.lookup(query)
+
+
+def parse_store(query, status, payload):
+    """Parses a local position store answer.
+
+    Returns:
+        dict: A dictionary containing the stored position of the BSSID.
+    """
+    if payload is None:
+        raise NotFound('Not stored')
+    return payload
+
+
+def index_lookup(query, config):
+    """Reads the networks using an SSID from the local SSID index."""
+    index = open_default_index(config)
+    return None if index is None else index.search(query)
+
+
+def parse_index(query, status, payload):
+    """Parses a local SSID index answer.
+
+    Returns:
+        list: A list of dictionaries, each containing information about a network.
+    """
+    if not payload:
+        raise NotFound('Not indexed')
+    return payload
+
+
+# Answers from the positions resolved on earlier runs, without any request
+register(Provider(
+    name='store_bssid', module='store', search_by='bssid',
+    endpoint='', build_request=None, parse_response=parse_store,
+    local=store_lookup,
+))
+register(Provider(
+    name='wigle_bssid', module='wigle', search_by='bssid',
+    endpoint='https://api.wigle.net/api/v2/network/search', auth='wigle_auth',
+    build_request=wigle_request('netid'), parse_response=parse_wigle,
+    rate_limit=1,
+))
+register(Provider(
+    name='apple_bssid', module='apple', search_by='bssid',
+    endpoint='https://gs-loc.apple.com/clls/wloc', method='POST', response_type='content',
+    build_request=apple_request, parse_response=parse_apple,
+    batch_size=APPLE_BATCH_SIZE,
+))
+# Not part of the BSSID searches: returns the whole neighbourhood Apple sends back for a BSSID
+register(Provider(
+    name='apple_wloc', module='apple', search_by='neighbours',
+    endpoint='https://gs-loc.apple.com/clls/wloc', method='POST', response_type='content',
+    build_request=apple_request, parse_response=parse_apple_wloc,
+))
+register(Provider(
+    name='mylnikov_bssid', module='mylnikov', search_by='bssid',
+    endpoint='https://api.mylnikov.org/geolocation/wifi?v=1.1&data=open', method='POST',
+    build_request=mylnikov_request, parse_response=parse_mylnikov,
+))
+register(Provider(
+    name='google_bssid', module='google', search_by='bssid',
+    endpoint='https://www.googleapis.com/geolocation/v1/geolocate?key={api_key}', method='POST', auth='google_api',
+    build_request=google_request, parse_response=parse_google,
+    cost=0.005,
+))
+register(Provider(
+    name='combain_bssid', module='combain', search_by='bssid',
+    endpoint='https://apiv2.combain.com?key={api_key}', method='POST', auth='combain_api',
+    build_request=combain_request, parse_response=parse_combain,
+    cost=0.001,
+))
+register(Provider(
+    name='wifidb_bssid', module='wifidb', search_by='bssid',
+    endpoint='https://wifidb.net/wifidb/api/geojson.php',
+    build_request=wifidb_request('mac'), parse_response=parse_wifidb,
+    records='features', record_filter=wifidb_filter('mac'),
+))
+register(Provider(
+    name='vendor_check', module='vendor_check', search_by='bssid',
+    endpoint='https://api.macvendors.com/{query}', response_type='text', allow_insecure=False,
+    build_request=vendor_check_request, parse_response=parse_vendor_check,
+    rate_limit=2, error_fields={'vendor': 'Unknown'},
+))
+# Answers from the SSIDs collected on earlier runs, without any request
+register(Provider(
+    name='index_ssid', module='index', search_by='ssid',
+    endpoint='', build_request=None, parse_response=parse_index,
+    local=index_lookup,
+))
+register(Provider(
+    name='wigle_ssid', module='wigle', search_by='ssid',
+    endpoint='https://api.wigle.net/api/v2/network/search', auth='wigle_auth',
+    build_request=wigle_request('ssid'), parse_response=parse_wigle,
+    rate_limit=1,
+))
+register(Provider(
+    name='openwifimap_ssid', module='openwifimap', search_by='ssid',
+    endpoint='https://api.openwifimap.net/view_nodes', method='POST',
+    build_request=openwifimap_request, parse_response=parse_openwifimap,
+))
+register(Provider(
+    name='wifidb_ssid', module='wifidb', search_by='ssid',
+    endpoint='https://wifidb.net/wifidb/api/geojson.php',
+    build_request=wifidb_request('ssid'), parse_response=parse_wifidb,
+    records='features', record_filter=wifidb_filter('ssid'),
+))
+register(Provider(
+    name='freifunk_karte_ssid', module='freifunk-karte', search_by='ssid',
+    endpoint='https://www.freifunk-karte.de/data.php',
+    build_request=freifunk_karte_request, parse_response=parse_freifunk_karte,
+    records='allTheRouters', record_filter=freifunk_karte_filter,
+))
+
+
+def collect_results(provider_results, bssid=None, ssid=None):
+    """Merges raw provider results into the list of search results for one network.
+
+    Parameters:
+        provider_results (iterable): The (provider, result) tuples of the queried providers.
+        bssid (str, optional): The BSSID searched for, list results with another BSSID are dropped.
+        ssid (str, optional): The SSID searched for, list results with another SSID are dropped.
+
+    Returns:
+        list: A list of dictionaries, each containing information about a network.
+    """
+    target = bssid_to_int(bssid) if bssid else str(ssid).lower()
+
+    # Initialize an empty list to store the results
+    results = []
+
+    # Add the result of every provider, keeping only the entries matching the searched network. The results come
+    # from a generator waiting on the providers, only the filtering itself is timed
+    for provider, result in provider_results:
+        with span('filter'):
+            if isinstance(result, list):
+                for res in result:
+                    if bssid and bssid_to_int(res['bssid']) != target:
+                        continue
+                    if ssid and str(res['ssid']).lower() != target:
+                        continue
+                    if res['latitude'] != 0.0:
+                        results.append(dict(res))
+            else:
+                results.append(dict(result))
+
+    # Format the json data
+    for locations in results:
+        if 'latitude' in locations:
+            locations['latitude'] = float(locations['latitude'])
+        if 'longitude' in locations:
+            locations['longitude'] = float(locations['longitude'])
+
+    return results
+
+
+def search_networks(bssid=None, ssid=None, providers=None, exclude=None, engine=None, use_cache=True):
+    """Searches for networks using the specified search criteria.
+
+    Parameters:
+        bssid (str, optional): The BSSID of the network to search for.
+        ssid (str, optional): The SSID of the network to search for.
+        providers (list, optional): Provider or module names to query, all registered providers when empty.
+        exclude (list, optional): Provider or module names to skip.
+        engine (Engine, optional): The engine running the queries. Defaults to the process-wide engine.
+        use_cache (bool, optional): Whether cached provider results and stored positions may be used.
+            Defaults to True.
+
+    Returns:
+        list: A list of dictionaries, each containing information about a network.
+    """
+    engine = engine or get_engine()
+
+    if bssid:
+        # Query the providers with the canonical colon notation and match the results on the 48-bit key
+        bssid = normalize_bssid(bssid) or bssid
+        selected = [provider for provider in select_providers('bssid', providers, exclude)
+                    if use_cache or provider.local is None]
+        return collect_results(engine.search(selected, bssid, use_cache), bssid=bssid)
+    selected = [provider for provider in select_providers('ssid', providers, exclude)
+                if use_cache or provider.local is None]
+    return collect_results(engine.search(selected, ssid, use_cache), ssid=ssid)
@@ -0,0 +1,331 @@
+"""Background refresh of the BSSID position store.
+
+Stored positions are re-queried in priority order: the older a position, the fewer modules that located it and the
+more they disagree, the sooner it is refreshed. Every cycle spends at most a fixed budget of requests per provider,
+and only the refreshed positions are written back, through the append log of the store.
+
+The positions replaced by a refresh are kept in <store path>.history, in the append log record format, so the
+previous positions of an access point stay available and an access point that moved can be told apart from
+providers that disagree.
+
+Run `python3 -m helpers.refresh --help` to run a refresh cycle or to read the history of a BSSID.
+"""
+import argparse
+import collections
+import heapq
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from helpers.bssid import FLAG_MOVED, FLAG_STALE, bssid_to_int, int_to_bssid
+from helpers.engine import PROVIDERS, get_engine, select_providers
+from helpers.providers import search_networks
+from helpers.store import LOG_RECORD, Position, distance, module_mask, open_default_store
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DAY = 86400
+
+
+class RefreshPolicy:
+    """How refresh priorities are computed and how many requests a cycle may spend.
+
+    The priority of a position is age / max_age + 1 / confidence + min(spread / disagreement, 4), so a month-old
+    position, a position located by a single module and a position whose modules are 500 m apart weigh the same.
+
+    Parameters:
+        max_age (float, optional): The age, in seconds, worth one priority point. Defaults to 30 days.
+        min_age (float, optional): Positions updated more recently are never refreshed. Defaults to 1 day.
+        disagreement (float, optional): The spread, in metres, worth one priority point. Defaults to 500.
+        move_threshold (float, optional): The distance, in metres, past which a refreshed position counts as a
+            moved access point rather than noise. Defaults to 1000.
+        budget (dict, optional): The requests per cycle of providers or modules, e.g. {'google': 50}.
+        default_budget (int, optional): The requests per cycle of free providers missing from budget. Paid
+            providers are only queried when budgeted explicitly. Defaults to 100.
+    """
+
+    def __init__(self, max_age=30 * DAY, min_age=DAY, disagreement=500, move_threshold=1000, budget=None,
+                 default_budget=100):
+        self.max_age = max_age
+        self.min_age = min_age
+        self.disagreement = disagreement
+        self.move_threshold = move_threshold
+        self.budget = dict(budget or {})
+        self.default_budget = default_budget
+
+    @classmethod
+    def from_config(cls, options):
+        """Reads the policy from the refresh section of the configuration, where ages are given in days."""
+        return cls(max_age=options.get('max_age_days', 30) * DAY, min_age=options.get('min_age_days', 1) * DAY,
+                   disagreement=options.get('disagreement', 500), move_threshold=options.get('move_threshold', 1000),
+                   budget=options.get('budget'), default_budget=options.get('default_budget', 100))
+
+    def priority(self, position, now):
+        """Returns the refresh priority of a Position, or None if it is too recent to be refreshed."""
+        age = now - position.updated
+        if age < self.min_age:
+            return None
+        return age / self.max_age + 1 / max(position.confidence, 1) + min(position.spread / self.disagreement, 4)
+
+    def priorities(self, updated, modules, spread, now):
+        """Vectorised priority of numpy columns, -inf for the positions too recent to be refreshed."""
+        age = now - updated.astype(numpy.float64)
+        confidence = numpy.unpackbits(modules.view(numpy.uint8)).reshape(len(modules), -1).sum(axis=1)
+        scores = (age / self.max_age + 1 / numpy.maximum(confidence, 1) +
+                  numpy.minimum(spread / self.disagreement, 4))
+        scores[age < self.min_age] = -numpy.inf
+        return scores
+
+    def budgets(self):
+        """Returns the requests per cycle of every BSSID provider that locates networks."""
+        budgets = {}
+        for provider in select_providers('bssid'):
+            if provider.local is not None or provider.module == 'vendor_check':
+                continue
+            for name in (provider.name, provider.module):
+                if name in self.budget:
+                    budgets[provider.name] = self.budget[name]
+                    break
+            else:
+                budgets[provider.name] = 0 if provider.cost else self.default_budget
+        return {name: budget for name, budget in budgets.items() if budget > 0}
+
+
+class PositionHistory:
+    """The positions replaced by refreshes, appended to a file of append log records.
+
+    Parameters:
+        path (str): The path of the history file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, positions):
+        positions = list(positions)
+        if not positions:
+            return
+        with self._lock, open(self.path, 'ab') as history:
+            history.write(b''.join(position.pack() for position in positions))
+
+    def read(self, keys=None):
+        """Returns the previous positions of BSSID keys, all of them when keys is None.
+
+        Returns:
+            dict: The Positions of every key, oldest first.
+        """
+        keys = None if keys is None else set(keys)
+        positions = collections.defaultdict(list)
+        try:
+            with open(self.path, 'rb') as history:
+                data = history.read()
+        except FileNotFoundError:
+            return positions
+        for fields in LOG_RECORD.iter_unpack(data[:len(data) - len(data) % LOG_RECORD.size]):
+            if keys is None or fields[0] in keys:
+                positions[fields[0]].append(Position(*fields))
+        for entries in positions.values():
+            entries.sort(key=lambda position: position.updated)
+        return positions
+
+
+class RefreshScheduler:
+    """Re-queries the stored positions most in need of it, within the request budget of every provider.
+
+    Parameters:
+        store (PositionStore): The store to refresh.
+        policy (RefreshPolicy, optional): The priorities and budgets. Defaults to RefreshPolicy().
+        engine (Engine, optional): The engine running the queries. Defaults to the process-wide engine.
+        workers (int, optional): The number of refreshes running at the same time. Defaults to 16.
+    """
+
+    def __init__(self, store, policy=None, engine=None, workers=16):
+        self.store = store
+        self.policy = policy or RefreshPolicy()
+        self.engine = engine or get_engine()
+        self.workers = workers
+        self.history = PositionHistory(store.path + '.history')
+
+    def plan(self, limit, now=None):
+        """Returns the limit stored Positions with the highest refresh priority, highest first."""
+        now = time.time() if now is None else now
+        store = self.store
+        policy = self.policy
+        candidates = []
+        with store._lock:
+            store.reopen_if_changed()
+            log = list(store.log.values())
+            if numpy is not None and store.count:
+                # Score the mapped columns in place, the log entries replace their rows
+                columns = {name: numpy.frombuffer(store.columns[name], dtype=dtype) for name, dtype in
+                           (('key', numpy.uint64), ('updated', numpy.uint32), ('modules', numpy.uint16),
+                            ('spread', numpy.uint16))}
+                scores = policy.priorities(columns['updated'], columns['modules'], columns['spread'], now)
+                if log:
+                    scores[numpy.isin(columns['key'], numpy.array(list(store.log), dtype=numpy.uint64))] = -numpy.inf
+                rows = numpy.flatnonzero(scores > -numpy.inf)
+                if len(rows) > limit:
+                    rows = rows[numpy.argpartition(scores[rows], len(rows) - limit)[len(rows) - limit:]]
+                candidates = [(float(scores[row]), store.row(int(row))) for row in rows]
+                positions = log
+            else:
+                positions = iter(store) if store.count else log
+            scored = ((policy.priority(position, now), position) for position in positions)
+            candidates.extend((score, position) for score, position in scored if score is not None)
+        return [position for _, position in heapq.nlargest(limit, candidates, key=lambda candidate: candidate[0])]
+
+    def assign(self, positions, budgets):
+        """Splits the request budgets over positions in priority order.
+
+        Returns:
+            list: (position, provider names) tuples, for the positions that got at least one provider.
+        """
+        remaining = dict(budgets)
+        assigned = []
+        for position in positions:
+            names = [name for name, budget in remaining.items() if budget > 0]
+            if not names:
+                break
+            for name in names:
+                remaining[name] -= 1
+            assigned.append((position, names))
+        return assigned
+
+    def update(self, old, names, results, now):
+        """Works out the refreshed Position of a stored one from the results of the providers queried.
+
+        A refresh that locates the BSSID replaces the position; the modules that were not queried keep vouching for
+        it unless the access point moved. A refresh that does not locate it keeps the position, flagged stale.
+
+        Returns:
+            tuple: The new Position and the distance it moved, in metres, or None if it did not move.
+        """
+        queried = module_mask(PROVIDERS[name].module for name in names)
+        new = Position.from_results(old.key, [result for result in results if 'sibling' not in result], now,
+                                    old.flags & ~(FLAG_STALE | FLAG_MOVED))
+        if new is None:
+            return Position(old.key, old.lat, old.lon, int(now), old.modules, old.spread, old.flags | FLAG_STALE), None
+        moved = distance(old.latitude, old.longitude, new.latitude, new.longitude)
+        if moved > max(self.policy.move_threshold, old.spread, new.spread):
+            new.flags |= FLAG_MOVED
+            return new, moved
+        new.modules |= old.modules & ~queried
+        return new, None
+
+    def run_once(self, limit=None, now=None):
+        """Runs one refresh cycle.
+
+        Parameters:
+            limit (int, optional): The maximum number of positions refreshed. Defaults to the largest budget.
+            now (float, optional): The current time, in seconds since the epoch.
+
+        Returns:
+            dict: The number of positions refreshed, located, moved and missed, the requests per provider and the
+                moved access points.
+        """
+        now = time.time() if now is None else now
+        budgets = self.policy.budgets()
+        report = {'refreshed': 0, 'located': 0, 'moved': 0, 'missed': 0, 'requests': collections.Counter(),
+                  'moved_aps': []}
+        if not budgets:
+            return report
+        limit = max(budgets.values()) if limit is None else limit
+        assigned = self.assign(self.plan(limit, now), budgets)
+        updates = []
+        replaced = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(search_networks, bssid=int_to_bssid(position.key), providers=names,
+                                       engine=self.engine, use_cache=False): (position, names)
+                       for position, names in assigned}
+            for future in as_completed(futures):
+                old, names = futures[future]
+                report['requests'].update(names)
+                try:
+                    results = future.result()
+                except Exception:
+                    # Leave the position for the next cycle
+                    continue
+                new, moved = self.update(old, names, results, now)
+                report['refreshed'] += 1
+                if new.flags & FLAG_STALE:
+                    report['missed'] += 1
+                else:
+                    report['located'] += 1
+                    replaced.append(old)
+                if moved is not None:
+                    report['moved'] += 1
+                    report['moved_aps'].append({'bssid': int_to_bssid(old.key), 'from': [old.latitude, old.longitude],
+                                                'to': [new.latitude, new.longitude], 'distance': round(moved)})
+                updates.append(new)
+        # History first: a crash in between leaves an extra history entry rather than a lost position
+        self.history.append(replaced)
+        self.store.append(updates)
+        return report
+
+    def start(self, interval=3600):
+        """Runs a refresh cycle every interval seconds from a daemon thread, e.g. next to a lookup server.
+
+        Returns:
+            threading.Event: Set it to stop the thread.
+        """
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.run_once()
+                except Exception:
+                    # A failed cycle is retried on the next one
+                    pass
+
+        threading.Thread(target=run, name='geowifi-refresh', daemon=True).start()
+        return stop
+
+
+def open_default_scheduler(config, engine=None):
+    """Returns a scheduler over the default store, configured by the refresh section, or None without a store."""
+    store = open_default_store(config)
+    if store is None:
+        return None
+    options = config.get('refresh') or {}
+    return RefreshScheduler(store, RefreshPolicy.from_config(options), engine, options.get('workers', 16))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Refresh the geowifi BSSID position store.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='Run one refresh cycle')
+    run.add_argument('--limit', type=int, help='Maximum number of BSSIDs refreshed (default: the largest budget)')
+    plan = commands.add_parser('plan', help='List the BSSIDs the next cycle would refresh, without querying')
+    plan.add_argument('--limit', type=int, default=20)
+    history = commands.add_parser('history', help='Show the previous positions of BSSIDs')
+    history.add_argument('bssids', nargs='+')
+    args = parser.parse_args()
+
+    scheduler = open_default_scheduler(get_engine().config)
+    if scheduler is None:
+        parser.error('the position store is disabled in the configuration')
+    if args.command == 'run':
+        report = scheduler.run_once(args.limit)
+        print(json.dumps(report, indent=2))
+    elif args.command == 'plan':
+        now = time.time()
+        for position in scheduler.plan(args.limit, now):
+            print(json.dumps(dict(position.to_result(), priority=round(scheduler.policy.priority(position, now), 3),
+                                  spread=position.spread)))
+    elif args.command == 'history':
+        keys = [bssid_to_int(bssid) for bssid in args.bssids]
+        entries = scheduler.history.read(key for key in keys if key is not None)
+        for bssid, key in zip(args.bssids, keys):
+            current = scheduler.store.get(key) if key is not None else None
+            print(json.dumps({'bssid': bssid, 'history': [position.to_result() for position in entries.get(key, [])],
+                              'current': current.to_result() if current is not None else None}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import base64
+import collections
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+# Query parameters carrying credentials, left out of the request keys so recordings hold no secrets and replay on
+# machines configured with other keys, or none
+AUTH_PARAMS = {'key', 'api_key', 'apikey', 'access_token', 'token'}
+
+
+def fingerprint(path, query_string, body):
+    """Identifies a provider request independently of the host it was sent to and of the credentials it carried.
+
+    Parameters:
+        path (str): The path of the endpoint, without the stub provider prefix.
+        query_string (str): The raw query string of the request.
+        body (bytes or str): The request body, if any.
+
+    Returns:
+        str: A stable key for the request.
+    """
+    if isinstance(body, str):
+        # http.client sends str bodies encoded as ISO-8859-1
+        body = body.encode('iso-8859-1')
+    params = '&'.join(f'{key}={value}' for key, value in sorted(parse_qsl(query_string, keep_blank_values=True))
+                      if key.lower() not in AUTH_PARAMS)
+    return f'{path}?{params}#{hashlib.sha1(body or b"").hexdigest()}'
+
+
+class Recorder:
+    """Engine hook saving every provider response so it can be replayed offline.
+
+    Responses are appended to <directory>/<provider name>.jsonl, one JSON record per line.
+
+    Parameters:
+        directory (str): The directory the recordings are written to.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, provider, query, response):
+        url = urlsplit(response.request.url)
+        path = url.path or '/'
+        if path == f'/{provider.name}' or path.startswith(f'/{provider.name}/'):
+            # The engine was itself pointed at a stub server, keep only the real endpoint path
+            path = path[len(provider.name) + 1:] or '/'
+        record = {
+            'query': query,
+            'key': fingerprint(path, url.query, response.request.body),
+            'status': response.status_code,
+            'content_type': response.headers.get('Content-Type', ''),
+            'body': base64.b64encode(response.content).decode('ascii'),
+        }
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        with self._lock:
+            # One unbuffered append per record, so the workers of a sharded batch can record to the same files
+            with open(os.path.join(self.directory, provider.name + '.jsonl'), 'ab', buffering=0) as recording:
+                recording.write(line)
+
+
+def load_recordings(directory):
+    """Loads the responses recorded by a Recorder.
+
+    Parameters:
+        directory (str): The directory holding the recordings.
+
+    Returns:
+        dict: The recorded responses, as {provider name: {request key: record}}.
+    """
+    recordings = collections.defaultdict(dict)
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.jsonl'):
+            continue
+        with open(os.path.join(directory, filename)) as recording:
+            for line in recording:
+                record = json.loads(line)
+                record['body'] = base64.b64decode(record['body'])
+                recordings[filename[:-len('.jsonl')]][record['key']] = record
+    return recordings
+
+
+def recorded_queries(recordings, providers):
+    """Returns the distinct queries recorded for the given providers, in a stable order."""
+    queries = set()
+    for provider in providers:
+        queries.update(record['query'] for record in recordings.get(provider.name, {}).values())
+    return sorted(queries)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Replays recorded provider responses, served under /<provider name>/<endpoint path>."""
+
+    protocol_version = 'HTTP/1.1'
+    # Reply without waiting for delayed ACKs, which would otherwise dominate the measured latency
+    disable_nagle_algorithm = True
+    recordings = None
+    latency = 0.0
+    jitter = 0.0
+    error_rate = 0.0
+    slow_rate = 0.0
+    slow_latency = 0.0
+    random = random.Random()
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        url = urlsplit(self.path)
+        provider, _, path = url.path.lstrip('/').partition('/')
+        record = self.recordings.get(provider, {}).get(fingerprint('/' + path, url.query, body))
+
+        # Simulate the provider latency and transient failures
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if self.random.random() < self.slow_rate:
+            # Long tail: a few responses take much longer than the rest
+            delay += self.slow_latency
+        if delay > 0:
+            time.sleep(delay)
+        if self.random.random() < self.error_rate:
+            status, content_type, content = 503, 'application/json', b'{"error": {"message": "Injected error"}}'
+        elif record is None:
+            status, content_type, content = 404, 'application/json', b'{"error": {"message": "Not recorded"}}'
+        else:
+            status, content_type, content = record['status'], record['content_type'], record['body']
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = reply
+    do_POST = reply
+
+
+def create_stub_server(recordings, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0, seed=None,
+                       slow_rate=0.0, slow_latency=0.0):
+    """Creates a local server replaying recorded provider responses.
+
+    Point an Engine at it with Engine(base_url=f'http://{host}:{server.server_address[1]}').
+
+    Parameters:
+        recordings (dict): The recordings returned by load_recordings().
+        host (str, optional): The address to listen on. Defaults to '127.0.0.1'.
+        port (int, optional): The port to listen on, 0 picks a free port. Defaults to 0.
+        latency (float, optional): The mean delay added to every response, in seconds. Defaults to 0.
+        jitter (float, optional): The maximum random deviation from the latency, in seconds. Defaults to 0.
+        error_rate (float, optional): The fraction of requests answered with a 503 error. Defaults to 0.
+        seed (int, optional): Seed of the random generator, for reproducible runs.
+        slow_rate (float, optional): The fraction of responses delayed by slow_latency on top. Defaults to 0.
+        slow_latency (float, optional): The extra delay of the slow responses, in seconds. Defaults to 0.
+
+    Returns:
+        ThreadingHTTPServer: The server, ready for serve_forever().
+    """
+    handler = type('BoundStubHandler', (StubHandler,), {
+        'recordings': recordings,
+        'latency': latency,
+        'jitter': jitter,
+        'error_rate': error_rate,
+        'slow_rate': slow_rate,
+        'slow_latency': slow_latency,
+        'random': random.Random(seed),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
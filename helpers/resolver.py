@@ -0,0 +1,162 @@
+import collections
+import ipaddress
+import socket
+import threading
+import time
+
+from requests import Request
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.connection import is_connection_dropped
+
+from helpers.profiling import span
+
+try:
+    import dns.resolver
+except ImportError:
+    dns = None
+
+
+class DNSCache:
+    """Resolves host names once and keeps the addresses until their TTL expires.
+
+    With dnspython installed the TTL of the DNS answer is used, capped at max_ttl. The system resolver does not
+    report TTLs, so its answers are kept for default_ttl seconds.
+
+    Parameters:
+        default_ttl (float, optional): The number of seconds answers of the system resolver are kept. Defaults to 300.
+        max_ttl (float, optional): The maximum number of seconds an answer is kept. Defaults to 3600.
+    """
+
+    def __init__(self, default_ttl=300, max_ttl=3600):
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        self.stats = collections.Counter()
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, host, port):
+        """Queries the resolver for the IPv4 and IPv6 addresses of a host, returns the addresses and their TTL."""
+        if dns is not None:
+            addresses, ttls = [], []
+            for record_type in ('A', 'AAAA'):
+                try:
+                    answer = dns.resolver.resolve(host, record_type)
+                except Exception:
+                    # No record of this family, or no usable name server
+                    continue
+                addresses.extend(record.address for record in answer)
+                ttls.append(answer.rrset.ttl)
+            if addresses:
+                return addresses, min(min(ttls), self.max_ttl)
+            # Let the system resolver try, it also covers the hosts file
+        infos = socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM)
+        return list(dict.fromkeys(info[4][0] for info in infos)), self.default_ttl
+
+    def resolve(self, host, port=443):
+        """Returns the addresses of a host, from the cache while their TTL lasts.
+
+        Raises:
+            socket.gaierror: If the host name cannot be resolved.
+        """
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+        with self._lock:
+            entry = self._entries.get(host)
+        if entry is not None and entry[0] > time.monotonic():
+            self.stats['hits'] += 1
+            return entry[1]
+        with span(host, 'dns'):
+            addresses, ttl = self.lookup(host, port)
+        self.stats['lookups'] += 1
+        with self._lock:
+            self._entries[host] = (time.monotonic() + ttl, addresses)
+        return addresses
+
+    def forget(self, host):
+        """Drops the cached addresses of a host, e.g. after a connection to them failed."""
+        with self._lock:
+            self._entries.pop(host, None)
+
+
+class CachedDNSConnection(HTTPConnection):
+    """An HTTP connection resolving its host through a DNSCache, set as the dns_cache class attribute."""
+
+    dns_cache = None
+
+    def _new_conn(self):
+        # urllib3 connects to _dns_host and keeps host for the Host header, SNI and certificate checks
+        host = self._dns_host
+        try:
+            addresses = self.dns_cache.resolve(host, self.port)
+        except OSError:
+            addresses = []
+        if not addresses:
+            # Leave the resolution and its error reporting to urllib3
+            return super()._new_conn()
+        # Try every address in turn, as socket.create_connection does, and report the last error
+        error = None
+        try:
+            for address in addresses:
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except Exception as e:
+                    error = e
+        finally:
+            self._dns_host = host
+        self.dns_cache.forget(host)
+        raise error
+
+
+class CachedDNSHTTPSConnection(CachedDNSConnection, HTTPSConnection):
+    pass
+
+
+class CachedDNSAdapter(HTTPAdapter):
+    """A requests transport adapter whose connections resolve host names through a shared DNSCache.
+
+    Parameters:
+        dns_cache (DNSCache): The cache used by every connection of the adapter.
+        kwargs: The HTTPAdapter arguments, e.g. pool_connections and pool_maxsize.
+    """
+
+    def __init__(self, dns_cache, **kwargs):
+        self.dns_cache = dns_cache
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        connections = {
+            scheme: type(connection.__name__, (connection,), {'dns_cache': self.dns_cache})
+            for scheme, connection in (('http', CachedDNSConnection), ('https', CachedDNSHTTPSConnection))
+        }
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('CachedDNSConnectionPool', (HTTPConnectionPool,), {'ConnectionCls': connections['http']}),
+            'https': type('CachedDNSHTTPSConnectionPool', (HTTPSConnectionPool,),
+                          {'ConnectionCls': connections['https']}),
+        }
+
+    def warm(self, url, verify=True):
+        """Makes sure the connection pool of a URL holds an open connection, opening one if needed."""
+        request = Request('GET', url).prepare()
+        if hasattr(self, 'get_connection_with_tls_context'):
+            connection_pool = self.get_connection_with_tls_context(request, verify)
+        else:
+            # requests < 2.32.2
+            connection_pool = self.get_connection(url)
+        connection = connection_pool._get_conn()
+        try:
+            if connection.sock is None or is_connection_dropped(connection):
+                connection.close()
+                with span(connection_pool.host, 'connect'):
+                    connection.connect()
+        except Exception:
+            connection.close()
+            raise
+        finally:
+            connection_pool._put_conn(connection)
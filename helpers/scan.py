@@ -0,0 +1,203 @@
+import csv
+import json
+import math
+import statistics
+
+from helpers.bssid import normalize_bssid
+from helpers.engine import get_engine, select_providers
+from helpers.providers import collect_results
+
+EARTH_RADIUS = 6371008.8
+# Rate-limited providers only look up the strongest APs of a scan, one at a time
+RATE_LIMITED_APS = 8
+
+
+def read_scan(path):
+    """Reads a Wi-Fi scan: the BSSIDs seen by a device and their signal strength.
+
+    The file may be a CSV file with bssid and rssi columns (with or without a header), a JSON list of
+    {"bssid": ..., "rssi": ...} objects or the same objects one per line.
+
+    Parameters:
+        path (str): The path of the scan file.
+
+    Returns:
+        list: A list of (bssid, rssi) tuples, with the BSSIDs in colon notation. Invalid entries are skipped.
+    """
+    with open(path, 'r') as scan_file:
+        content = scan_file.read()
+    stripped = content.lstrip()
+    if stripped.startswith('['):
+        entries = [(entry['bssid'], entry.get('rssi')) for entry in json.loads(stripped)]
+    elif stripped.startswith('{'):
+        entries = [(entry['bssid'], entry.get('rssi')) for entry in map(json.loads, stripped.splitlines()) if entry]
+    else:
+        entries = [tuple(row[:2]) for row in csv.reader(content.splitlines()) if len(row) >= 2]
+
+    scan = {}
+    for bssid, rssi in entries:
+        bssid = normalize_bssid(bssid)
+        try:
+            rssi = float(rssi)
+        except (TypeError, ValueError):
+            # Header rows and entries without a signal level
+            continue
+        if bssid:
+            # Keep the strongest reading of an AP seen several times
+            scan[bssid] = max(rssi, scan.get(bssid, rssi))
+    return list(scan.items())
+
+
+def rssi_to_distance(rssi, reference=-40.0, exponent=3.0):
+    """Estimates the distance to an AP from its signal strength with the log-distance path loss model.
+
+    Parameters:
+        rssi (float): The received signal strength in dBm.
+        reference (float, optional): The signal strength at one metre. Defaults to -40 dBm.
+        exponent (float, optional): The path loss exponent, 2 in free space and 2.7 to 4 indoors. Defaults to 3.
+
+    Returns:
+        float: The estimated distance in metres.
+    """
+    return 10 ** ((reference - rssi) / (10 * exponent))
+
+
+def ap_position(results):
+    """Combines the provider fixes of one AP into a single position, the median being robust to outliers.
+
+    Returns:
+        tuple: The latitude and longitude, or None if no provider located the AP.
+    """
+    fixes = [(result['latitude'], result['longitude']) for result in results
+             if 'error' not in result and 'latitude' in result and 'longitude' in result]
+    if not fixes:
+        return None
+    return statistics.median(lat for lat, _ in fixes), statistics.median(lon for _, lon in fixes)
+
+
+def trilaterate(anchors):
+    """Estimates a position from APs with known positions and estimated distances.
+
+    Minimises sum(w * (|p - ap| - d) ** 2) with w = 1 / d ** 2 using Gauss-Newton iterations in a local plane
+    around the weighted centroid, so strong (near) APs count more than weak ones.
+
+    Parameters:
+        anchors (list): A list of (latitude, longitude, distance in metres) tuples.
+
+    Returns:
+        tuple: The latitude, the longitude and the accuracy estimate in metres.
+    """
+    weights = [1 / max(distance, 1.0) ** 2 for _, _, distance in anchors]
+    total = sum(weights)
+    lat0 = sum(w * lat for w, (lat, _, _) in zip(weights, anchors)) / total
+    lon0 = sum(w * lon for w, (_, lon, _) in zip(weights, anchors)) / total
+
+    # Project the APs on a local plane in metres, around the weighted centroid
+    scale_x = math.radians(1) * EARTH_RADIUS * math.cos(math.radians(lat0))
+    scale_y = math.radians(1) * EARTH_RADIUS
+    points = [((lon - lon0) * scale_x, (lat - lat0) * scale_y, distance) for lat, lon, distance in anchors]
+
+    x = y = 0.0
+    if len(points) >= 3:
+        for _ in range(50):
+            # Normal equations of the linearised problem: (J^T W J) delta = -J^T W r
+            a11 = a12 = a22 = b1 = b2 = 0.0
+            for w, (px, py, distance) in zip(weights, points):
+                dx, dy = x - px, y - py
+                norm = math.hypot(dx, dy) or 1e-6
+                jx, jy = dx / norm, dy / norm
+                residual = norm - distance
+                a11 += w * jx * jx
+                a12 += w * jx * jy
+                a22 += w * jy * jy
+                b1 -= w * jx * residual
+                b2 -= w * jy * residual
+            determinant = a11 * a22 - a12 * a12
+            if abs(determinant) < 1e-12:
+                break
+            step_x = (a22 * b1 - a12 * b2) / determinant
+            step_y = (a11 * b2 - a12 * b1) / determinant
+            x += step_x
+            y += step_y
+            if math.hypot(step_x, step_y) < 0.01:
+                break
+
+    # Accuracy: weighted RMS of the range residuals, never better than the distance to the nearest AP model allows
+    residuals = [w * (math.hypot(x - px, y - py) - distance) ** 2 for w, (px, py, distance) in zip(weights, points)]
+    accuracy = math.sqrt(sum(residuals) / total)
+    accuracy = max(accuracy, min(distance for _, _, distance in points))
+    return lat0 + y / scale_y, lon0 + x / scale_x, accuracy
+
+
+def query_in_turn(engine, provider, bssids, use_cache=True):
+    """Looks up several BSSIDs at one provider, one after the other.
+
+    Parameters:
+        engine (Engine): The engine running the queries.
+        provider (Provider): The provider to query.
+        bssids (list): The BSSIDs to look up.
+        use_cache (bool, optional): Whether cached results and known misses may be used. Defaults to True.
+
+    Returns:
+        list: The result of every BSSID, in order.
+    """
+    return [engine.query(provider, bssid, use_cache) for bssid in bssids]
+
+
+def locate_scan(scan, providers=None, exclude=None, engine=None, use_cache=True, reference=-40.0, exponent=3.0):
+    """Locates a device from a Wi-Fi scan.
+
+    The (AP, provider) queries of providers without a rate limit are submitted to the engine executor at once. Each
+    rate-limited provider (Wigle allows one request per second) gets a single task that looks up the strongest
+    RATE_LIMITED_APS APs in turn, so its limiter holds one pool thread instead of one per AP and the scan waits at
+    most RATE_LIMITED_APS request intervals for it, whatever the number of APs. The per-AP positions are then combined
+    by RSSI-weighted trilateration.
+
+    Parameters:
+        scan (list): The (bssid, rssi) tuples of the scan.
+        providers (list, optional): Provider or module names to query.
+        exclude (list, optional): Provider or module names to skip.
+        engine (Engine, optional): The engine running the queries. Defaults to the process-wide engine.
+        use_cache (bool, optional): Whether cached results and known misses may be used. Defaults to True.
+        reference (float, optional): The signal strength at one metre, in dBm. Defaults to -40.
+        exponent (float, optional): The path loss exponent. Defaults to 3.
+
+    Returns:
+        tuple: The estimated position as a result dictionary (or an error dictionary if no AP could be located),
+            and the search results of every AP.
+    """
+    engine = engine or get_engine()
+    selected = [provider for provider in select_providers('bssid', providers, exclude)
+                if provider.name != 'vendor_check']
+    if not scan or not selected:
+        return {'module': 'scan', 'error': 'No access points to locate'}, {}
+
+    strongest = [bssid for bssid, _ in sorted(scan, key=lambda entry: entry[1], reverse=True)[:RATE_LIMITED_APS]]
+    # One task per rate-limited provider, one task per query for the others
+    batches = [(provider, bssids) for provider in selected
+               for bssids in ([strongest] if engine.rate_limit(provider) else [[bssid] for bssid, _ in scan])]
+    futures = [(provider, bssids, engine.executor.submit(query_in_turn, engine, provider, bssids, use_cache))
+               for provider, bssids in batches]
+    per_ap = {bssid: [] for bssid, _ in scan}
+    for provider, bssids, future in futures:
+        for bssid, result in zip(bssids, future.result()):
+            per_ap[bssid].append((provider, result))
+
+    ap_results = {bssid: collect_results(results, bssid=bssid) for bssid, results in per_ap.items()}
+    anchors = []
+    for bssid, rssi in scan:
+        position = ap_position(ap_results[bssid])
+        if position is not None:
+            anchors.append((position[0], position[1], rssi_to_distance(rssi, reference, exponent)))
+
+    if not anchors:
+        return {'module': 'scan', 'error': 'None of the access points could be located'}, ap_results
+    latitude, longitude, accuracy = trilaterate(anchors)
+    return {
+        'module': 'scan',
+        'latitude': latitude,
+        'longitude': longitude,
+        'accuracy': round(accuracy, 1),
+        'aps_located': len(anchors),
+        'aps_total': len(scan)
+    }, ap_results
@@ -0,0 +1,75 @@
+from helpers.engine import get_engine
+from helpers.expand import expand_search
+from helpers.planner import open_default_planner
+from helpers.providers import search_networks
+from helpers.ssidindex import open_default_index
+
+
+class SearchMode:
+    """The search selected on the command line, as a function of a BSSID or an SSID.
+
+    It holds options only, so it can be sent to the worker processes of a sharded batch, which then run the same
+    searches as a single process would, on their own engine.
+
+    Parameters:
+        providers (list, optional): Provider or module names to query.
+        exclude (list, optional): Provider or module names to skip.
+        use_cache (bool, optional): Whether cached results, known misses and local data may be used. Defaults to True.
+        expand_budget (int, optional): Search the sibling BSSIDs of BSSIDs no provider located, with at most this
+            many extra provider requests. Defaults to None, no expansion.
+        match (str, optional): How SSIDs are matched, see helpers.ssidindex.MATCH_MODES. Defaults to 'exact'.
+        max_distance (int, optional): The maximum edit distance of fuzzy SSID matches. Defaults to 2.
+        tiered (bool, optional): Dispatch the provider queries in tiers, see helpers.planner. Defaults to False.
+    """
+
+    def __init__(self, providers=None, exclude=None, use_cache=True, expand_budget=None, match='exact',
+                 max_distance=2, tiered=False):
+        self.providers = providers
+        self.exclude = exclude
+        self.use_cache = use_cache
+        self.expand_budget = expand_budget
+        self.match = match
+        self.max_distance = max_distance
+        self.tiered = tiered
+        self.engine = None
+        self.planner = None
+        # A ledger shared with the worker processes of a sharded run, see QuotaLedger.share
+        self.ledger = None
+
+    def __getstate__(self):
+        # The engine and the planner stay in their process, a worker binds its own on the shared ledger
+        return dict(self.__dict__, engine=None, planner=None)
+
+    def share_ledger(self):
+        """Shares the quota ledger of a tiered search with the worker processes it is sent to."""
+        if self.planner is not None and self.planner.ledger is not None:
+            self.ledger = self.planner.ledger.share()
+
+    def bind(self, engine=None):
+        """Sets the engine the searches run on, and creates the planner of a tiered search.
+
+        Returns:
+            SearchMode: The search itself.
+        """
+        self.engine = engine or get_engine()
+        if self.tiered:
+            self.planner = open_default_planner(self.engine.config, self.engine, self.ledger)
+        return self
+
+    def __call__(self, bssid=None, ssid=None):
+        engine = self.engine or get_engine()
+        if ssid and self.match != 'exact':
+            # Partial and approximate matches are only possible over the SSIDs collected locally
+            index = open_default_index(engine.config)
+            if index is None:
+                return [{'module': 'index', 'error': 'The SSID index is disabled'}]
+            try:
+                results = index.search(ssid, self.match, self.max_distance)
+            except ValueError as e:
+                return [{'module': 'index', 'error': str(e)}]
+            return results or [{'module': 'index', 'error': 'Not indexed'}]
+        if bssid and self.expand_budget is not None:
+            return expand_search(bssid, self.providers, self.exclude, engine, self.use_cache, self.expand_budget)
+        if self.planner is not None:
+            return self.planner.search(bssid, ssid, self.providers, self.exclude, self.use_cache)
+        return search_networks(bssid, ssid, self.providers, self.exclude, engine, self.use_cache)
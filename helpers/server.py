@@ -0,0 +1,286 @@
+import collections
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from helpers.BSSIDApple_pb2 import BSSIDResp
+from helpers.bssid import normalize_bssid
+
+
+class LookupService:
+    """Long-lived lookup state shared by every request handled by the server.
+
+    Parameters:
+        search (callable): The search function, called as search(bssid=...) or search(ssid=...).
+        max_workers (int): The number of lookups that may run at the same time for batch requests.
+        client_limit (int): The maximum number of requests a single client may have in flight.
+        engine (Engine, optional): The engine whose provider metrics are exposed alongside the service metrics.
+    """
+
+    def __init__(self, search, max_workers=32, client_limit=4, engine=None):
+        self.search = search
+        self.engine = engine
+        self.client_limit = client_limit
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.started = time.time()
+        # Only the clients with requests in flight have an entry, so the map stays as small as the server load
+        self._in_flight = collections.Counter()
+        self._lock = threading.Lock()
+        self.metrics = collections.Counter()
+        self.latency = collections.Counter()
+
+    def acquire_client(self, client):
+        """Reserves a request slot for a client, returns False if the client is over its concurrency limit."""
+        with self._lock:
+            if self._in_flight[client] >= self.client_limit:
+                return False
+            self._in_flight[client] += 1
+            return True
+
+    def release_client(self, client):
+        """Frees a request slot of a client, forgetting the client once it has no request in flight."""
+        with self._lock:
+            self._in_flight[client] -= 1
+            if self._in_flight[client] <= 0:
+                del self._in_flight[client]
+
+    def count(self, name, value=1):
+        """Adds to a service counter, from any handler thread."""
+        with self._lock:
+            self.metrics[name] += value
+
+    def lookup(self, search_by, identifier):
+        """Runs a single lookup.
+
+        Results are not cached here: the engine caches every provider answer it can tell is not transient, and
+        local answers are cheaper to read again than to cache.
+
+        Parameters:
+            search_by (str): Either 'bssid' or 'ssid'.
+            identifier (str): The BSSID or SSID to search for.
+
+        Returns:
+            list: The search results for the identifier.
+        """
+        if search_by == 'bssid':
+            identifier = normalize_bssid(identifier) or identifier
+        start = time.perf_counter()
+        results = self.search(**{search_by: identifier})
+        with self._lock:
+            self.latency[search_by] += time.perf_counter() - start
+            self.metrics['lookups_' + search_by] += 1
+            self.metrics['provider_errors'] += sum(1 for result in results if 'error' in result)
+        return results
+
+    def lookup_many(self, queries):
+        """Runs several lookups concurrently and yields them as soon as each one completes.
+
+        Parameters:
+            queries (list): A list of (search_by, identifier) tuples.
+
+        Yields:
+            tuple: The index of the query in the input list and its results.
+        """
+        futures = {self.executor.submit(self.lookup, search_by, identifier): index
+                   for index, (search_by, identifier) in enumerate(queries)}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], [{'module': 'server', 'error': str(e)}]
+
+    def render_metrics(self):
+        """Returns the service metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = sorted(self.metrics.items())
+            latency = sorted(self.latency.items())
+        lines = [f'geowifi_uptime_seconds {time.time() - self.started:.0f}']
+        for name, value in metrics:
+            lines.append(f'geowifi_{name}_total {value}')
+        for search_by, seconds in latency:
+            lines.append(f'geowifi_lookup_seconds_total{{search_by="{search_by}"}} {seconds:.6f}')
+        metrics = '\n'.join(lines) + '\n'
+        if self.engine is not None:
+            metrics += self.engine.render_metrics()
+        return metrics
+
+
+def results_to_protobuf(bssid, results):
+    """Encodes the located results of a BSSID lookup as a BSSIDResp message.
+
+    The coordinates use the same fixed-point scale as the Apple location service (degrees * 1e8).
+
+    Parameters:
+        bssid (str): The BSSID that was searched for.
+        results (list): The search results for the BSSID.
+
+    Returns:
+        bytes: The serialized BSSIDResp message.
+    """
+    message = BSSIDResp()
+    message.APIName = 'geowifi'
+    for result in results:
+        if 'error' in result or 'latitude' not in result:
+            continue
+        wifi = message.wifi.add()
+        wifi.bssid = result.get('bssid', bssid)
+        wifi.location.lat = int(round(float(result['latitude']) * 1e8))
+        wifi.location.lon = int(round(float(result['longitude']) * 1e8))
+    return message.SerializeToString()
+
+
+def parse_queries(body):
+    """Extracts the list of (search_by, identifier) tuples from a batch request body.
+
+    The body may either be {"bssids": [...], "ssids": [...]} or {"queries": [{"bssid": ...}, {"ssid": ...}]}.
+
+    Raises:
+        ValueError: If the body does not have one of these shapes.
+    """
+    if not isinstance(body, dict):
+        raise ValueError('The request body must be a JSON object')
+    for field in ('bssids', 'ssids', 'queries'):
+        if not isinstance(body.get(field, []), list):
+            raise ValueError(f'{field} must be a list')
+    if not all(isinstance(query, dict) for query in body.get('queries', [])):
+        raise ValueError('Every query must be a JSON object')
+    queries = [('bssid', bssid) for bssid in body.get('bssids', [])]
+    queries += [('ssid', ssid) for ssid in body.get('ssids', [])]
+    for query in body.get('queries', []):
+        for search_by in ('bssid', 'ssid'):
+            if query.get(search_by):
+                queries.append((search_by, query[search_by]))
+    return queries
+
+
+class LookupHandler(BaseHTTPRequestHandler):
+    """Handles the HTTP endpoints of the lookup server.
+
+    Endpoints:
+        GET /lookup?bssid=... or /lookup?ssid=...   Single lookup, JSON or protobuf (Accept: application/x-protobuf).
+        POST /batch                                   Batch lookup, answered once every query completed.
+        POST /stream                                  Batch lookup streamed as newline-delimited JSON.
+        GET /health                                   Liveness check.
+        GET /metrics                                  Prometheus metrics.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    service = None
+
+    def log_message(self, format, *args):
+        # Keep the console clean, the metrics endpoint exposes the request counters
+        pass
+
+    def send_body(self, status, body, content_type='application/json'):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, data):
+        self.send_body(status, json.dumps(data))
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def handle_limited(self, handler):
+        # Apply the per-client concurrency limit before doing any work
+        client = self.client_address[0]
+        if not self.service.acquire_client(client):
+            self.service.count('rejected_requests')
+            self.send_json(429, {'error': 'Too many concurrent requests'})
+            return
+        try:
+            self.service.count('requests')
+            handler()
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+        except ConnectionError:
+            # The client went away, there is nobody left to answer
+            raise
+        except Exception as e:
+            # Answer the failed request instead of dropping the connection
+            self.service.count('server_errors')
+            self.send_json(500, {'module': 'server', 'error': str(e)})
+        finally:
+            self.service.release_client(client)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/health':
+            self.send_json(200, {'status': 'ok', 'uptime': round(time.time() - self.service.started)})
+        elif url.path == '/metrics':
+            self.send_body(200, self.service.render_metrics(), 'text/plain; version=0.0.4')
+        elif url.path == '/lookup':
+            self.handle_limited(lambda: self.lookup(parse_qs(url.query)))
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == '/batch':
+            self.handle_limited(self.batch)
+        elif url.path == '/stream':
+            self.handle_limited(self.stream)
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
+    def lookup(self, query):
+        if 'bssid' in query:
+            search_by = 'bssid'
+        elif 'ssid' in query:
+            search_by = 'ssid'
+        else:
+            raise ValueError('A bssid or ssid parameter is required')
+        identifier = query[search_by][0]
+        results = self.service.lookup(search_by, identifier)
+        if search_by == 'bssid' and 'application/x-protobuf' in self.headers.get('Accept', ''):
+            self.send_body(200, results_to_protobuf(identifier, results), 'application/x-protobuf')
+        else:
+            self.send_json(200, results)
+
+    def batch(self):
+        queries = parse_queries(self.read_json())
+        output = [None] * len(queries)
+        for index, results in self.service.lookup_many(queries):
+            search_by, identifier = queries[index]
+            output[index] = {search_by: identifier, 'results': results}
+        self.send_json(200, output)
+
+    def stream(self):
+        queries = parse_queries(self.read_json())
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        # Write every lookup as its own chunk as soon as it completes
+        for index, results in self.service.lookup_many(queries):
+            search_by, identifier = queries[index]
+            line = json.dumps({search_by: identifier, 'results': results}).encode('utf-8') + b'\n'
+            self.wfile.write(f'{len(line):x}\r\n'.encode('ascii') + line + b'\r\n')
+            self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+
+
+def create_server(service, host='127.0.0.1', port=8080):
+    """Creates the HTTP lookup server bound to the given address.
+
+    Parameters:
+        service (LookupService): The lookup service answering the requests.
+        host (str, optional): The address to listen on. Defaults to '127.0.0.1'.
+        port (int, optional): The port to listen on. Defaults to 8080.
+
+    Returns:
+        ThreadingHTTPServer: The server, ready for serve_forever().
+    """
+    handler = type('BoundLookupHandler', (LookupHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
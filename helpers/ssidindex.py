@@ -0,0 +1,444 @@
+"""Local SSID index answering exact, prefix, substring and fuzzy SSID searches without network access.
+
+File layout (native byte order, recorded in the header):
+
+    header           magic 'GWSI', version, byte order, number of SSIDs, networks, trigrams, postings, text bytes
+    ssid_offsets     uint64[ssids + 1]     offsets of the SSIDs in the text column, SSIDs sorted case-insensitively
+    network_offsets  uint64[ssids + 1]     ranges of the networks of every SSID in the network columns
+    keys             uint64[networks]      BSSID keys, NO_BSSID for networks known by SSID only
+    trigrams         uint64[trigrams]      sorted character trigrams of the padded lowercase SSIDs
+    posting_offsets  uint64[trigrams + 1]  ranges of the SSIDs of every trigram in the postings column
+    postings         uint32[postings]      SSID numbers, increasing within a trigram
+    lats, lons       int32[networks]       latitude and longitude * 1e7
+    modules          uint8[networks]       bit number of the module that reported the network (see MODULE_BITS)
+    text             uint8[text bytes]     the UTF-8 encoded SSIDs
+
+New networks go to a JSON lines append log (<path>.log), searched linearly and merged into the file by `merge`.
+
+Run `python3 -m helpers.ssidindex --help` to import the JSON files of the results folder or to search the index.
+"""
+import argparse
+import bisect
+import collections
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+
+from helpers.bssid import COORDINATE_SCALE, bssid_to_int, int_to_bssid
+from helpers.store import (BYTE_ORDER, MODULE_BITS, OTHER_MODULE, load_result_file, map_columns, mask_modules,
+                           write_columns)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b'GWSI'
+VERSION = 1
+HEADER = struct.Struct('=4sHcxQQQQQ')
+NO_BSSID = 2 ** 64 - 1
+# Markers padding the SSIDs, so the first and last characters get trigrams of their own
+START, END = '\x02', '\x03'
+MATCH_MODES = ('exact', 'prefix', 'substring', 'fuzzy')
+# Shorter substrings have no trigram to look up, and would need a scan of every SSID
+MIN_SUBSTRING = 3
+
+
+def trigram_keys(text, padded=True):
+    """Returns the set of character trigrams of a lowercase string, each packed into a 63-bit integer."""
+    if padded:
+        text = START + text + END
+    return {(ord(text[i]) << 42) | (ord(text[i + 1]) << 21) | ord(text[i + 2]) for i in range(len(text) - 2)}
+
+
+def edit_distance(query):
+    """Returns a function computing the Levenshtein distance of strings to the query.
+
+    Uses the bit-parallel algorithm of Myers, as formulated by Hyyrö, with one bit per query character, so every
+    candidate costs a few integer operations per character instead of a full dynamic programming table.
+    """
+    length = len(query)
+    if not length:
+        return len
+    matches = {}
+    for position, char in enumerate(query):
+        matches[char] = matches.get(char, 0) | (1 << position)
+    mask = (1 << length) - 1
+    last = 1 << (length - 1)
+
+    def distance(text):
+        positive, negative, score = mask, 0, length
+        for char in text:
+            equal = matches.get(char, 0)
+            vertical = equal | negative
+            horizontal = (((equal & positive) + positive) ^ positive) | equal
+            horizontal_positive = negative | ~(horizontal | positive)
+            horizontal_negative = positive & horizontal
+            if horizontal_positive & last:
+                score += 1
+            elif horizontal_negative & last:
+                score -= 1
+            horizontal_positive = (horizontal_positive << 1) | 1
+            horizontal_negative <<= 1
+            positive = (horizontal_negative | ~(vertical | horizontal_positive)) & mask
+            negative = horizontal_positive & vertical
+        return score
+
+    return distance
+
+
+def contains(numbers, number):
+    """Checks if a sorted sequence holds a number."""
+    row = bisect.bisect_left(numbers, number)
+    return row < len(numbers) and numbers[row] == number
+
+
+def module_bit(module):
+    return MODULE_BITS.index(module) if module in MODULE_BITS else OTHER_MODULE
+
+
+def result_entries(results):
+    """Extracts the (ssid, bssid key, lat, lon, module bit) entries of the located results that carry an SSID."""
+    entries = []
+    for result in results:
+        ssid = result.get('ssid')
+        if 'error' in result or not ssid or 'latitude' not in result or 'sibling' in result:
+            continue
+        if result.get('module') in ('index', 'store'):
+            continue
+        try:
+            lat = round(float(result['latitude']) * COORDINATE_SCALE)
+            lon = round(float(result['longitude']) * COORDINATE_SCALE)
+        except (TypeError, ValueError):
+            continue
+        key = bssid_to_int(result.get('bssid', ''))
+        entries.append((str(ssid), NO_BSSID if key is None else key, lat, lon, module_bit(result.get('module'))))
+    return entries
+
+
+class FoldedSSIDs:
+    """The lowercase SSIDs of an index as a sequence, to bisect on without decoding them all."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return self.index.count
+
+    def __getitem__(self, number):
+        return self.index.ssid(number).lower()
+
+
+class SSIDIndex:
+    """A memory-mapped trigram index of SSIDs and the networks using them.
+
+    Parameters:
+        path (str): The path of the index file. It does not need to exist yet.
+        merge_threshold (int, optional): The number of log entries that triggers a rebuild on append.
+            Defaults to 100000.
+    """
+
+    def __init__(self, path, merge_threshold=100000):
+        self.path = path
+        self.log_path = path + '.log'
+        self.merge_threshold = merge_threshold
+        self.count = 0
+        self.columns = {}
+        self.log = []
+        self._mmap = None
+        self._file = None
+        self._lock = threading.RLock()
+        self.open()
+
+    def open(self):
+        """Maps the index file and loads the append log."""
+        with self._lock:
+            self.close()
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                self._file = open(self.path, 'rb')
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, byte_order, ssids, networks, trigrams, postings, text = HEADER.unpack_from(
+                    self._mmap, 0)
+                if magic != MAGIC or version != VERSION:
+                    raise ValueError(f'{self.path} is not a geowifi SSID index')
+                if byte_order != BYTE_ORDER:
+                    raise ValueError(f'{self.path} was written on a machine with another byte order')
+                self.count = ssids
+                self.columns = map_columns(self._mmap, HEADER.size, [
+                    ('ssid_offsets', 'Q', ssids + 1), ('network_offsets', 'Q', ssids + 1), ('keys', 'Q', networks),
+                    ('trigrams', 'Q', trigrams), ('posting_offsets', 'Q', trigrams + 1), ('postings', 'I', postings),
+                    ('lats', 'i', networks), ('lons', 'i', networks), ('modules', 'B', networks), ('text', 'B', text),
+                ])
+            self.log = []
+            if os.path.exists(self.log_path):
+                with open(self.log_path, 'r') as log:
+                    for line in log:
+                        try:
+                            self.log.append(tuple(json.loads(line)))
+                        except ValueError:
+                            # A line cut short by an interrupted write
+                            continue
+
+    def close(self):
+        with self._lock:
+            for view in self.columns.values():
+                view.release()
+            self.columns = {}
+            self.count = 0
+            if self._mmap is not None:
+                self._mmap.close()
+                self._file.close()
+                self._mmap = self._file = None
+
+    def __len__(self):
+        return self.count
+
+    def ssid(self, number):
+        """Returns an SSID of the file by its number."""
+        offsets = self.columns['ssid_offsets']
+        return bytes(self.columns['text'][offsets[number]:offsets[number + 1]]).decode('utf-8')
+
+    def networks(self, number):
+        """Returns the (ssid, bssid key, lat, lon, module bit) entries of an SSID of the file."""
+        ssid = self.ssid(number)
+        columns = self.columns
+        start, end = columns['network_offsets'][number], columns['network_offsets'][number + 1]
+        return [(ssid, columns['keys'][row], columns['lats'][row], columns['lons'][row], columns['modules'][row])
+                for row in range(start, end)]
+
+    def entries(self):
+        """Iterates over every entry of the file, then of the append log."""
+        for number in range(self.count):
+            yield from self.networks(number)
+        yield from self.log
+
+    def postings(self, trigram):
+        """Returns the sorted SSID numbers of a trigram, as a memoryview."""
+        trigrams = self.columns['trigrams']
+        row = bisect.bisect_left(trigrams, trigram)
+        if row == len(trigrams) or trigrams[row] != trigram:
+            return self.columns['postings'][0:0]
+        offsets = self.columns['posting_offsets']
+        return self.columns['postings'][offsets[row]:offsets[row + 1]]
+
+    def prefix_range(self, prefix):
+        """Returns the range of SSID numbers starting with a lowercase prefix, the SSIDs being sorted."""
+        folded = FoldedSSIDs(self)
+        start = bisect.bisect_left(folded, prefix)
+        # Every string starting with the prefix sorts before prefix + the largest code point
+        return range(start, bisect.bisect_left(folded, prefix + '\U0010ffff', start))
+
+    def candidates(self, query, mode, max_distance):
+        """Returns the numbers of the SSIDs of the file that may match, to be checked by matcher()."""
+        if not self.count:
+            return []
+        if mode in ('exact', 'prefix'):
+            return self.prefix_range(query)
+        if mode == 'substring':
+            grams = trigram_keys(query, padded=False)
+            lists = sorted((self.postings(gram) for gram in grams), key=len)
+            smallest, others = lists[0], lists[1:]
+            return [number for number in smallest if all(contains(other, number) for other in others)]
+        # Fuzzy: a string within k edits of the query still shares all but at most 3 * k of its padded trigrams
+        grams = trigram_keys(query)
+        needed = len(grams) - 3 * max_distance
+        if needed <= 0:
+            return range(self.count)
+        if numpy is not None:
+            postings = [numpy.frombuffer(self.postings(gram), dtype=numpy.uint32) for gram in grams]
+            numbers, counts = numpy.unique(numpy.concatenate(postings), return_counts=True)
+            return numbers[counts >= needed].tolist()
+        counts = collections.Counter()
+        for gram in grams:
+            counts.update(self.postings(gram))
+        return sorted(number for number, count in counts.items() if count >= needed)
+
+    @staticmethod
+    def matcher(query, mode, max_distance):
+        """Returns the function checking a lowercase SSID against a lowercase query."""
+        if mode == 'exact':
+            return query.__eq__
+        if mode == 'prefix':
+            return lambda ssid: ssid.startswith(query)
+        if mode == 'substring':
+            return lambda ssid: query in ssid
+        distance = edit_distance(query)
+        return lambda ssid: abs(len(ssid) - len(query)) <= max_distance and distance(ssid) <= max_distance
+
+    def search(self, query, mode='exact', max_distance=2, limit=1000):
+        """Searches the SSIDs of the index.
+
+        Parameters:
+            query (str): The SSID, prefix or substring to search for, case-insensitively. Substrings need at least
+                MIN_SUBSTRING characters.
+            mode (str, optional): One of 'exact', 'prefix', 'substring' or 'fuzzy'. Defaults to 'exact'.
+            max_distance (int, optional): The maximum edit distance of fuzzy matches. Defaults to 2.
+            limit (int, optional): The maximum number of networks returned. Defaults to 1000.
+
+        Returns:
+            list: The matching networks as search results, closest SSIDs first for fuzzy searches.
+
+        Raises:
+            ValueError: If a substring query is shorter than MIN_SUBSTRING characters.
+        """
+        query = str(query).lower()
+        if mode == 'substring' and len(query) < MIN_SUBSTRING:
+            raise ValueError(f'Substring searches need at least {MIN_SUBSTRING} characters, use a prefix search')
+        match = self.matcher(query, mode, max_distance)
+        with self._lock:
+            entries = []
+            for number in self.candidates(query, mode, max_distance):
+                if match(self.ssid(number).lower()):
+                    entries.extend(self.networks(number))
+                    if len(entries) >= limit and mode != 'fuzzy':
+                        break
+                elif mode in ('exact', 'prefix'):
+                    break
+            entries.extend(entry for entry in self.log if match(entry[0].lower()))
+        if mode == 'fuzzy':
+            distance = edit_distance(query)
+            entries.sort(key=lambda entry: distance(entry[0].lower()))
+        results = []
+        seen = set()
+        for ssid, key, lat, lon, module in entries:
+            if (ssid, key, module) in seen:
+                # The log may repeat networks already merged into the file
+                continue
+            seen.add((ssid, key, module))
+            result = {'module': 'index', 'ssid': ssid, 'latitude': lat / COORDINATE_SCALE,
+                      'longitude': lon / COORDINATE_SCALE, 'source': mask_modules(1 << module)[0]}
+            if key != NO_BSSID:
+                result['bssid'] = int_to_bssid(key)
+            results.append(result)
+        return results[:limit]
+
+    def append(self, entries):
+        """Adds entries through the append log, rebuilding the index when the log grows too large."""
+        entries = list(entries)
+        if not entries:
+            return
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.log_path, 'a') as log:
+                log.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+            self.log.extend(entries)
+            if len(self.log) >= self.merge_threshold:
+                self.merge()
+
+    def merge(self):
+        """Rebuilds the index file from its entries and the append log, replacing the old file atomically."""
+        with self._lock:
+            write_index(self.path, self.entries())
+            if os.path.exists(self.log_path):
+                os.remove(self.log_path)
+            self.open()
+
+
+def write_index(path, entries):
+    """Builds an index file from (ssid, bssid key, lat, lon, module bit) entries.
+
+    Later entries of the same SSID, BSSID and module replace the earlier ones.
+    """
+    networks = {}
+    for ssid, key, lat, lon, module in entries:
+        networks.setdefault(ssid, {})[(key, module)] = (lat, lon)
+    ssids = sorted(networks, key=lambda ssid: (ssid.lower(), ssid))
+
+    columns = collections.OrderedDict((name, array(code)) for name, code in (
+        ('ssid_offsets', 'Q'), ('network_offsets', 'Q'), ('keys', 'Q'), ('trigrams', 'Q'), ('posting_offsets', 'Q'),
+        ('postings', 'I'), ('lats', 'i'), ('lons', 'i'), ('modules', 'B'), ('text', 'B')))
+    postings = collections.defaultdict(lambda: array('I'))
+    columns['ssid_offsets'].append(0)
+    columns['network_offsets'].append(0)
+    for number, ssid in enumerate(ssids):
+        columns['text'].frombytes(ssid.encode('utf-8'))
+        columns['ssid_offsets'].append(len(columns['text']))
+        for (key, module), (lat, lon) in sorted(networks[ssid].items()):
+            columns['keys'].append(key)
+            columns['lats'].append(lat)
+            columns['lons'].append(lon)
+            columns['modules'].append(module)
+        columns['network_offsets'].append(len(columns['keys']))
+        for gram in trigram_keys(ssid.lower()):
+            postings[gram].append(number)
+    columns['posting_offsets'].append(0)
+    for gram in sorted(postings):
+        columns['trigrams'].append(gram)
+        columns['postings'].extend(postings[gram])
+        columns['posting_offsets'].append(len(columns['postings']))
+
+    temporary = path + '.tmp'
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(temporary, 'wb') as output:
+        output.write(HEADER.pack(MAGIC, VERSION, BYTE_ORDER, len(ssids), len(columns['keys']),
+                                 len(columns['trigrams']), len(columns['postings']), len(columns['text'])))
+        write_columns(output, HEADER.size, columns.values())
+    os.replace(temporary, path)
+
+
+def index_results(index, results):
+    """Adds the located networks of search results that carry an SSID to an index."""
+    index.append(result_entries(results))
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def open_default_index(config):
+    """Returns the process-wide index described by the ssid_index section of the configuration, or None if disabled."""
+    global _default_index
+    options = config.get('ssid_index') or {}
+    if options.get('enabled') is False:
+        return None
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = SSIDIndex(options.get('path', 'results/ssids.gwi'),
+                                       options.get('merge_threshold', 100000))
+        return _default_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the geowifi SSID index.')
+    parser.add_argument('--index', default='results/ssids.gwi', help='Path of the index file')
+    commands = parser.add_subparsers(dest='command', required=True)
+    importer = commands.add_parser('import', help='Import JSON files saved with -o json and watch sinks')
+    importer.add_argument('files', nargs='+')
+    search = commands.add_parser('search', help='Search SSIDs')
+    search.add_argument('query')
+    search.add_argument('--match', choices=MATCH_MODES, default='substring')
+    search.add_argument('--max-distance', type=int, default=2)
+    search.add_argument('--limit', type=int, default=100)
+    commands.add_parser('merge', help='Merge the append log into the index file')
+    commands.add_parser('stats', help='Show the number of indexed SSIDs')
+    args = parser.parse_args()
+
+    index = SSIDIndex(args.index)
+    if args.command == 'import':
+        for path in args.files:
+            index_results(index, load_result_file(path))
+        index.merge()
+        print(f'{len(index)} SSIDs indexed')
+    elif args.command == 'search':
+        if args.match == 'substring' and len(args.query) < MIN_SUBSTRING:
+            parser.error(f'substring searches need at least {MIN_SUBSTRING} characters')
+        for result in index.search(args.query, args.match, args.max_distance, args.limit):
+            json.dump(result, sys.stdout)
+            print()
+    elif args.command == 'merge':
+        index.merge()
+        print(f'{len(index)} SSIDs indexed')
+    elif args.command == 'stats':
+        print(f'{index.count} SSIDs in the index file, {len(index.log)} entries in the append log')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,497 @@
+"""Memory-mapped binary store of resolved BSSID positions.
+
+File layout (native byte order, recorded in the header):
+
+    header    magic 'GWST', version, byte order, record count, creation time, module names (JSON)
+    keys      uint64[count]  sorted BSSID keys
+    lats      int32[count]   latitude * 1e7
+    lons      int32[count]   longitude * 1e7
+    updated   uint32[count]  time of the last update, in seconds since the epoch
+    modules   uint16[count]  bit mask of the modules that located the BSSID (see MODULE_BITS)
+    spread    uint16[count]  largest distance between the module fixes and the position, in metres
+    flags     uint8[count]   record flags (see helpers.bssid)
+
+Opening a store maps the file and reads the header, whatever its size, and lookups binary search the key column
+in place, so every process opening the same store shares one page-cached copy. Updates go to an append log
+(<path>.log) which is merged into a new store file once it grows past a threshold. Processes append under a shared
+lock and merge under an exclusive one (<path>.lock, where fcntl is available), and readers pick up the merges and
+log entries of other processes.
+
+Run `python3 -m helpers.store --help` to import the JSON files of the results folder or to query a store.
+"""
+import argparse
+import bisect
+import contextlib
+import json
+import math
+import mmap
+import os
+import statistics
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from helpers.bssid import COORDINATE_SCALE, bssid_to_int, int_to_bssid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b'GWST'
+VERSION = 1
+HEADER = struct.Struct('=4sHcxQdI')
+LOG_RECORD = struct.Struct('<QiiIHHB3x')
+# Column type codes, in file order
+COLUMNS = (('key', 'Q'), ('lat', 'i'), ('lon', 'i'), ('updated', 'I'), ('modules', 'H'), ('spread', 'H'),
+           ('flags', 'B'))
+BYTE_ORDER = b'<' if sys.byteorder == 'little' else b'>'
+
+# Stable bit of every module in the modules column, unknown modules share the last bit
+MODULE_BITS = ['wigle', 'apple', 'mylnikov', 'google', 'combain', 'wifidb', 'openwifimap', 'freifunk-karte',
+               'store', 'crawler', 'import']
+OTHER_MODULE = 15
+
+
+def module_mask(modules):
+    """Returns the bit mask of a collection of module names."""
+    mask = 0
+    for module in modules:
+        mask |= 1 << (MODULE_BITS.index(module) if module in MODULE_BITS else OTHER_MODULE)
+    return mask
+
+
+def mask_modules(mask):
+    """Returns the module names of a bit mask."""
+    return [name for bit, name in enumerate(MODULE_BITS) if mask & (1 << bit)] + (
+        ['other'] if mask & (1 << OTHER_MODULE) else [])
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """Returns the great-circle distance between two points, in metres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * 6371008.8 * math.asin(min(1.0, math.sqrt(a)))
+
+
+class Position:
+    """The stored position of a BSSID."""
+
+    __slots__ = ('key', 'lat', 'lon', 'updated', 'modules', 'spread', 'flags')
+
+    def __init__(self, key, lat, lon, updated, modules, spread=0, flags=0):
+        self.key = key
+        self.lat = lat
+        self.lon = lon
+        self.updated = updated
+        self.modules = modules
+        self.spread = spread
+        self.flags = flags
+
+    @classmethod
+    def from_results(cls, key, results, updated=None, flags=0):
+        """Summarises the located results of one BSSID: median position, modules and their disagreement.
+
+        Returns:
+            Position: The position, or None if none of the results is located.
+        """
+        fixes = [(float(result['latitude']), float(result['longitude']), result['module']) for result in results
+                 if 'error' not in result and 'latitude' in result and 'longitude' in result]
+        if not fixes:
+            return None
+        lat = statistics.median(fix[0] for fix in fixes)
+        lon = statistics.median(fix[1] for fix in fixes)
+        spread = max(distance(lat, lon, fix_lat, fix_lon) for fix_lat, fix_lon, _ in fixes)
+        return cls(key, round(lat * COORDINATE_SCALE), round(lon * COORDINATE_SCALE),
+                   int(updated if updated is not None else time.time()), module_mask(fix[2] for fix in fixes),
+                   min(int(spread), 0xffff), flags)
+
+    @property
+    def latitude(self):
+        return self.lat / COORDINATE_SCALE
+
+    @property
+    def longitude(self):
+        return self.lon / COORDINATE_SCALE
+
+    @property
+    def confidence(self):
+        """The number of modules that located the BSSID."""
+        return bin(self.modules).count('1')
+
+    def to_result(self):
+        return {
+            'module': 'store',
+            'bssid': int_to_bssid(self.key),
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'sources': mask_modules(self.modules),
+            'updated': self.updated
+        }
+
+    def pack(self):
+        return LOG_RECORD.pack(self.key, self.lat, self.lon, self.updated, self.modules, self.spread, self.flags)
+
+
+class PositionStore:
+    """A sorted, memory-mapped BSSID position store with an append log.
+
+    Parameters:
+        path (str): The path of the store file. It does not need to exist yet.
+        merge_threshold (int, optional): The number of log entries that triggers a merge on append.
+            Defaults to 100000.
+        check_interval (float, optional): The minimum number of seconds between two checks for the merges and log
+            entries of other processes on lookup. Defaults to 1.
+    """
+
+    def __init__(self, path, merge_threshold=100000, check_interval=1.0):
+        self.path = path
+        self.log_path = path + '.log'
+        self.lock_path = path + '.lock'
+        self.merge_threshold = merge_threshold
+        self.check_interval = check_interval
+        self.count = 0
+        self.columns = {}
+        self._mmap = None
+        self._file = None
+        self._inode = None
+        self._log_offset = 0
+        self._checked = time.monotonic()
+        self._lock = threading.RLock()
+        self.log = {}
+        self.open()
+
+    @contextlib.contextmanager
+    def locked(self, exclusive=False):
+        """Holds the lock shared by every process using the store: shared to append, exclusive to merge."""
+        if fcntl is None:
+            yield
+            return
+        directory = os.path.dirname(self.lock_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def open(self):
+        """Maps the store file and loads the append log."""
+        with self._lock:
+            self.close()
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                self._file = open(self.path, 'rb')
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._inode = os.fstat(self._file.fileno()).st_ino
+                magic, version, byte_order, self.count, _, names_length = HEADER.unpack_from(self._mmap, 0)
+                if magic != MAGIC or version != VERSION:
+                    raise ValueError(f'{self.path} is not a geowifi position store')
+                if byte_order != BYTE_ORDER:
+                    raise ValueError(f'{self.path} was written on a machine with another byte order')
+                self.columns = map_columns(self._mmap, HEADER.size + names_length,
+                                           [(name, code, self.count) for name, code in COLUMNS])
+            self.log = {}
+            self._log_offset = 0
+            self.read_log()
+
+    def read_log(self):
+        """Reads the log entries appended since the last read, by this process or another one."""
+        with self._lock:
+            try:
+                with open(self.log_path, 'rb') as log:
+                    log.seek(self._log_offset)
+                    data = log.read()
+            except FileNotFoundError:
+                return
+            # A record being written by another process is read on the next call
+            data = data[:len(data) - len(data) % LOG_RECORD.size]
+            for fields in LOG_RECORD.iter_unpack(data):
+                self.log[fields[0]] = Position(*fields)
+            self._log_offset += len(data)
+
+    def close(self):
+        with self._lock:
+            for view in self.columns.values():
+                view.release()
+            self.columns = {}
+            self.count = 0
+            if self._mmap is not None:
+                self._mmap.close()
+                self._file.close()
+                self._mmap = self._file = None
+            self._inode = None
+
+    def reopen_if_changed(self):
+        """Maps the store again if another process merged it since it was opened, otherwise reads the log entries
+        appended since the last check."""
+        with self._lock:
+            self._checked = time.monotonic()
+            try:
+                inode = os.stat(self.path).st_ino
+            except FileNotFoundError:
+                inode = None
+            if inode != self._inode:
+                self.open()
+            else:
+                self.read_log()
+
+    def check(self):
+        """Calls reopen_if_changed at most every check_interval seconds, so long-lived readers stay current."""
+        if time.monotonic() - self._checked >= self.check_interval:
+            self.reopen_if_changed()
+
+    def __len__(self):
+        with self._lock:
+            self.check()
+            return self.count + sum(1 for key in self.log if self.index(key) is None)
+
+    def index(self, key):
+        """Returns the row of a key in the mapped file, or None."""
+        if not self.count:
+            return None
+        keys = self.columns['key']
+        row = bisect.bisect_left(keys, key)
+        return row if row < self.count and keys[row] == key else None
+
+    def row(self, row):
+        columns = self.columns
+        return Position(*(columns[name][row] for name, _ in COLUMNS))
+
+    def get(self, key):
+        """Returns the Position of a BSSID key, or None if it is not stored."""
+        with self._lock:
+            self.check()
+            if key in self.log:
+                return self.log[key]
+            row = self.index(key)
+            return None if row is None else self.row(row)
+
+    def get_many(self, keys):
+        """Returns the Positions of many keys at once, None for the ones that are not stored."""
+        with self._lock:
+            self.check()
+            if numpy is not None and self.count:
+                # Vectorised binary search over a zero-copy view of the key column
+                column = numpy.frombuffer(self.columns['key'], dtype=numpy.uint64)
+                wanted = numpy.asarray(keys, dtype=numpy.uint64)
+                rows = numpy.minimum(numpy.searchsorted(column, wanted), self.count - 1)
+                found = column[rows] == wanted
+                return [self.log.get(key) or (self.row(int(row)) if hit else None)
+                        for key, row, hit in zip(keys, rows, found)]
+            return [self.get(key) for key in keys]
+
+    def lookup(self, bssid):
+        """Returns the stored position of a BSSID as a search result, or None."""
+        key = bssid_to_int(bssid)
+        position = None if key is None else self.get(key)
+        return None if position is None else position.to_result()
+
+    def __iter__(self):
+        """Iterates over every stored Position in key order, the log taking precedence over the file."""
+        log_keys = sorted(self.log)
+        next_log = 0
+        for row in range(self.count):
+            key = self.columns['key'][row]
+            while next_log < len(log_keys) and log_keys[next_log] < key:
+                yield self.log[log_keys[next_log]]
+                next_log += 1
+            if next_log < len(log_keys) and log_keys[next_log] == key:
+                yield self.log[key]
+                next_log += 1
+            else:
+                yield self.row(row)
+        for key in log_keys[next_log:]:
+            yield self.log[key]
+
+    def append(self, positions):
+        """Adds or replaces positions through the append log, merging the log when it grows too large."""
+        positions = list(positions)
+        if not positions:
+            return
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self.locked():
+                # The log of a merge that just ran elsewhere is gone, start from the new store file
+                self.reopen_if_changed()
+                with open(self.log_path, 'ab') as log:
+                    log.write(b''.join(position.pack() for position in positions))
+            for position in positions:
+                self.log[position.key] = position
+            if len(self.log) >= self.merge_threshold:
+                self.merge()
+
+    def merge(self):
+        """Writes the file and the log into a new store file, which atomically replaces the old one.
+
+        No process can append while the merge runs, and the store and the whole log are read again first, so the
+        entries other processes appended are merged too.
+        """
+        with self._lock, self.locked(exclusive=True):
+            self.open()
+            write_store(self.path, iter(self))
+            if os.path.exists(self.log_path):
+                os.remove(self.log_path)
+            self.open()
+
+
+def map_columns(buffer, offset, layout):
+    """Casts the columns of a mapped file in place.
+
+    Parameters:
+        buffer (mmap.mmap): The mapped file.
+        offset (int): The offset of the first column.
+        layout (list): The (name, type code, length) of every column, in file order.
+
+    Returns:
+        dict: A memoryview of every column, by name.
+    """
+    view = memoryview(buffer)
+    columns = {}
+    for name, code, length in layout:
+        size = struct.calcsize(code)
+        # Every column is aligned on its item size so the views can be cast without copies
+        offset = -(-offset // size) * size
+        columns[name] = view[offset:offset + size * length].cast(code)
+        offset += size * length
+    view.release()
+    return columns
+
+
+def write_columns(output, offset, columns):
+    """Writes arrays as the aligned columns read back by map_columns, starting at the given file offset."""
+    for column in columns:
+        padding = -offset % column.itemsize
+        output.write(b'\0' * padding)
+        column.tofile(output)
+        offset += padding + column.itemsize * len(column)
+
+
+def write_store(path, positions):
+    """Writes a store file from Positions sorted by key.
+
+    Parameters:
+        path (str): The path of the store file, replaced atomically.
+        positions (iterable): The positions, in increasing key order.
+    """
+    columns = {name: array(code) for name, code in COLUMNS}
+    for position in positions:
+        for name, _ in COLUMNS:
+            columns[name].append(getattr(position, name))
+    names = json.dumps(MODULE_BITS).encode('utf-8')
+    count = len(columns['key'])
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as output:
+        output.write(HEADER.pack(MAGIC, VERSION, BYTE_ORDER, count, time.time(), len(names)))
+        output.write(names)
+        write_columns(output, HEADER.size + len(names), [columns[name] for name, _ in COLUMNS])
+    os.replace(temporary, path)
+
+
+def results_by_bssid(results):
+    """Groups located search results by BSSID key, skipping errors, SSID-only results and local answers."""
+    grouped = {}
+    for result in results:
+        if 'error' in result or 'latitude' not in result or 'sibling' in result:
+            continue
+        if result.get('module') in ('store', 'index'):
+            continue
+        key = bssid_to_int(result.get('bssid', ''))
+        if key is not None:
+            grouped.setdefault(key, []).append(result)
+    return grouped
+
+
+def store_results(store, results):
+    """Adds the located results of a search to a store.
+
+    The new position replaces the stored one, the modules that located the BSSID before are kept in its mask.
+    """
+    now = time.time()
+    positions = [position for position in (Position.from_results(key, located, now)
+                                           for key, located in results_by_bssid(results).items())
+                 if position is not None]
+    for position, stored in zip(positions, store.get_many([position.key for position in positions])):
+        if stored is not None:
+            position.modules |= stored.modules
+    store.append(positions)
+
+
+def load_result_file(path):
+    """Reads the search results saved in a JSON file of the results folder, whatever the search mode, or in a
+    watch mode sink."""
+    with open(path, 'r') as result_file:
+        if path.endswith('.jsonl'):
+            data = [json.loads(line) for line in result_file if line.strip()]
+        else:
+            data = json.load(result_file)
+    if isinstance(data, dict):
+        # Scan output
+        return [result for results in data.get('access_points', {}).values() for result in results]
+    results = []
+    for entry in data:
+        if isinstance(entry, dict) and 'results' in entry:
+            # Batch output
+            results.extend(entry['results'])
+        else:
+            results.append(entry)
+    return results
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def open_default_store(config):
+    """Returns the process-wide store described by the store section of the configuration, or None if disabled."""
+    global _default_store
+    options = config.get('store') or {}
+    if options.get('enabled') is False:
+        return None
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = PositionStore(options.get('path', 'results/positions.gws'),
+                                           options.get('merge_threshold', 100000))
+        return _default_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the geowifi BSSID position store.')
+    parser.add_argument('--store', default='results/positions.gws', help='Path of the store file')
+    commands = parser.add_subparsers(dest='command', required=True)
+    importer = commands.add_parser('import', help='Import JSON files saved with -o json and watch sinks')
+    importer.add_argument('files', nargs='+')
+    lookup = commands.add_parser('lookup', help='Look up BSSIDs')
+    lookup.add_argument('bssids', nargs='+')
+    commands.add_parser('merge', help='Merge the append log into the store file')
+    commands.add_parser('stats', help='Show the number of stored BSSIDs')
+    args = parser.parse_args()
+
+    store = PositionStore(args.store)
+    if args.command == 'import':
+        for path in args.files:
+            store_results(store, load_result_file(path))
+        store.merge()
+        print(f'{len(store)} BSSIDs stored')
+    elif args.command == 'lookup':
+        for bssid in args.bssids:
+            print(json.dumps(store.lookup(bssid) or {'bssid': bssid, 'error': 'Not stored'}))
+    elif args.command == 'merge':
+        store.merge()
+        print(f'{len(store)} BSSIDs stored')
+    elif args.command == 'stats':
+        print(f'{store.count} BSSIDs in the store file, {len(store.log)} entries in the append log')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+import csv
+import io
+import json
+import os
+import sqlite3
+import time
+import xml.etree.ElementTree as ElementTree
+from array import array
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from helpers.bssid import bssid_to_int, int_to_bssid
+
+# Files read again from the start whenever they change (capture tools rewrite them in place), and files only
+# ever appended to, read from the last complete line
+REWRITTEN = ('.csv', '.netxml', '.kismet')
+APPENDED = ('.txt', '.jsonl', '.log')
+
+
+def parse_csv(content):
+    """Extracts (bssid, ssid) pairs from a CSV file with a BSSID column.
+
+    Covers the airodump-ng CSV and log CSV files, where the column sits under a BSSID header, and plain bssid,rssi
+    scan files without a header.
+    """
+    entries = []
+    bssid_column = essid_column = None
+    for row in csv.reader(io.StringIO(content), skipinitialspace=True):
+        if not row:
+            continue
+        header = [cell.strip().lower() for cell in row]
+        if 'bssid' in header:
+            # airodump-ng starts a new section, with its own header, for the client stations
+            bssid_column = header.index('bssid')
+            essid_column = header.index('essid') if 'essid' in header else None
+            continue
+        column = bssid_column if bssid_column is not None else 0
+        if len(row) > column:
+            ssid = row[essid_column].strip() if essid_column is not None and len(row) > essid_column else ''
+            entries.append((row[column].strip(), ssid))
+    return entries
+
+
+def parse_netxml(content):
+    """Extracts (bssid, ssid) pairs from a Kismet netxml file, skipping client-only networks."""
+    entries = []
+    try:
+        root = ElementTree.fromstring(content)
+    except ElementTree.ParseError:
+        # Kismet is still writing the file, it is read again on the next change
+        return entries
+    for network in root.iter('wireless-network'):
+        if network.get('type') == 'probe':
+            continue
+        bssid = network.findtext('BSSID', '')
+        ssid = network.findtext('SSID/essid', '') or ''
+        entries.append((bssid, ssid))
+    return entries
+
+
+def parse_kismet_db(path, since=0):
+    """Extracts (bssid, ssid) pairs of the access points in a Kismet sqlite log, last seen after a time.
+
+    Returns:
+        tuple: The entries and the latest last_time value read, to resume from on the next call.
+    """
+    # Read-only, the database is still open in Kismet while it captures
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        rows = connection.execute(
+            "SELECT devmac, device, last_time FROM devices WHERE phyname = 'IEEE802.11' AND type = 'Wi-Fi AP' "
+            'AND last_time >= ?', (since,)).fetchall()
+    finally:
+        connection.close()
+    entries = []
+    for devmac, device, last_time in rows:
+        ssid = ''
+        try:
+            ssid = json.loads(device).get('kismet.device.base.commonname', '')
+        except (TypeError, ValueError, AttributeError):
+            pass
+        entries.append((devmac, ssid))
+        since = max(since, last_time)
+    return entries, since
+
+
+def parse_lines(content):
+    """Extracts (bssid, ssid) pairs from BSSID lists, one per line, or JSON objects with a bssid key."""
+    entries = []
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('{'):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            entries.append((str(entry.get('bssid', '')), str(entry.get('ssid', ''))))
+        else:
+            entries.append((line.split(',')[0].strip(), ''))
+    return entries
+
+
+class WatchState:
+    """The progress of a watcher, persisted so a restart does not process old files and BSSIDs again.
+
+    Parameters:
+        directory (str): The directory the state is kept in.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}
+        self.pending = []
+        self.seen = set()
+        try:
+            with open(os.path.join(directory, 'state.json'), 'r') as state_file:
+                state = json.load(state_file)
+            self.files = state.get('files', {})
+            self.pending = state.get('pending', [])
+        except (FileNotFoundError, ValueError):
+            pass
+        seen = array('Q')
+        try:
+            with open(os.path.join(directory, 'seen.bin'), 'rb') as seen_file:
+                data = seen_file.read()
+            seen.frombytes(data[:len(data) - len(data) % seen.itemsize])
+        except FileNotFoundError:
+            pass
+        self.seen.update(seen)
+        self._new_seen = array('Q')
+
+    def mark_seen(self, key):
+        self.seen.add(key)
+        self._new_seen.append(key)
+
+    def save(self, pending):
+        """Writes the file progress and the BSSIDs still being looked up, which are searched again on restart."""
+        os.makedirs(self.directory, exist_ok=True)
+        if self._new_seen:
+            with open(os.path.join(self.directory, 'seen.bin'), 'ab') as seen_file:
+                self._new_seen.tofile(seen_file)
+            self._new_seen = array('Q')
+        path = os.path.join(self.directory, 'state.json')
+        with open(path + '.tmp', 'w') as state_file:
+            json.dump({'files': self.files, 'pending': sorted(pending)}, state_file)
+        os.replace(path + '.tmp', path)
+
+
+class Watcher:
+    """Follows capture files and geolocates every BSSID the first time it shows up.
+
+    Each poll only reads the files that changed since the last one, and only the BSSIDs never seen before are
+    looked up, concurrently. Results are appended to the sink as soon as their lookup completes, so a BSSID is
+    written at most interval seconds plus one lookup after the capture tool wrote it.
+
+    Parameters:
+        paths (list): The directories or files to watch.
+        search (callable): The search function, called as search(bssid).
+        sink (str): The JSON lines file the results are appended to.
+        state_dir (str, optional): The directory of the persisted state. Defaults to 'results/watch'.
+        interval (float, optional): The number of seconds between two polls. Defaults to 1.
+        workers (int, optional): The number of lookups running at the same time. Defaults to 16.
+        on_result (callable, optional): Called as on_result(record) after every record written to the sink.
+    """
+
+    def __init__(self, paths, search, sink, state_dir='results/watch', interval=1.0, workers=16, on_result=None):
+        self.paths = paths
+        self.search = search
+        self.sink = sink
+        self.interval = interval
+        self.workers = workers
+        self.on_result = on_result
+        self.state = WatchState(state_dir)
+
+    def files(self):
+        """Returns the watched files with a supported extension."""
+        found = []
+        for path in self.paths:
+            if os.path.isdir(path):
+                for name in sorted(os.listdir(path)):
+                    found.append(os.path.join(path, name))
+            else:
+                found.append(path)
+        return [path for path in found if os.path.isfile(path) and path.lower().endswith(REWRITTEN + APPENDED)]
+
+    def read(self, path, progress):
+        """Returns the entries of a file added since its recorded progress, and updates the progress."""
+        stat = os.stat(path)
+        if progress.get('size') == stat.st_size and progress.get('mtime') == stat.st_mtime:
+            return []
+        lower = path.lower()
+        if lower.endswith('.kismet'):
+            entries, progress['since'] = parse_kismet_db(path, progress.get('since', 0))
+        elif lower.endswith(APPENDED):
+            offset = progress.get('offset', 0)
+            if stat.st_size < offset:
+                # The file was truncated or replaced, start over
+                offset = 0
+            with open(path, 'rb') as source:
+                source.seek(offset)
+                data = source.read()
+            # Leave a line still being written for the next poll
+            complete = data[:data.rfind(b'\n') + 1]
+            progress['offset'] = offset + len(complete)
+            entries = parse_lines(complete.decode('utf-8', 'replace'))
+        else:
+            with open(path, 'r', encoding='utf-8', errors='replace') as source:
+                content = source.read()
+            entries = parse_netxml(content) if lower.endswith('.netxml') else parse_csv(content)
+        progress['size'], progress['mtime'] = stat.st_size, stat.st_mtime
+        return entries
+
+    def poll(self):
+        """Reads the changed files and returns the (bssid, ssid, source file) entries of the BSSIDs never seen."""
+        delta = {}
+        for path in self.files():
+            progress = self.state.files.setdefault(path, {})
+            try:
+                entries = self.read(path, progress)
+            except (OSError, sqlite3.Error):
+                # Files can disappear or be locked between the listing and the read
+                continue
+            for bssid, ssid in entries:
+                key = bssid_to_int(bssid)
+                if key is not None and key not in self.state.seen and key not in delta:
+                    delta[key] = (int_to_bssid(key), ssid, path)
+        return delta
+
+    def write(self, sink, record):
+        sink.write(json.dumps(record) + '\n')
+        sink.flush()
+        if self.on_result is not None:
+            self.on_result(record)
+
+    def run(self, stop=None):
+        """Watches the files until stop() returns True or the watcher is interrupted.
+
+        Parameters:
+            stop (callable, optional): Called after every poll, the watcher stops when it returns True.
+        """
+        directory = os.path.dirname(self.sink)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor, open(self.sink, 'a') as sink:
+
+            def submit(key, bssid, ssid, source):
+                self.state.seen.add(key)
+                future = executor.submit(self.search, bssid)
+                in_flight[future] = (key, bssid, ssid, source, time.time())
+
+            # Lookups interrupted by the last shutdown come first
+            for bssid in self.state.pending:
+                submit(bssid_to_int(bssid), bssid, '', 'pending')
+            try:
+                while True:
+                    for key, (bssid, ssid, source) in self.poll().items():
+                        submit(key, bssid, ssid, source)
+                    deadline = time.monotonic() + self.interval
+                    while in_flight and time.monotonic() < deadline:
+                        done, _ = wait(in_flight, timeout=deadline - time.monotonic(), return_when=FIRST_COMPLETED)
+                        for future in done:
+                            key, bssid, ssid, source, detected = in_flight.pop(future)
+                            try:
+                                results = future.result()
+                            except Exception as e:
+                                results = [{'module': 'watch', 'error': str(e)}]
+                            self.state.mark_seen(key)
+                            self.write(sink, {'bssid': bssid, 'ssid': ssid, 'source': source, 'detected': detected,
+                                              'located': time.time(), 'results': results})
+                    self.state.save(bssid for key, bssid, *_ in in_flight.values())
+                    if stop is not None and stop():
+                        break
+                    if not in_flight:
+                        time.sleep(max(deadline - time.monotonic(), 0))
+            finally:
+                for future in in_flight:
+                    future.cancel()
+                self.state.save(bssid for key, bssid, *_ in in_flight.values())
@@ -0,0 +1,27 @@
+import threading
+
+import pytest
+
+import helpers.providers  # noqa: F401, registers the providers
+from helpers.engine import Engine
+from helpers.negcache import NegativeCache
+from helpers.replay import create_stub_server
+
+
+@pytest.fixture
+def stub_engine(tmp_path):
+    """Returns a function creating an engine whose providers are served by a local stub server, e.g.
+    stub_engine(error_rate=1.0) for a stub answering every request with a 503."""
+    servers = []
+
+    def create(recordings=None, config=None, **options):
+        server = create_stub_server(recordings or {}, **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return Engine(config=config or {}, retries=0, base_url=f'http://127.0.0.1:{server.server_address[1]}',
+                      negative_cache=NegativeCache(str(tmp_path / 'negative_cache'), save_interval=None))
+
+    yield create
+    for server in servers:
+        server.shutdown()
+        server.server_close()
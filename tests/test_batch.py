@@ -0,0 +1,56 @@
+import os
+import time
+
+from helpers.batch import read_identifiers, run_sharded_batch
+from helpers.bssid import int_to_bssid
+
+
+class SlowFirstSearch:
+    """A picklable search answering the first identifiers last, so the workers finish out of input order."""
+
+    planner = None
+
+    def __init__(self, count, crash=None):
+        self.count = count
+        self.crash = crash
+
+    def bind(self, engine=None):
+        return self
+
+    def share_ledger(self):
+        pass
+
+    def __call__(self, bssid=None, ssid=None):
+        number = int(bssid.replace(':', ''), 16)
+        if number == self.crash:
+            os._exit(1)
+        time.sleep((self.count - number) * 0.002)
+        return [{'module': 'test', 'bssid': bssid, 'latitude': number / 10, 'longitude': -number / 10}]
+
+
+def test_sharded_batch_keeps_input_order():
+    identifiers = [int_to_bssid(number) for number in range(40)]
+    merged = list(run_sharded_batch(identifiers, 'bssid', 3, threads=4, search=SlowFirstSearch(40)))
+    assert [index for index, _, _ in merged] == list(range(40))
+    for index, identifier, records in merged:
+        assert identifier == identifiers[index]
+        assert records.to_results() == [{'module': 'test', 'bssid': identifier, 'latitude': index / 10,
+                                         'longitude': -index / 10}]
+
+
+def test_sharded_batch_reports_crashed_worker():
+    identifiers = [int_to_bssid(number) for number in range(10)]
+    # The worker of the even identifiers dies on the first one it searches
+    merged = list(run_sharded_batch(identifiers, 'bssid', 2, threads=1, search=SlowFirstSearch(10, crash=0)))
+    assert [index for index, _, _ in merged] == list(range(10))
+    for index, identifier, records in merged:
+        if index % 2 == 0:
+            assert records.to_results() == [{'module': 'batch', 'error': 'Worker process failed'}]
+        else:
+            assert records.to_results()[0]['bssid'] == identifier
+
+
+def test_read_identifiers_skips_blank_and_comment_lines(tmp_path):
+    path = tmp_path / 'batch.txt'
+    path.write_text('# networks\naa:bb:cc:dd:ee:ff\n\n  HomeNet  \n')
+    assert read_identifiers(str(path)) == ['aa:bb:cc:dd:ee:ff', 'HomeNet']
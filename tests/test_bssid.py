@@ -0,0 +1,47 @@
+import multiprocessing
+import pickle
+
+from helpers import bssid
+from helpers.bssid import RecordArray, bssid_to_int, int_to_bssid, normalize_bssid
+
+RESULTS = [
+    {'module': 'apple', 'bssid': '00:11:22:33:44:55', 'latitude': 40.4, 'longitude': -3.7},
+    {'module': 'wigle', 'error': 'No results detected'},
+    {'module': 'wigle', 'bssid': '00:11:22:33:44:55', 'ssid': 'HomeNet', 'latitude': 40.4, 'longitude': -3.7},
+    {'module': 'vendor_check', 'vendor': 'Unknown'},
+]
+
+
+def test_bssid_notations():
+    for notation in ('00:11:22:33:44:55', '00-11-22-33-44-55', '0011.2233.4455', '001122334455', '0:11:22:33:44:55'):
+        assert bssid_to_int(notation) == 0x001122334455
+    assert int_to_bssid(0x001122334455) == '00:11:22:33:44:55'
+    assert normalize_bssid('AABB.CCDD.EEFF') == 'aa:bb:cc:dd:ee:ff'
+    assert bssid_to_int('not a bssid') is None
+
+
+def test_record_array_round_trip():
+    records = RecordArray.from_results(RESULTS)
+    assert len(records.extras) == 2
+    assert pickle.loads(pickle.dumps(records)).to_results() == records.to_results() == RESULTS
+
+
+def test_extras_only_array_pickles_without_module_names(monkeypatch):
+    # A worker whose every result is kept whole never names a module
+    monkeypatch.setattr(bssid, 'MODULES', bssid.StringTable())
+    records = RecordArray.from_results(RESULTS[2:])
+    assert pickle.loads(pickle.dumps(records)).to_results() == RESULTS[2:]
+
+
+def test_extras_only_array_crosses_a_queue():
+    queue = multiprocessing.get_context('spawn').Queue()
+    process = multiprocessing.get_context('spawn').Process(target=put_extras, args=(queue,))
+    process.start()
+    try:
+        assert queue.get(timeout=30).to_results() == RESULTS[2:]
+    finally:
+        process.join()
+
+
+def put_extras(queue):
+    queue.put(RecordArray.from_results(RESULTS[2:]))
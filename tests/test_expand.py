@@ -0,0 +1,80 @@
+import collections
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from helpers.BSSIDApple_pb2 import BSSIDReq, BSSIDResp
+from helpers.bssid import bssid_to_int
+from helpers.engine import Engine
+from helpers.expand import expand_search, sibling_candidates
+from helpers.providers import APPLE_WLOC_HEADER
+
+SEED = '00:11:22:33:44:50'
+SIBLING = '00:11:22:33:44:5a'
+
+
+class ProviderHandler(BaseHTTPRequestHandler):
+    """Counts the requests per provider; Apple only locates SIBLING, the other providers know nothing."""
+
+    requests = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        provider = self.path.lstrip('/').partition('/')[0].partition('?')[0]
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.requests[provider].append(body)
+        if provider.startswith('apple'):
+            request = BSSIDReq()
+            request.ParseFromString(body[len(APPLE_WLOC_HEADER) + 2:])
+            response = BSSIDResp()
+            for wifi in request.wifi:
+                located = response.wifi.add()
+                located.bssid = wifi.bssid
+                located.location.lat = 4040000000 if bssid_to_int(wifi.bssid) == bssid_to_int(SIBLING) else -18000000000
+                located.location.lon = -370000000
+            self.reply(200, b'\0' * 10 + response.SerializeToString())
+        else:
+            self.reply(404, json.dumps({'error': {'message': 'Not found'}, 'result': 404, 'desc': 'Not found'}).encode())
+
+    do_GET = do_POST
+
+    def reply(self, status, content):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+@pytest.fixture
+def provider_server():
+    requests = collections.defaultdict(list)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), type('Handler', (ProviderHandler,), {'requests': requests}))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield Engine(config={'google_api': 'k', 'combain_api': 'k'}, retries=0,
+                 base_url=f'http://127.0.0.1:{server.server_address[1]}'), requests
+    server.shutdown()
+    server.server_close()
+
+
+def test_expansion_batches_apple_and_skips_paid_providers(provider_server):
+    engine, requests = provider_server
+    results = expand_search(SEED, exclude=['wigle'], engine=engine)
+    assert [result['sibling'] for result in results if 'sibling' in result] == [SIBLING]
+    # The seed once, then every candidate in one multi-BSSID request
+    assert 'apple_bssid' not in requests
+    assert len(requests['apple_wloc']) == 2
+    assert len(sibling_candidates(SEED)) <= 25
+    # Paid providers only answer for the seed itself
+    assert len(requests['google_bssid']) == 1 and len(requests['combain_bssid']) == 1
+    assert any('error' in result and result['module'] == 'apple' for result in results)
+
+
+def test_paid_providers_expand_when_named(provider_server):
+    engine, requests = provider_server
+    expand_search(SEED, providers=['apple', 'google'], engine=engine, budget=5)
+    # The seed search, then the candidates within the budget left by the Apple request
+    assert len(requests['google_bssid']) == 1 + 4
@@ -0,0 +1,50 @@
+import json
+import multiprocessing
+
+import helpers.providers  # noqa: F401, registers the providers
+from helpers.engine import PROVIDERS
+from helpers.planner import QuotaLedger
+
+
+def book(ledger, name, attempts, booked):
+    for _ in range(attempts):
+        if ledger(PROVIDERS[name]):
+            with booked.get_lock():
+                booked.value += 1
+
+
+def test_shared_ledger_holds_the_quota_across_processes(tmp_path):
+    ledger = QuotaLedger(str(tmp_path / 'quota.json'), {'wigle': 25}, max_cost=0.05).share()
+    booked = multiprocessing.Value('i', 0)
+    workers = [multiprocessing.Process(target=book, args=(ledger, name, 40, booked))
+               for name in ('wigle_bssid', 'wigle_bssid', 'combain_bssid', 'combain_bssid')]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    cost = PROVIDERS['combain_bssid'].cost
+    assert ledger.run['wigle_bssid']['requests'] == 25
+    assert ledger.run['combain_bssid']['requests'] == int(0.05 / cost + 1e-9)
+    assert booked.value == 25 + int(0.05 / cost + 1e-9)
+    assert ledger.run['wigle_bssid']['over_quota'] == 55
+    ledger.save()
+    day = json.loads((tmp_path / 'quota.json').read_text())['days'][ledger.day]
+    assert day['wigle_bssid']['requests'] == 25
+
+
+def save_requests(path, count):
+    for _ in range(count):
+        ledger = QuotaLedger(path)
+        ledger(PROVIDERS['apple_bssid'])
+        ledger.save()
+
+
+def test_concurrent_saves_keep_every_count(tmp_path):
+    path = str(tmp_path / 'quota.json')
+    workers = [multiprocessing.Process(target=save_requests, args=(path, 50)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    ledger = QuotaLedger(path)
+    assert ledger.used(PROVIDERS['apple_bssid']) == 200
@@ -0,0 +1,78 @@
+import struct
+
+import pytest
+
+from helpers.BSSIDApple_pb2 import BSSIDReq, BSSIDResp
+from helpers.engine import PROVIDERS, NotFound, ProviderError
+from helpers.providers import (APPLE_WLOC_HEADER, apple_request, encode_apple_request, parse_apple,
+                               parse_apple_wloc, parse_mylnikov)
+
+
+def legacy_request(bssid):
+    # The hand-built body sent before the request was encoded with protobuf
+    data_bssid = f'\x12\x13\n\x11{bssid}\x18\x00\x20\01'
+    return ('\x00\x01\x00\x05en_US\x00\x13com.apple.locationd\x00\x0a' + '8.1.12B411\x00\x00\x00\x01\x00\x00\x00' +
+            chr(len(data_bssid)) + data_bssid).encode('latin-1')
+
+
+def decode_request(body):
+    assert body.startswith(APPLE_WLOC_HEADER)
+    length, = struct.unpack('>H', body[len(APPLE_WLOC_HEADER):len(APPLE_WLOC_HEADER) + 2])
+    message = body[len(APPLE_WLOC_HEADER) + 2:]
+    assert len(message) == length
+    request = BSSIDReq()
+    request.ParseFromString(message)
+    return request
+
+
+def test_single_bssid_request_matches_legacy_body():
+    assert encode_apple_request(['aa:bb:cc:dd:ee:ff']) == legacy_request('aa:bb:cc:dd:ee:ff')
+    assert apple_request('00:11:22:33:44:55', None)['data'] == legacy_request('00:11:22:33:44:55')
+
+
+def test_batched_request_round_trip():
+    bssids = ['aa:bb:cc:dd:ee:%02x' % number for number in range(25)]
+    request = decode_request(apple_request(','.join(bssids), None)['data'])
+    assert [wifi.bssid for wifi in request.wifi] == bssids
+    assert (request.unk1, request.unk2) == (0, 1)
+
+
+def test_batched_response_is_matched_per_bssid():
+    response = BSSIDResp()
+    for bssid, lat in (('aa:bb:cc:d:e:f', 4040000000), ('aa:bb:cc:dd:ee:01', -18000000000)):
+        wifi = response.wifi.add()
+        wifi.bssid = bssid
+        wifi.location.lat = lat
+        wifi.location.lon = -370000000
+    payload = b'\0' * 10 + response.SerializeToString()
+    assert parse_apple('aa:bb:cc:0d:0e:0f', 200, payload) == {
+        'module': 'apple', 'bssid': 'aa:bb:cc:0d:0e:0f', 'latitude': 40.4, 'longitude': -3.7}
+    # Unknown to Apple, and not in the answer at all
+    for missing in ('aa:bb:cc:dd:ee:01', 'aa:bb:cc:dd:ee:02'):
+        with pytest.raises(NotFound):
+            parse_apple(missing, 200, payload)
+
+
+def test_parse_mylnikov_tells_misses_from_failures():
+    located = parse_mylnikov('00:11:22:33:44:55', 200, {'result': 200, 'data': {'lat': 1.5, 'lon': 2.5}})
+    assert located['latitude'] == 1.5
+    with pytest.raises(NotFound):
+        parse_mylnikov('00:11:22:33:44:55', 200, {'result': 404, 'desc': 'Object was not found'})
+    with pytest.raises(ProviderError) as error:
+        parse_mylnikov('00:11:22:33:44:55', 200, {'result': 500, 'desc': 'Internal error'})
+    assert not isinstance(error.value, NotFound)
+
+
+def test_failed_requests_are_not_remembered_as_misses(stub_engine):
+    # An outage answers with an empty body, which holds no network either
+    for parse in (parse_apple, parse_apple_wloc):
+        with pytest.raises(ProviderError) as error:
+            parse('00:11:22:33:44:55', 503, b'')
+        assert not isinstance(error.value, NotFound)
+    engine = stub_engine(error_rate=1.0)
+    for name in ('apple_bssid', 'mylnikov_bssid'):
+        provider = PROVIDERS[name]
+        result = engine.query(provider, '00:11:22:33:44:55')
+        assert 'error' in result
+        assert not engine.negative_cache.contains(name, '00:11:22:33:44:55')
+        assert engine.cache.get((name, '00:11:22:33:44:55')) is None
@@ -0,0 +1,46 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from helpers.engine import PROVIDERS, Engine
+from helpers.replay import Recorder, fingerprint, load_recordings
+
+
+class GoogleHandler(BaseHTTPRequestHandler):
+    """Answers every request like the Google geolocation API locating the network."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = json.dumps({'location': {'lat': 40.4, 'lng': -3.7}, 'accuracy': 20}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_fingerprint_leaves_out_credentials():
+    assert fingerprint('/geolocate', 'key=secret&v=1', b'{}') == fingerprint('/geolocate', 'v=1&key=other', b'{}')
+    assert fingerprint('/geolocate', 'v=1', b'{}') != fingerprint('/geolocate', 'v=2', b'{}')
+
+
+def test_recordings_hold_no_keys_and_replay_without_them(tmp_path, stub_engine):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), GoogleHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        recording = Engine(config={'google_api': 'secret-key'}, retries=0,
+                           base_url=f'http://127.0.0.1:{server.server_address[1]}')
+        recording.hooks.append(Recorder(str(tmp_path / 'recordings')))
+        assert 'error' not in recording.query(PROVIDERS['google_bssid'], '00:11:22:33:44:55')
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert 'secret-key' not in (tmp_path / 'recordings' / 'google_bssid.jsonl').read_text()
+
+    # Replayed on a machine without the key configured
+    engine = stub_engine(load_recordings(str(tmp_path / 'recordings')))
+    assert engine.query(PROVIDERS['google_bssid'], '00:11:22:33:44:55') == {
+        'module': 'google', 'bssid': '00:11:22:33:44:55', 'latitude': 40.4, 'longitude': -3.7}
@@ -0,0 +1,33 @@
+import threading
+
+from helpers.scan import RATE_LIMITED_APS, locate_scan
+
+
+def test_rate_limited_providers_query_strongest_aps_in_turn(stub_engine, monkeypatch):
+    engine = stub_engine(config={'rate_limits': {'wigle_bssid': 1000}})
+    scan = [(f'00:11:22:33:44:{index:02x}', -30.0 - index) for index in range(3 * RATE_LIMITED_APS)]
+    lock = threading.Lock()
+    running = {'wigle_bssid': 0}
+    most = {'wigle_bssid': 0}
+    queried = {}
+    query = engine.query
+
+    def counting_query(provider, bssid, use_cache=True):
+        with lock:
+            queried.setdefault(provider.name, []).append(bssid)
+            running[provider.name] = running.get(provider.name, 0) + 1
+            most[provider.name] = max(most.get(provider.name, 0), running[provider.name])
+        try:
+            return query(provider, bssid, use_cache)
+        finally:
+            with lock:
+                running[provider.name] -= 1
+
+    monkeypatch.setattr(engine, 'query', counting_query)
+    position, ap_results = locate_scan(scan, exclude=['store', 'google', 'combain'], engine=engine)
+    assert position['error'] == 'None of the access points could be located'
+    assert set(ap_results) == {bssid for bssid, _ in scan}
+    # Wigle only sees the strongest APs, one request at a time
+    assert queried['wigle_bssid'] == [bssid for bssid, _ in scan[:RATE_LIMITED_APS]]
+    assert most['wigle_bssid'] == 1
+    assert sorted(queried['mylnikov_bssid']) == sorted(bssid for bssid, _ in scan)
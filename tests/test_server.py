@@ -0,0 +1,107 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from helpers.server import LookupService, create_server
+
+
+@pytest.fixture
+def lookup_server():
+    """Returns a function serving a LookupService over HTTP, returning its base URL."""
+    servers = []
+
+    def create(search, **options):
+        service = LookupService(search, **options)
+        server = create_server(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append((server, service))
+        return service, f'http://127.0.0.1:{server.server_address[1]}'
+
+    yield create
+    for server, service in servers:
+        server.shutdown()
+        server.server_close()
+        service.executor.shutdown()
+
+
+def request(url, body=None):
+    """Sends a request, returns the status code and the decoded JSON answer."""
+    data = json.dumps(body).encode() if isinstance(body, (dict, list)) else body
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data), timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def located(bssid=None, ssid=None):
+    return [{'module': 'stub', 'bssid': bssid, 'ssid': ssid, 'latitude': 40.4, 'longitude': -3.7}]
+
+
+def test_concurrent_lookups(lookup_server):
+    # Every lookup waits for the others, so they only complete if they run at the same time
+    barrier = threading.Barrier(4, timeout=5)
+
+    def search(**query):
+        barrier.wait()
+        return located(**query)
+
+    service, url = lookup_server(search, client_limit=4)
+    bssids = [f'00:11:22:33:44:0{index}' for index in range(4)]
+    with ThreadPoolExecutor(4) as executor:
+        answers = list(executor.map(lambda bssid: request(f'{url}/lookup?bssid={bssid}'), bssids))
+    assert [status for status, _ in answers] == [200] * 4
+    assert [results[0]['bssid'] for _, results in answers] == bssids
+
+    barrier.reset()
+    status, output = request(f'{url}/batch', {'bssids': bssids})
+    assert status == 200
+    assert [entry['bssid'] for entry in output] == bssids
+    assert service.metrics['lookups_bssid'] == 8
+
+
+def test_client_limit(lookup_server):
+    started = threading.Event()
+    release = threading.Event()
+
+    def search(**query):
+        started.set()
+        release.wait(5)
+        return located(**query)
+
+    service, url = lookup_server(search, client_limit=1)
+    with ThreadPoolExecutor(1) as executor:
+        first = executor.submit(request, f'{url}/lookup?bssid=00:11:22:33:44:55')
+        assert started.wait(5)
+        assert request(f'{url}/lookup?bssid=00:11:22:33:44:66') == (429, {'error': 'Too many concurrent requests'})
+        release.set()
+        assert first.result()[0] == 200
+    assert service.metrics['rejected_requests'] == 1
+    # Clients without requests in flight are forgotten
+    assert not service._in_flight
+    assert request(f'{url}/lookup?bssid=00:11:22:33:44:66')[0] == 200
+
+
+def test_error_responses(lookup_server):
+    def search(**query):
+        if query.get('ssid') == 'broken':
+            raise RuntimeError('Provider table missing')
+        return located(**query)
+
+    service, url = lookup_server(search, client_limit=1)
+    assert request(f'{url}/lookup?ssid=broken') == (500, {'module': 'server', 'error': 'Provider table missing'})
+    assert request(f'{url}/lookup') == (400, {'error': 'A bssid or ssid parameter is required'})
+    assert request(f'{url}/batch', b'{not json')[0] == 400
+    # Failed lookups of a batch are reported per query
+    status, output = request(f'{url}/batch', {'ssids': ['broken', 'home']})
+    assert status == 200
+    assert output[0]['results'] == [{'module': 'server', 'error': 'Provider table missing'}]
+    assert output[1]['results'][0]['ssid'] == 'home'
+    # The slot of the failed request was released
+    assert request(f'{url}/lookup?ssid=home')[0] == 200
+    assert service.metrics['server_errors'] == 1
+    assert not service._in_flight
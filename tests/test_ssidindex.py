@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+from helpers.ssidindex import NO_BSSID, SSIDIndex, edit_distance, write_index
+
+ENTRIES = [
+    ('HomeNet', 1, 404000000, -37000000, 0),
+    ('HomeNet', 2, 404000100, -37000100, 1),
+    ('homenet-5G', 3, 404000200, -37000200, 0),
+    ('Office', 4, 515000000, -1000000, 2),
+    ('Café Wi-Fi', NO_BSSID, 488000000, 23000000, 3),
+    ('FreeWifi', 5, 488500000, 23500000, 1),
+]
+
+
+def levenshtein(first, second):
+    row = list(range(len(second) + 1))
+    for i, char in enumerate(first, 1):
+        previous, row[0] = row[0], i
+        for j, other in enumerate(second, 1):
+            previous, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, previous + (char != other))
+    return row[-1]
+
+
+def test_edit_distance_matches_dynamic_programming():
+    generator = random.Random(7)
+    for _ in range(2000):
+        query = ''.join(generator.choice('abc') for _ in range(generator.randint(0, 70)))
+        text = ''.join(generator.choice('abc') for _ in range(generator.randint(0, 70)))
+        assert edit_distance(query)(text) == levenshtein(query, text)
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / 'ssids.gwi')
+    write_index(path, ENTRIES)
+    return SSIDIndex(path)
+
+
+def test_index_file_round_trip(index):
+    assert len(index) == 5
+    assert sorted(index.entries()) == sorted(ENTRIES)
+    result = index.search('café wi-fi')[0]
+    assert result == {'module': 'index', 'ssid': 'Café Wi-Fi', 'latitude': 48.8, 'longitude': 2.3,
+                      'source': result['source']}
+
+
+def test_index_match_modes(index):
+    def ssids(query, mode, **options):
+        return sorted({result['ssid'] for result in index.search(query, mode, **options)})
+
+    assert ssids('homenet', 'exact') == ['HomeNet']
+    assert ssids('home', 'prefix') == ['HomeNet', 'homenet-5G']
+    assert ssids('wi', 'prefix') == []
+    assert ssids('fr', 'prefix') == ['FreeWifi']
+    assert ssids('wif', 'substring') == ['FreeWifi']
+    assert ssids('offic', 'fuzzy', max_distance=1) == ['Office']
+    with pytest.raises(ValueError):
+        index.search('fi', 'substring')
+
+
+def test_log_entries_are_searched_and_merged(index):
+    index.append([('Office', 6, 1, 2, 0), ('Offline', 7, 3, 4, 0)])
+    assert sorted(result['bssid'] for result in index.search('off', 'prefix')) == [
+        '00:00:00:00:00:04', '00:00:00:00:00:06', '00:00:00:00:00:07']
+    index.merge()
+    assert index.log == [] and len(index) == 6
+    reopened = SSIDIndex(index.path)
+    assert sorted(result['bssid'] for result in reopened.search('off', 'prefix')) == [
+        '00:00:00:00:00:04', '00:00:00:00:00:06', '00:00:00:00:00:07']
@@ -0,0 +1,46 @@
+from helpers.bssid import int_to_bssid
+from helpers.store import Position, PositionStore, module_mask, store_results, write_store
+
+
+def position(key, lat=404000000, lon=-37000000, modules=None, flags=0):
+    return Position(key, lat, lon, 1700000000 + key, module_mask(['apple']) if modules is None else modules,
+                    spread=key % 100, flags=flags)
+
+
+def fields(item):
+    return tuple(getattr(item, name) for name in Position.__slots__)
+
+
+def test_store_file_round_trip(tmp_path):
+    path = str(tmp_path / 'positions.gws')
+    positions = [position(key * 7919, lat=key * 1000, lon=-key * 1000, flags=key % 3) for key in range(1, 500)]
+    write_store(path, positions)
+    store = PositionStore(path)
+    assert len(store) == len(positions)
+    assert [fields(item) for item in store] == [fields(item) for item in positions]
+    assert fields(store.get(7919 * 42)) == fields(positions[41])
+    assert store.get(1) is None
+    assert [item and item.key for item in store.get_many([7919, 2, 7919 * 499])] == [7919, None, 7919 * 499]
+
+
+def test_log_survives_reopen_and_merge(tmp_path):
+    path = str(tmp_path / 'positions.gws')
+    write_store(path, [position(1), position(3)])
+    store = PositionStore(path, check_interval=0)
+    store.append([position(2), position(3, lat=1)])
+    # A second process reads the log of the first one
+    other = PositionStore(path, check_interval=0)
+    assert [(item.key, item.lat) for item in other] == [(1, 404000000), (2, 404000000), (3, 1)]
+    store.merge()
+    assert store.log == {}
+    assert [(item.key, item.lat) for item in PositionStore(path)] == [(1, 404000000), (2, 404000000), (3, 1)]
+    # The reader notices the merge on its next lookup
+    assert other.get(3).lat == 1 and len(other) == 3
+
+
+def test_store_results_merges_module_masks(tmp_path):
+    store = PositionStore(str(tmp_path / 'positions.gws'), check_interval=0)
+    bssid = int_to_bssid(5)
+    store_results(store, [{'module': 'apple', 'bssid': bssid, 'latitude': 1.0, 'longitude': 2.0}])
+    store_results(store, [{'module': 'wigle', 'bssid': bssid, 'latitude': 1.0, 'longitude': 2.0}])
+    assert sorted(store.lookup(bssid)['sources']) == ['apple', 'wigle']